@@ -0,0 +1,128 @@
+from pathlib import Path
+import os
+import time
+import numpy as np
+from nano_vectordb import NanoVectorDB
+from src.app.util.ann_index import IVFIndex, attach_full_precision, default_nlist, top_rows, _normalise
+from src.app.util import vector_quant
+
+def load_vdb_matrix(working_dir, namespace, embedding_dim):
+    storage_file = Path(working_dir) / f"vdb_{namespace}.json"
+    client = NanoVectorDB(embedding_dim, storage_file=str(storage_file))
+    # Quantized vector DBs keep their vectors in the .f32 file only.
+    attach_full_precision(client._NanoVectorDB__storage, working_dir)
+    return np.asarray(client._NanoVectorDB__storage["matrix"], dtype=np.float32)
+
+def exact_top_k(matrix, query, top_k):
+    scores = matrix @ query
+    top = np.argpartition(-scores, top_k - 1)[:top_k]
+    return top[np.argsort(-scores[top])]
+
+def percentile_ms(latencies, q):
+    return float(np.percentile(latencies, q) * 1000) if latencies else 0.0
+
+def sample_queries(matrix, num_queries, noise, seed):
+    rng = np.random.default_rng(seed)
+    queries = matrix[rng.choice(len(matrix), num_queries, replace=len(matrix) < num_queries)]
+    return _normalise(queries + rng.normal(scale=noise / np.sqrt(matrix.shape[1]), size=queries.shape)).astype(np.float32)
+
+def ann_benchmark(working_dir, namespace="entities", embedding_dim=3072, top_k=10, num_queries=200,
+                  nprobes=(1, 2, 4, 8, 16, 32), noise=0.05, seed=0):
+    """
+    Compare the IVF index with the exact cosine scan on one vector DB of a KG: recall@k and p50/p99 latency per nprobe.
+    Queries are stored vectors with Gaussian noise, so their neighbourhoods resemble real entity/chunk lookups.
+    """
+    matrix = load_vdb_matrix(working_dir, namespace, embedding_dim)
+    if len(matrix) <= top_k:
+        return {"namespace": namespace, "vectors": len(matrix), "error": "not enough vectors"}
+    queries = sample_queries(matrix, num_queries, noise, seed)
+
+    start = time.perf_counter()
+    index = IVFIndex.build(matrix, default_nlist(len(matrix)), iterations=int(os.getenv("ann_kmeans_iterations", "10")))
+    build_seconds = time.perf_counter() - start
+
+    exact_latencies, exact_results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        exact_results.append(set(exact_top_k(matrix, query, top_k).tolist()))
+        exact_latencies.append(time.perf_counter() - start)
+    results = [{
+        "method": "exact",
+        "nprobe": None,
+        f"recall@{top_k}": 1.0,
+        "p50_ms": percentile_ms(exact_latencies, 50),
+        "p99_ms": percentile_ms(exact_latencies, 99),
+    }]
+    for nprobe in nprobes:
+        latencies, recalls = [], []
+        for query, expected in zip(queries, exact_results):
+            start = time.perf_counter()
+            rows, _ = index.search(matrix, query, top_k, nprobe)
+            latencies.append(time.perf_counter() - start)
+            recalls.append(len(expected & set(rows.tolist())) / top_k)
+        results.append({
+            "method": "ivf",
+            "nprobe": nprobe,
+            f"recall@{top_k}": float(np.mean(recalls)),
+            "p50_ms": percentile_ms(latencies, 50),
+            "p99_ms": percentile_ms(latencies, 99),
+        })
+    return {
+        "namespace": namespace,
+        "vectors": len(matrix),
+        "nlist": index.nlist,
+        "build_seconds": build_seconds,
+        "results": results,
+    }
+
+def quantization_report(working_dir, namespace="entities", embedding_dim=3072, top_k=10, num_queries=200,
+                        precisions=("float16", "int8", "pq"), rescore_factor=None, noise=0.05, seed=0):
+    """
+    Memory saved and recall@k lost per vector precision on one vector DB of a KG, against the exact float32 scan,
+    both scoring with the codes only and with the best top_k * rescore_factor candidates rescored in float32.
+    Queries are stored vectors with Gaussian noise (sample_queries), not real user queries.
+    """
+    matrix = load_vdb_matrix(working_dir, namespace, embedding_dim)
+    if len(matrix) <= top_k:
+        return {"namespace": namespace, "vectors": len(matrix), "error": "not enough vectors"}
+    if rescore_factor is None:
+        rescore_factor = max(1, vector_quant.rescore_factor())
+    queries = sample_queries(matrix, num_queries, noise, seed)
+    all_rows = np.arange(len(matrix))
+    expected = [set(exact_top_k(matrix, query, top_k).tolist()) for query in queries]
+    float32_bytes = matrix.astype(np.float32).nbytes
+    results = [{
+        "precision": "float32",
+        "bytes": float32_bytes,
+        "bytes_per_vector": float32_bytes / len(matrix),
+        "memory_saved": 0.0,
+        f"recall@{top_k}": 1.0,
+        f"recall@{top_k}_rescored": 1.0,
+    }]
+    for precision in precisions:
+        start = time.perf_counter()
+        codec = vector_quant.encode(matrix, precision)
+        encode_seconds = time.perf_counter() - start
+        recalls, rescored_recalls = [], []
+        for query, exact in zip(queries, expected):
+            scores = codec.score(query)
+            rows, _ = top_rows(all_rows, scores, top_k)
+            recalls.append(len(exact & set(rows.tolist())) / top_k)
+            rows, _ = top_rows(all_rows, scores, top_k * rescore_factor)
+            rows, _ = top_rows(rows, matrix[rows] @ query, top_k)
+            rescored_recalls.append(len(exact & set(rows.tolist())) / top_k)
+        results.append({
+            "precision": precision,
+            "bytes": codec.nbytes,
+            "bytes_per_vector": codec.nbytes / len(matrix),
+            "memory_saved": 1 - codec.nbytes / float32_bytes,
+            f"recall@{top_k}": float(np.mean(recalls)),
+            f"recall@{top_k}_rescored": float(np.mean(rescored_recalls)),
+            "encode_seconds": encode_seconds,
+        })
+    return {
+        "namespace": namespace,
+        "vectors": len(matrix),
+        "rescore_factor": rescore_factor,
+        "results": results,
+    }
@@ -1,8 +1,9 @@
 from pathlib import Path
-import networkx as nx
 import pandas as pd
 from itertools import combinations
 import json
+import os
+from src.app.util import graphml_utils, entity_blocking
 
 ROOT = Path(__file__).resolve().parent.parent.parent.parent.parent
 GRAPHRAG_ROOT = Path(__file__).resolve().parent.parent.parent.parent.parent.parent
@@ -21,26 +22,51 @@ VERSION_MAPPING = {
     "LongBench": ["1", "2", "3"]
 }
 
-def jaccard_lightrag(graph1_path, graph2_path):
+def read_lightrag_graph(graph_path):
+    """Node ids and (u, v, relationship_type) edges of a LightRAG GraphML file, read in one streaming pass."""
+    node_order: dict[str, int] = {}
+    edges = set()
+    for tag, attrs in graphml_utils.iter_graphml(graph_path):
+        if tag == "node":
+            node_order.setdefault(attrs["id"], len(node_order))
+            continue
+        u, v = attrs["source"], attrs["target"]
+        # Orient undirected edges by node insertion order, as networkx's edge iteration does.
+        if node_order.get(v, len(node_order)) < node_order.get(u, len(node_order)):
+            u, v = v, u
+        edges.add((u, v, attrs.get("relationship_type", "")))
+    return set(node_order), edges
+
+def blocked_jaccard(nodes1, edges1, nodes2, edges2):
+    """Node and edge Jaccard after collapsing near-duplicate entity names of both graphs with the LSH blocking index."""
+    proposals = entity_blocking.propose_merges(
+        nodes1 | nodes2, threshold=float(os.getenv("entity_blocking_threshold", "0.8"))
+    )
+    canonical = entity_blocking.cluster_proposals(proposals)
+
+    def canonical_nodes(nodes):
+        return {canonical.get(n, n) for n in nodes}
+
+    def canonical_edges(edges):
+        return {(*sorted((canonical.get(u, u), canonical.get(v, v))), t) for u, v, t in edges}
+
+    nodes1, nodes2 = canonical_nodes(nodes1), canonical_nodes(nodes2)
+    edges1, edges2 = canonical_edges(edges1), canonical_edges(edges2)
+    node_jaccard = len(nodes1 & nodes2) / len(nodes1 | nodes2) if nodes1 or nodes2 else 0.0
+    edge_jaccard = len(edges1 & edges2) / len(edges1 | edges2) if edges1 or edges2 else 0.0
+    return {"blocked_node_jaccard": node_jaccard, "blocked_edge_jaccard": edge_jaccard}
+
+def jaccard_lightrag(graph1_path, graph2_path, with_blocking=False):
     try:
-        g1 = nx.read_graphml(graph1_path)
-        g2 = nx.read_graphml(graph2_path)
-        
-        nodes1 = set(g1.nodes())
-        nodes2 = set(g2.nodes())
+        nodes1, edges1 = read_lightrag_graph(graph1_path)
+        nodes2, edges2 = read_lightrag_graph(graph2_path)
         node_jaccard = len(nodes1 & nodes2) / len(nodes1 | nodes2) if nodes1 or nodes2 else 0.0
-        
-        edges1 = set(
-            (u, v, d.get("relationship_type", "")) 
-            for u, v, d in g1.edges(data=True)
-        )
-        edges2 = set(
-            (u, v, d.get("relationship_type", "")) 
-            for u, v, d in g2.edges(data=True)
-        )
         edge_jaccard = len(edges1 & edges2) / len(edges1 | edges2) if edges1 or edges2 else 0.0
         
-        return {"node_jaccard": node_jaccard, "edge_jaccard": edge_jaccard}
+        scores = {"node_jaccard": node_jaccard, "edge_jaccard": edge_jaccard}
+        if with_blocking:
+            scores.update(blocked_jaccard(nodes1, edges1, nodes2, edges2))
+        return scores
     except Exception as e:
         print(f"Error processing LightRAG files: {graph1_path}, {graph2_path}")
         print(f"Error: {e}")
@@ -105,6 +131,8 @@ def find_graphrag_paths():
 
 def calculate_all_jaccard_scores(dataset, scenario):
     results = []
+    # With entity_blocking=on, LightRAG graphs are also compared after collapsing near-duplicate entity names.
+    with_blocking = entity_blocking.entity_blocking_enabled()
     
     # Jigsaw-LightRAG and Vanilla-LightRAG
     lightrag_paths = find_lightrag_paths()
@@ -117,7 +145,7 @@ def calculate_all_jaccard_scores(dataset, scenario):
                     path1 = lightrag_paths[dataset][framework][scenario][ver1]
                     path2 = lightrag_paths[dataset][framework][scenario][ver2]
                     
-                    scores = jaccard_lightrag(path1, path2)
+                    scores = jaccard_lightrag(path1, path2, with_blocking=with_blocking)
                     
                     results.append({
                         "dataset": dataset,
@@ -126,6 +154,8 @@ def calculate_all_jaccard_scores(dataset, scenario):
                         "comparison": f"{ver1}-vs-{ver2}",
                         "node_jaccard": scores["node_jaccard"],
                         "edge_jaccard": scores["edge_jaccard"],
+                        "blocked_node_jaccard": scores.get("blocked_node_jaccard"),
+                        "blocked_edge_jaccard": scores.get("blocked_edge_jaccard"),
                         "entity_jaccard": None,
                         "relation_jaccard": None
                     })
@@ -149,6 +179,8 @@ def calculate_all_jaccard_scores(dataset, scenario):
                     "comparison": f"{ver1}-vs-{ver2}",
                     "node_jaccard": None,
                     "edge_jaccard": None,
+                    "blocked_node_jaccard": None,
+                    "blocked_edge_jaccard": None,
                     "entity_jaccard": scores["entity_jaccard"],
                     "relation_jaccard": scores["relation_jaccard"]
                 })
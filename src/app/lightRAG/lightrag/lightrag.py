@@ -3,6 +3,202 @@ The corresponding source code in LightRAG V1.0.1 is omitted here.
 You can download and compile the framework yourself and then integrate the ainsert_custom_kg method provided by this method.
 '''
 
+# Strict string-matching merge rules of Phase 2, shared by ainsert_custom_kg and the incremental ledger replay.
+def merge_custom_entity(old_node_data: dict | None, node_data: dict) -> dict:
+    if old_node_data is None:
+        return node_data
+    entity_type = node_data["entity_type"]
+    if entity_type != old_node_data.get("entity_type"):
+        entity_type = f"{entity_type}<SEP>{old_node_data.get('entity_type')}"
+    return {
+        "entity_type": entity_type,
+        "description": f"{old_node_data.get('description')}<SEP>{node_data['description']}",
+        "source_id": f"{old_node_data.get('source_id')}<SEP>{node_data['source_id']}",
+    }
+
+
+def merge_custom_relationship(old_edge_data: dict | None, edge_data: dict, source_chunk_id: str) -> dict:
+    if old_edge_data is None:
+        return edge_data
+    return {
+        "weight": edge_data["weight"],
+        "keywords": f"{old_edge_data.get('keywords')}<SEP>{edge_data['keywords']}",
+        "description": f"{old_edge_data.get('description')}<SEP>{edge_data['description']}",
+        "source_id": f"{old_edge_data.get('source_id')}<SEP>{source_chunk_id}",
+    }
+
+
+def _add_fragments(fragments: dict[str, None], value):
+    # dict keys act as an insertion-ordered set, so byte-identical fragments are kept once.
+    for fragment in str(value).split("<SEP>"):
+        if fragment:
+            fragments.setdefault(fragment)
+
+
+def _join_fragments(fragments: dict[str, None], fragment_cap: int = 0) -> str:
+    values = list(fragments)
+    if 0 < fragment_cap < len(values):
+        values = values[:fragment_cap]
+    return "<SEP>".join(values)
+
+
+class EntityAccumulator:
+    """Merge state of one entity: deduplicated fragments, joined only once when materialised."""
+
+    __slots__ = ("entity_types", "descriptions", "source_ids")
+
+    def __init__(self):
+        self.entity_types: dict[str, None] = {}
+        self.descriptions: dict[str, None] = {}
+        self.source_ids: dict[str, None] = {}
+
+    def add(self, node_data: dict):
+        _add_fragments(self.entity_types, node_data["entity_type"])
+        _add_fragments(self.descriptions, node_data["description"])
+        _add_fragments(self.source_ids, node_data["source_id"])
+
+    def materialise(self, fragment_cap: int = 0) -> dict:
+        return {
+            # Newest type first, like the string-concatenating merge.
+            "entity_type": "<SEP>".join(reversed(self.entity_types)),
+            "description": _join_fragments(self.descriptions, fragment_cap),
+            "source_id": _join_fragments(self.source_ids),
+        }
+
+
+class RelationshipAccumulator:
+    """Merge state of one relationship, see EntityAccumulator."""
+
+    __slots__ = ("src_id", "tgt_id", "weight", "keywords", "descriptions", "source_ids")
+
+    def __init__(self):
+        self.src_id = None
+        self.tgt_id = None
+        self.weight = None
+        self.keywords: dict[str, None] = {}
+        self.descriptions: dict[str, None] = {}
+        self.source_ids: dict[str, None] = {}
+
+    def add(self, edge_data: dict, source_chunk_id: str):
+        if self.src_id is None:
+            # The first occurrence keeps its edge_data source_id, like merge_custom_relationship.
+            self.src_id, self.tgt_id = edge_data["src_id"], edge_data["tgt_id"]
+            source_chunk_id = edge_data["source_id"]
+        self.weight = edge_data["weight"]
+        _add_fragments(self.keywords, edge_data["keywords"])
+        _add_fragments(self.descriptions, edge_data["description"])
+        _add_fragments(self.source_ids, source_chunk_id)
+
+    def materialise(self, fragment_cap: int = 0) -> dict:
+        return {
+            "src_id": self.src_id,
+            "tgt_id": self.tgt_id,
+            "weight": self.weight,
+            "keywords": _join_fragments(self.keywords),
+            "description": _join_fragments(self.descriptions, fragment_cap),
+            "source_id": _join_fragments(self.source_ids),
+        }
+
+
+def materialise_custom_kg_maps(
+    all_entities_map: dict,
+    all_relationships_map: dict,
+    fragment_cap: int = 0,
+    summary_queue: list = None,
+) -> None:
+    """
+    Replace accumulators in the maps by their joined node/edge data, in place.
+    Descriptions are cut to fragment_cap fragments (0 = no cap). With a summary_queue, the full fragment list of every
+    capped entity or relationship is queued as (kind, key, fragments) for summarisation.
+    """
+    for kind, items in (("entities", all_entities_map), ("relationships", all_relationships_map)):
+        for key, value in items.items():
+            if not isinstance(value, (EntityAccumulator, RelationshipAccumulator)):
+                continue
+            if summary_queue is not None and 0 < fragment_cap < len(value.descriptions):
+                summary_queue.append((kind, key, list(value.descriptions)))
+            items[key] = value.materialise(fragment_cap)
+
+
+def record_contribution(contributions: dict, doc_id: str, kind: str, key: str, data):
+    """Track which subgraph (doc_id) contributed each fragment, so it can be removed again without a rebuild."""
+    contributions.setdefault(kind, {}).setdefault(key, []).append([doc_id, data])
+    doc_keys = contributions.setdefault("docs", {}).setdefault(
+        doc_id, {"entities": [], "relationships": [], "chunks": []}
+    )
+    doc_keys[kind].append(key)
+
+
+def fold_custom_entity(all_entities_map: dict, entity_data: dict, accumulate: bool = False) -> tuple[str, dict]:
+    """Merge one subgraph entity into all_entities_map, return its name and the node data it contributed."""
+    entity_name = entity_data["entity_name"]
+    entity_type = entity_data.get("entity_type", "UNKNOWN")
+    description = entity_data.get("description", "No description provided")
+    source_chunk_id = entity_data.get("source_id", "UNKNOWN")
+    node_data: dict[str, str] = {
+        "entity_type": entity_type,
+        "description": description,
+        "source_id": source_chunk_id,
+    }
+    if accumulate:
+        # Accumulators are materialised once by materialise_custom_kg_maps.
+        all_entities_map.setdefault(entity_name, EntityAccumulator()).add(node_data)
+    else:
+        all_entities_map[entity_name] = merge_custom_entity(
+            all_entities_map.get(entity_name), node_data
+        )
+    return entity_name, node_data
+
+
+def undirected_relationship_key(src_id: str, tgt_id: str) -> str:
+    """The same key for both directions of a relationship, e.g. to shard them together."""
+    return "######".join(sorted((src_id, tgt_id)))
+
+
+def fold_custom_relationship(
+    all_relationships_map: dict,
+    relationship_data: dict,
+    source_id: str,
+    accumulate: bool = False,
+    undirected: bool = False,
+) -> tuple[str, dict, str]:
+    """
+    Merge one subgraph relationship into all_relationships_map. With undirected (incremental Phase 2), a relationship
+    whose reverse direction is already in the map folds into that key, so the ledger can replay the undirected edge;
+    otherwise both directions keep their own key and the later upsert overwrites the edge, as in the full merge.
+    source_id is the last chunk source_id of the subgraph, which a first occurrence keeps as its source_id.
+    Returns the relationship key, the edge data it contributed and its source chunk id.
+    """
+    src_id = relationship_data["src_id"]
+    tgt_id = relationship_data["tgt_id"]
+    description = relationship_data["description"]
+    keywords = relationship_data["keywords"]
+    weight = relationship_data.get("weight", 1.0)
+    source_chunk_id = relationship_data.get("source_id", "UNKNOWN")
+
+    edge_data: dict[str, str] = {
+        "src_id": src_id,
+        "tgt_id": tgt_id,
+        "description": description,
+        "keywords": keywords,
+        "source_id": source_id,
+        "weight": weight,
+    }
+    relationship_key = f"{src_id}######{tgt_id}"
+    reverse_key = f"{tgt_id}######{src_id}"
+    if undirected and relationship_key not in all_relationships_map and reverse_key in all_relationships_map:
+        relationship_key = reverse_key
+    if accumulate:
+        all_relationships_map.setdefault(
+            relationship_key, RelationshipAccumulator()
+        ).add(edge_data, source_chunk_id)
+    else:
+        all_relationships_map[relationship_key] = merge_custom_relationship(
+            all_relationships_map.get(relationship_key), edge_data, source_chunk_id
+        )
+    return relationship_key, edge_data, source_chunk_id
+
+
 # Highlight the Phase 2 global KG aggregation logic, need a full version of LightRAG V1.0.1 to enable this method.
 async def ainsert_custom_kg(
         self,
@@ -11,8 +207,13 @@ async def ainsert_custom_kg(
         all_relationships_map: dict[str, dict],
         full_doc_id: str = None,
         file_path: str = "custom_kg",
+        defer_graph_upsert: bool = False,
+        contributions: dict = None,
+        accumulate: bool = False,
+        undirected: bool = False,
     ) -> None:
         try:
+            doc_id = custom_kg.get("source_id")
             # Insert chunks into vector storage
             all_chunks_data: dict[str, dict[str, str]] = {}
             chunk_to_source_map: dict[str, str] = {}
@@ -46,6 +247,8 @@ async def ainsert_custom_kg(
                 )
                 all_chunks_data[chunk_id] = chunk_entry
                 chunk_to_source_map[source_id] = chunk_id
+                if contributions is not None:
+                    record_contribution(contributions, doc_id, "chunks", chunk_id, None)
 
             if all_chunks_data:
                 await asyncio.gather(
@@ -54,65 +257,33 @@ async def ainsert_custom_kg(
 
             # Insert entities into knowledge graph
             for entity_data in custom_kg.get("entities", []):
-                entity_name = entity_data["entity_name"]
-                entity_type = entity_data.get("entity_type", "UNKNOWN")
-                description = entity_data.get("description", "No description provided")
-                source_chunk_id = entity_data.get("source_id", "UNKNOWN")
-                node_data: dict[str, str] = {
-                    "entity_type": entity_type,
-                    "description": description,
-                    "source_id": source_chunk_id,
-                }
-                if entity_name not in all_entities_map:
-                    all_entities_map[entity_name] = node_data
-                else:
-                    old_node_data = all_entities_map[entity_name]
-                    if entity_type != old_node_data.get("entity_type"):
-                        entity_type = (
-                            f"{entity_type}<SEP>{old_node_data.get('entity_type')}"
-                        )
-                    all_entities_map[entity_name] = {
-                        "entity_type": entity_type,
-                        "description": f"{old_node_data.get('description')}<SEP>{description}",
-                        "source_id": f"{old_node_data.get('source_id')}<SEP>{source_chunk_id}",
-                    }
-                await self.chunk_entity_relation_graph.upsert_node(
-                    entity_name, node_data=all_entities_map[entity_name]
+                entity_name, node_data = fold_custom_entity(
+                    all_entities_map, entity_data, accumulate
                 )
+                if contributions is not None:
+                    record_contribution(contributions, doc_id, "entities", entity_name, node_data)
+                # In bulk mode, and for accumulators, which are joined only once by materialise_custom_kg_maps,
+                # the final nodes are written once by aupsert_custom_kg_graph.
+                if not defer_graph_upsert and not accumulate:
+                    await self.chunk_entity_relation_graph.upsert_node(
+                        entity_name, node_data=all_entities_map[entity_name]
+                    )
 
             for relationship_data in custom_kg.get("relationships", []):
-                src_id = relationship_data["src_id"]
-                tgt_id = relationship_data["tgt_id"]
-                description = relationship_data["description"]
-                keywords = relationship_data["keywords"]
-                weight = relationship_data.get("weight", 1.0)
-                source_chunk_id = relationship_data.get("source_id", "UNKNOWN")
-
-                edge_data: dict[str, str] = {
-                    "src_id": src_id,
-                    "tgt_id": tgt_id,
-                    "description": description,
-                    "keywords": keywords,
-                    "source_id": source_id,
-                    "weight": weight,
-                }
-                relationship_key = f"{src_id}######{tgt_id}"
-                if relationship_key not in all_relationships_map:
-                    all_relationships_map[relationship_key] = edge_data
-                else:
-                    old_edge_data = all_relationships_map[relationship_key]
-                    all_relationships_map[relationship_key] = {
-                        "weight": weight,
-                        "keywords": f"{old_edge_data.get('keywords')}<SEP>{keywords}",
-                        "description": f"{old_edge_data.get('description')}<SEP>{description}",
-                        "source_id": f"{old_edge_data.get('source_id')}<SEP>{source_chunk_id}",
-                    }
-                # Insert edge into the knowledge graph
-                await self.chunk_entity_relation_graph.upsert_edge(
-                    src_id,
-                    tgt_id,
-                    edge_data=all_relationships_map[relationship_key],
+                relationship_key, edge_data, source_chunk_id = fold_custom_relationship(
+                    all_relationships_map, relationship_data, source_id, accumulate, undirected
                 )
+                if contributions is not None:
+                    record_contribution(
+                        contributions, doc_id, "relationships", relationship_key, [edge_data, source_chunk_id]
+                    )
+                # Insert edge into the knowledge graph
+                if not defer_graph_upsert and not accumulate:
+                    await self.chunk_entity_relation_graph.upsert_edge(
+                        edge_data["src_id"],
+                        edge_data["tgt_id"],
+                        edge_data=all_relationships_map[relationship_key],
+                    )
 
             new_docs = {
                 custom_kg.get("source_id"): {
@@ -125,4 +296,36 @@ async def ainsert_custom_kg(
 
         except Exception as e:
             print(f"Error in ainsert_custom_kg: {e}")
-            raise
\ No newline at end of file
+            raise
+
+# Bulk merge mode: write the final state of a whole base_entry once, after every subgraph was folded into the maps.
+async def aupsert_custom_kg_graph(
+        self,
+        all_entities_map: dict[str, dict],
+        all_relationships_map: dict[str, dict],
+    ) -> None:
+        graph = getattr(self.chunk_entity_relation_graph, "_graph", None)
+        if graph is not None:
+            # NetworkXStorage: one batched insert instead of an awaited upsert per entity and relationship.
+            graph.add_nodes_from(all_entities_map.items())
+            edges = []
+            for relationship_key, edge_data in all_relationships_map.items():
+                src_id, tgt_id = relationship_key.split("######", 1)
+                # The first upsert of an edge always carried src_id/tgt_id, keep them like the per-item path does.
+                edges.append((src_id, tgt_id, {"src_id": src_id, "tgt_id": tgt_id, **edge_data}))
+            graph.add_edges_from(edges)
+            return
+        await asyncio.gather(
+            *[
+                self.chunk_entity_relation_graph.upsert_node(entity_name, node_data=node_data)
+                for entity_name, node_data in all_entities_map.items()
+            ]
+        )
+        await asyncio.gather(
+            *[
+                self.chunk_entity_relation_graph.upsert_edge(
+                    *relationship_key.split("######", 1), edge_data=edge_data
+                )
+                for relationship_key, edge_data in all_relationships_map.items()
+            ]
+        )
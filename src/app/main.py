@@ -8,11 +8,14 @@ from contextlib import asynccontextmanager
 from src.app.router import (
     jigsaw_api
 )
+from src.app.util import http_client, db_utils
 
 @asynccontextmanager
 async def lifespan(_app: FastAPI):
     await startup_event()
-    yield
+    # Process-wide pooled HTTP client for LLM and embedding calls, closed cleanly on shutdown.
+    async with http_client.pooled_client():
+        yield
     await shutdown_event()
 
 app = FastAPI(
@@ -24,7 +27,8 @@ app.include_router(jigsaw_api.router)
 
 async def startup_event():
     print("lifespan")
-    pass
+    # Columns added to existing tables, e.g. request_token.cached.
+    db_utils.migrate_schema()
 
 async def shutdown_event():
     print("Performing clean shutdown...")
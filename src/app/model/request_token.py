@@ -11,6 +11,8 @@ class RequestToken(Base):
     req_type = Column(NVARCHAR(20), comment="req_type")
     completion_tokens = Column(Integer, comment="completion_tokens")
     prompt_tokens = Column(Integer, comment="prompt_tokens")
+    # 1 when the response was served from the LLM response cache, tokens are the original call's usage.
+    cached = Column(Integer, server_default=text("0"), comment="cached")
     create_at = Column(
         DateTime(),
         server_default=text("CURRENT_TIMESTAMP"),
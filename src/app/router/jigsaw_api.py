@@ -1,16 +1,23 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
 from src.app.service import lightRAG_service, jigsaw_service
+from src.app.util import subgraph_pool
+from src.app.util.kg_registry import KGNotFound
 from pydantic import BaseModel
 import os
+import json
 
 from src.app.benchmark.dataset_exp import dataset_exp as batch_qa_exp
 from src.app.benchmark.jaccard_eval import calculate_all_jaccard_scores as jaccard_exp
 from src.app.benchmark.dataset_prf_evaluation import prf_eval as precision_recall_f1_eval
 from src.app.benchmark.semantic_llm_judge import evaluate_dataset as llm_judge_eval
+from src.app.benchmark.ann_benchmark import ann_benchmark, quantization_report
 
 class RequestBody(BaseModel):
     query: str
     qa_id: int
+    # KG to answer from, the service's SERVING_BASE_ENTRY when not given.
+    base_entry: str | None = None
 
 router = APIRouter(
     tags=["Jigsaw_lightRAG"],
@@ -19,18 +26,56 @@ router = APIRouter(
 
 # Default QA method, query from KG and summarize the actual answer.
 @router.post("/search")
-def search_public(requestBody: RequestBody):
+async def search_public(requestBody: RequestBody):
     requestBody = requestBody.model_dump()
-    result = lightRAG_service.search_public(requestBody.get('query'))
+    try:
+        result = await lightRAG_service.asearch_public(requestBody.get('query'), requestBody.get('base_entry'))
+    except KGNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except lightRAG_service.SearchOverloaded as e:
+        # Backpressure: clients retry later instead of queueing behind the in-flight limit.
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
     return {
         "data": result
     }
 
+# Streaming QA: NDJSON events, the retrieved file list first, then answer tokens as they are generated.
+@router.post("/search_stream")
+async def search_stream(requestBody: RequestBody):
+    requestBody = requestBody.model_dump()
+    try:
+        events = await lightRAG_service.astream_search(requestBody.get('query'), requestBody.get('base_entry'))
+    except KGNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except lightRAG_service.SearchOverloaded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": "1"})
+
+    async def ndjson():
+        async for event in events:
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
+
 # Generate Knowledge Graph, including Phase 1 - Subgraph processing and Phase 2 - Global KG aggregation.
 @router.get("/genKG")
 async def custom_genKG():
     await jigsaw_service.custom_genKG()
 
+# Convert the existing JSON subgraph pool (json_dir) into the memory-mappable Arrow pool (arrow_dir).
+@router.get("/convert_subgraph_pool")
+def convert_subgraph_pool():
+    result = subgraph_pool.convert_json_pool()
+    return {
+        "data": result
+    }
+
+# Runtime metrics: cache hit/miss counters, loaded KGs and other service statistics.
+@router.get("/metrics")
+def metrics():
+    return {
+        "data": lightRAG_service.get_metrics()
+    }
+
 # Batch QA test, use question and ground truth answer from dataset, save actual answer to DB.
 @router.get("/batch_qa_exp")
 def dataset_exp_api():
@@ -56,3 +101,34 @@ def prf_eval():
 @router.get("/semantic_judge")
 def semantic_judge():
     llm_judge_eval(dataset=os.getenv("dataset"), scenario=os.getenv("scenario"))
+
+# Benchmark the IVF index against the exact cosine scan on the served KG's entity and chunk vector DBs.
+@router.get("/ann_benchmark")
+def ann_benchmark_api(base_entry: str = None):
+    try:
+        working_dir = lightRAG_service.kg_working_dir(base_entry)
+    except KGNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    result = [
+        ann_benchmark(working_dir, namespace=namespace, embedding_dim=lightRAG_service.embedding_dimension)
+        for namespace in ("entities", "chunks")
+    ]
+    return {
+        "data": result
+    }
+
+# Memory saved and recall lost by float16 / int8 / product-quantized vectors of the served KG.
+# The queries are stored vectors with Gaussian noise, not real user queries, so the recall is an estimate.
+@router.get("/quantization_report")
+def quantization_report_api(base_entry: str = None):
+    try:
+        working_dir = lightRAG_service.kg_working_dir(base_entry)
+    except KGNotFound as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    result = [
+        quantization_report(working_dir, namespace=namespace, embedding_dim=lightRAG_service.embedding_dimension)
+        for namespace in ("entities", "chunks")
+    ]
+    return {
+        "data": result
+    }
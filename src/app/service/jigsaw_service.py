@@ -1,20 +1,45 @@
+import asyncio
 import json
+import multiprocessing
 import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 from typing import List
-from bs4 import BeautifulSoup, Tag
-from pathlib import Path
 
 from src.app.model.subgraph_pool_mapping import SubgraphPoolMapping
-from src.app.util import db_utils
+from src.app.util import (
+    db_utils,
+    chunk_store,
+    graphml_utils,
+    subgraph_pool,
+    kg_ledger,
+    kg_store,
+    merge_journal,
+    entity_blocking,
+    embedding_cache,
+    http_client,
+    ann_index,
+    csr_graph,
+)
 from src.app.lightRAG.lightrag.utils import compute_mdhash_id, clean_text
+from src.app.lightRAG.lightrag.lightrag import (
+    EntityAccumulator,
+    RelationshipAccumulator,
+    materialise_custom_kg_maps,
+    undirected_relationship_key,
+)
+from src.app.lightRAG.lightrag.operate import _handle_entity_relation_summary
+from src.app.service import shard_service
 from src.app.service.lightRAG_service import (
     LightRAG,
     EmbeddingFunc,
     llm_model_func,
     embedding_dimension,
     embedding_func,
-    del_KG_data,
+    AZURE_EMBEDDING_DEPLOYMENT,
+    swap_rag,
     record_query,
 )
 from dotenv import load_dotenv
@@ -24,6 +49,10 @@ from constant import ROOT
 load_dotenv()
 
 def create_single_json(rag_workspace: Path = ROOT / "single_kg"):
+    return subgraph_pool.write_subgraph(read_single_subgraph(rag_workspace))
+
+
+def read_single_subgraph(rag_workspace: Path) -> dict:
     s_doc = {"chunks": [], "entities": [], "relationships": []}
     # get content
     content_json_file = rag_workspace / "kv_store_full_docs.json"
@@ -40,18 +69,65 @@ def create_single_json(rag_workspace: Path = ROOT / "single_kg"):
         s_doc["chunks"].append(chunk)
 
     graphml_file = rag_workspace / "graph_chunk_entity_relation.graphml"
-    xml_content = get_graphml(graphml_file)
-    soup = BeautifulSoup(xml_content, "xml")
-    s_doc["entities"] = get_entity(soup.find_all("node"))
-    s_doc["relationships"] = get_edges(soup.find_all("edge"))
+    s_doc["entities"], s_doc["relationships"] = graphml_utils.read_subgraph(graphml_file)
+    return s_doc
 
-    json_file_dir = ROOT / "json_dir"
-    json_file_dir.mkdir(parents=True, exist_ok=True)
-    file_name = s_doc.get("source_id")[4:]
-    json_file = json_file_dir / Path(file_name + ".json")
-    with open(json_file, "w", encoding="utf-8") as file:
-        json.dump(s_doc, file, indent=4, ensure_ascii=False)
-    return file_name
+
+async def export_single_subgraph(
+    p_rag: LightRAG, cached_chunks: dict[str, dict] = None, extractions: dict[str, dict] = None
+):
+    """
+    Build the subgraph pool record straight from the live Phase 1 storages after ainsert,
+    instead of reading kv_store_full_docs.json, kv_store_text_chunks.json and the GraphML file back from disk.
+    extractions: the raw per-chunk extraction records of the ainsert, stored for the chunks not in cached_chunks.
+    """
+    if cached_chunks:
+        # The reused chunks skipped extraction, their cached records are merged into the graph here.
+        await chunk_store.merge_cached_chunks(p_rag, cached_chunks)
+    graph_storage = p_rag.chunk_entity_relation_graph
+    if hasattr(graph_storage, "_graph"):
+        s_doc = await read_live_subgraph(p_rag)
+    else:
+        # Only the networkx storage keeps the graph in memory.
+        s_doc = read_single_subgraph(Path(p_rag.working_dir))
+    if chunk_store.chunk_store_enabled():
+        chunk_store.store_extractions(s_doc, extractions or {}, skip=cached_chunks or {})
+    return subgraph_pool.write_subgraph(s_doc)
+
+
+async def read_live_subgraph(p_rag: LightRAG) -> dict:
+    graph_storage = p_rag.chunk_entity_relation_graph
+    s_doc = {"chunks": [], "entities": [], "relationships": []}
+    for _id in await p_rag.full_docs.all_keys():
+        s_doc["source_id"] = _id
+        s_doc.update(await p_rag.full_docs.get_by_id(_id))
+
+    s_doc["chunks"] = await get_rag_chunks(p_rag)
+
+    # Values are stringified the same way write_graphml does, so the record matches the file based export.
+    s_doc["entities"] = [
+        graphml_utils.entity_from_attrs({"id": node, **{k: str(v) for k, v in data.items()}})
+        for node, data in graph_storage._graph.nodes(data=True)
+    ]
+    s_doc["relationships"] = [
+        graphml_utils.relationship_from_attrs(
+            {"source": src, "target": tgt, **{k: str(v) for k, v in data.items()}}
+        )
+        for src, tgt, data in graph_storage._graph.edges(data=True)
+    ]
+    return s_doc
+
+
+async def get_rag_chunks(rag: LightRAG) -> list[dict]:
+    """text_chunks of a live LightRAG instance in the subgraph pool chunk layout."""
+    chunks = []
+    chunk_ids = await rag.text_chunks.all_keys()
+    for _id, chunk_data in zip(chunk_ids, await rag.text_chunks.get_by_ids(chunk_ids)):
+        chunk = {}
+        chunk["source_id"] = _id
+        chunk.update(chunk_data)
+        chunks.append(chunk)
+    return chunks
 
 
 def get_doc_content(file_path) -> dict:
@@ -66,46 +142,7 @@ def get_doc_chunks(file_path) -> dict:
         return content
 
 
-def get_entity(nodes: List[Tag]):
-    entity_list = []
-    for node in nodes:
-        entity_list.append(
-            {
-                "entity_name": node.get("id"),
-                "entity_type": node.find("data", {"key": "d0"}).text,
-                "description": node.find("data", {"key": "d1"}).text,
-                "source_id": node.find("data", {"key": "d2"}).text,
-            }
-        )
-    return entity_list
-
-
-def get_edges(nodes: List[Tag]):
-    edge_list = []
-    for node in nodes:
-        edge_list.append(
-            {
-                "src_id": node.get("source"),
-                "tgt_id": node.get("target"),
-                "weight": node.find("data", {"key": "d3"}).text,
-                "description": node.find("data", {"key": "d4"}).text,
-                "keywords": node.find("data", {"key": "d5"}).text,
-                "source_id": node.find("data", {"key": "d6"}).text,
-            }
-        )
-    return edge_list
-
-def get_graphml(file_path):
-    with open(file_path, "r", encoding="utf-8") as file:
-        return file.read()
-
-async def custom_insert(
-    working_dir: str | Path = "./custom_kg/",
-    files: List[str] = [],
-):
-    if working_dir.exists():
-        shutil.rmtree(working_dir)
-    Path(working_dir).mkdir(parents=True, exist_ok=True)
+def new_pipeline_rag(working_dir: str | Path) -> LightRAG:
     pipeline_rag = LightRAG(
         working_dir=working_dir,
         llm_model_func=llm_model_func,
@@ -115,47 +152,415 @@ async def custom_insert(
             func=embedding_func,
         ),
     )
-    all_entities_map: dict[str, dict] = {}
-    all_relationships_map: dict[str, dict] = {}
-    for file in files:
-        await pipeline_rag.ainsert_custom_kg(
-            get_custom_kg_dict(file_path=file),
-            all_entities_map=all_entities_map,
-            all_relationships_map=all_relationships_map,
+    if ann_index.vector_storage_enabled():
+        # IVF indexes and quantized codes are built when the vector DBs are flushed and published with the KG.
+        ann_index.install_ann(pipeline_rag)
+    else:
+        # Vector DBs written with vector_precision keep their vectors in the .f32 file only.
+        ann_index.restore_matrices(pipeline_rag)
+    return pipeline_rag
+
+
+async def custom_insert(
+    working_dir: str | Path = "./custom_kg/",
+    files: List[str] = [],
+    previous_dir: Path = None,
+):
+    if previous_dir is not None and kg_ledger.load_ledger(previous_dir) is not None:
+        return await incremental_insert(working_dir=working_dir, files=files, previous_dir=previous_dir)
+    working_dir = Path(working_dir)
+    # Bulk mode folds the whole base_entry into the maps first and writes the final graph once.
+    bulk_upsert = os.getenv("phase2_bulk_upsert", "off").lower() == "on"
+    accumulate = accumulate_enabled()
+    num_shards = shard_service.shard_count()
+    # Record every fragment's source subgraph, so the next run can apply only the deltas.
+    track_contributions = kg_ledger.incremental_enabled()
+    journal = None
+    if merge_journal.journal_enabled():
+        # A run is only resumed with the same subgraph files and merge settings.
+        header = dict(
+            files=[str(file) for file in files],
+            bulk_upsert=bulk_upsert,
+            accumulate=accumulate,
+            num_shards=num_shards,
+            contributions=track_contributions,
+        )
+        journal = merge_journal.MergeJournal.resume(working_dir, header)
+        if journal is not None and journal.done:
+            print(f"[custom_insert] {working_dir} already merged, skipped")
+            return
+        if journal is not None:
+            print(f"[custom_insert] {working_dir} resumed from checkpoint: {journal.applied}/{len(files)} files, stage {journal.stage}")
+    if journal is None:
+        if working_dir.exists():
+            shutil.rmtree(working_dir)
+        working_dir.mkdir(parents=True, exist_ok=True)
+        if merge_journal.journal_enabled():
+            journal = merge_journal.MergeJournal.start(working_dir, header)
+    pipeline_rag = new_pipeline_rag(working_dir)
+    state = journal.load_state() if journal is not None else None
+    if state is not None:
+        all_entities_map = state["entities"]
+        all_relationships_map = state["relationships"]
+        contributions = state["contributions"]
+    else:
+        all_entities_map: dict[str, dict] = {}
+        all_relationships_map: dict[str, dict] = {}
+        contributions = kg_ledger.new_ledger() if track_contributions else None
+    applied = journal.applied if journal is not None else 0
+    stage = journal.stage if journal is not None else None
+
+    async def checkpoint(applied: int, stage: str):
+        await pipeline_rag._insert_done()
+        journal.checkpoint(
+            {"entities": all_entities_map, "relationships": all_relationships_map, "contributions": contributions},
+            applied=applied,
+            stage=stage,
         )
-    base_dir = Path(working_dir) / "graph_chunk_entity_relation.graphml"
-    xml_content = get_graphml(base_dir)
-    soup = BeautifulSoup(xml_content, "xml")
-    all_entities_data = get_entity(soup.find_all("node"))
 
+    if applied < len(files) and num_shards > 1:
+        # Chunks and docs are written here, entities/relationships are reduced by the shard workers.
+        for file in files:
+            custom_kg = get_custom_kg_dict(file_path=file)
+            await pipeline_rag.ainsert_custom_kg(
+                {k: custom_kg[k] for k in custom_kg if k not in ("entities", "relationships")},
+                all_entities_map={},
+                all_relationships_map={},
+                defer_graph_upsert=True,
+                contributions=contributions,
+            )
+        all_entities_map, all_relationships_map = await shard_service.sharded_reduce(
+            files,
+            num_shards,
+            accumulate=accumulate,
+            contributions=contributions,
+            new_rag=new_pipeline_rag,
+            undirected=track_contributions,
+        )
+        if journal is not None:
+            await checkpoint(len(files), "merge")
+    elif applied < len(files):
+        interval = merge_journal.checkpoint_interval()
+        for done, file in enumerate(files[applied:], start=applied + 1):
+            await pipeline_rag.ainsert_custom_kg(
+                get_custom_kg_dict(file_path=file),
+                all_entities_map=all_entities_map,
+                all_relationships_map=all_relationships_map,
+                defer_graph_upsert=bulk_upsert,
+                contributions=contributions,
+                accumulate=accumulate,
+                # The ledger replays undirected edges, the plain full merge keeps the last direction's attributes.
+                undirected=track_contributions,
+            )
+            if journal is None:
+                continue
+            journal.log("applied", file=str(file))
+            if done % interval == 0 or done == len(files):
+                await checkpoint(done, "merge")
+    if stage in (None, "merge"):
+        if accumulate:
+            await materialise_maps(pipeline_rag, all_entities_map, all_relationships_map)
+        if bulk_upsert or num_shards > 1 or accumulate:
+            # Deferred (bulk, sharded) and accumulated graphs are written once here, with the materialised descriptions.
+            await pipeline_rag.aupsert_custom_kg_graph(all_entities_map, all_relationships_map)
+        if journal is not None:
+            # Materialised maps and summaries are kept, so a resume does not re-run the LLM summaries.
+            await checkpoint(len(files), "graph")
+    # all_entities_map holds the final node data, no need to re-read the GraphML just written.
     data_for_vdb = {
-        compute_mdhash_id(dp["entity_name"], prefix="ent-"): {
-            "content": dp["entity_name"] + dp["description"],
-            "entity_name": dp["entity_name"],
+        compute_mdhash_id(entity_name, prefix="ent-"): {
+            "content": entity_name + node_data["description"],
+            "entity_name": entity_name,
         }
-        for dp in all_entities_data
+        for entity_name, node_data in all_entities_map.items()
     }
-    await pipeline_rag.entities_vdb.upsert(data_for_vdb)
-    chunks_dir = Path(working_dir) / "kv_store_text_chunks.json"
-    s_doc = {"chunks": []}
-    doc_chunks = get_doc_chunks(chunks_dir)
-    for _id in doc_chunks:
-        chunk = {}
-        chunk["source_id"] = _id
-        chunk.update(doc_chunks.get(_id))
-        s_doc["chunks"].append(chunk)
-    await pipeline_rag.chunks_vdb.upsert(s_doc["chunks"]) 
+    await vdb_upsert(pipeline_rag.entities_vdb, data_for_vdb, "entities", journal)
+    await vdb_upsert(pipeline_rag.chunks_vdb, await get_rag_chunks(pipeline_rag), "chunks", journal)
     await pipeline_rag._insert_done() 
+    if csr_graph.csr_graph_enabled():
+        csr_graph.write_csr_graph(pipeline_rag.chunk_entity_relation_graph)
+    if contributions is not None:
+        kg_ledger.save_ledger(working_dir, contributions)
+    if entity_blocking.entity_blocking_enabled():
+        write_entity_merge_candidates(working_dir, all_entities_map)
+    if journal is not None:
+        journal.finish()
+
+
+async def vdb_upsert(vdb, data: dict | list, name: str, journal: merge_journal.MergeJournal = None):
+    """Upsert into a vector DB, in journaled batches that a resumed run skips instead of embedding them again."""
+    if journal is None:
+        await vdb.upsert(data)
+        return
+    keys = list(data) if isinstance(data, dict) else None
+    batch_size = merge_journal.vdb_batch_size()
+    for start in range(journal.vdb_done.get(name, 0), len(data), batch_size):
+        if keys is None:
+            batch = data[start : start + batch_size]
+        else:
+            batch = {key: data[key] for key in keys[start : start + batch_size]}
+        await vdb.upsert(batch)
+        # The ANN index is only rebuilt by the final _insert_done, not for every batch.
+        await getattr(vdb, "flush_vectors", vdb.index_done_callback)()
+        journal.vdb_done[name] = start + len(batch)
+        journal.log("vdb", name=name, done=journal.vdb_done[name])
+
+
+async def incremental_insert(working_dir: Path, files: List[str], previous_dir: Path):
+    """
+    Start from the previous KG of this base_entry and apply only the subgraph deltas:
+    subgraphs no longer in files (Deleted, or the old md5 of a Modified document) have their fragments removed,
+    new subgraphs are merged, and only the touched entities, relationships and chunks are re-embedded.
+    Relies on the networkx graph storage for node and edge removal.
+    With phase2_incremental_verify=on, the replayed values are checked against a full merge of files.
+    """
+    if working_dir.exists():
+        shutil.rmtree(working_dir)
+    shutil.copytree(previous_dir, working_dir)
+    # The copied journal belongs to the previous full merge.
+    merge_journal.clear(working_dir)
+    ledger = kg_ledger.load_ledger(working_dir)
+    pipeline_rag = new_pipeline_rag(working_dir)
+    graph = pipeline_rag.chunk_entity_relation_graph._graph
+
+    subgraphs = {f"doc-{Path(file).stem}": file for file in files}
+    removed_docs = [doc_id for doc_id in ledger["docs"] if doc_id not in subgraphs]
+    affected = kg_ledger.remove_docs(ledger, removed_docs)
+    for doc_id in removed_docs:
+        pipeline_rag.full_docs._data.pop(doc_id, None)
+
+    existing_chunks = set(await pipeline_rag.text_chunks.all_keys())
+    for doc_id, file in subgraphs.items():
+        if doc_id in ledger["docs"]:
+            continue
+        # The maps are throwaway, final values are replayed from the ledger below.
+        await pipeline_rag.ainsert_custom_kg(
+            get_custom_kg_dict(file_path=file),
+            all_entities_map={},
+            all_relationships_map={},
+            defer_graph_upsert=True,
+            contributions=ledger,
+            undirected=True,
+        )
+        for kind in kg_ledger.KINDS:
+            affected[kind].update(ledger["docs"].get(doc_id, {}).get(kind, []))
+
+    # files are in the sorted order of a full merge, the new subgraphs' fragments are replayed at their position in it.
+    kg_ledger.reorder_docs(ledger, list(subgraphs), affected)
+    accumulate = accumulate_enabled()
+    if kg_ledger.incremental_verify_enabled():
+        await verify_incremental_insert(ledger, files, accumulate)
+    relationship_updates = {}
+    order = kg_ledger.doc_order(ledger)
+    for relationship_key in affected["relationships"]:
+        src_id, tgt_id = relationship_key.split("######", 1)
+        if f"{tgt_id}######{src_id}" in relationship_updates:
+            # Both directions replay into the same undirected edge.
+            continue
+        relationship_updates[relationship_key] = kg_ledger.replay_relationship(
+            ledger, src_id, tgt_id, accumulate, order
+        )
+    entity_updates = {
+        entity_name: kg_ledger.replay_entity(ledger, entity_name, accumulate)
+        for entity_name in affected["entities"]
+    }
+    await materialise_maps(pipeline_rag, entity_updates, relationship_updates)
+
+    # Relationships first, so nodes left without edges or entity fragments can be dropped afterwards.
+    orphan_candidates = set()
+    for relationship_key, edge_data in relationship_updates.items():
+        src_id, tgt_id = relationship_key.split("######", 1)
+        if edge_data is not None:
+            await pipeline_rag.chunk_entity_relation_graph.upsert_edge(
+                src_id, tgt_id, edge_data={"src_id": src_id, "tgt_id": tgt_id, **edge_data}
+            )
+        elif graph.has_edge(src_id, tgt_id):
+            graph.remove_edge(src_id, tgt_id)
+            orphan_candidates.update((src_id, tgt_id))
+    for entity_name in orphan_candidates - set(ledger["entities"]):
+        entity_updates[entity_name] = None
+
+    data_for_vdb = {}
+    removed_entity_ids = []
+    for entity_name, node_data in entity_updates.items():
+        if node_data is not None:
+            await pipeline_rag.chunk_entity_relation_graph.upsert_node(entity_name, node_data=node_data)
+            data_for_vdb[compute_mdhash_id(entity_name, prefix="ent-")] = {
+                "content": entity_name + node_data["description"],
+                "entity_name": entity_name,
+            }
+            continue
+        removed_entity_ids.append(compute_mdhash_id(entity_name, prefix="ent-"))
+        if not graph.has_node(entity_name):
+            continue
+        if graph.degree(entity_name) == 0:
+            graph.remove_node(entity_name)
+        else:
+            # Still an endpoint of another subgraph's edge: keep it as the bare node a full rebuild would create.
+            graph.nodes[entity_name].clear()
+    if data_for_vdb:
+        await pipeline_rag.entities_vdb.upsert(data_for_vdb)
+    await vdb_delete(pipeline_rag.entities_vdb, removed_entity_ids)
+
+    removed_chunks = [c for c in affected["chunks"] if c not in ledger["chunks"]]
+    for chunk_id in removed_chunks:
+        pipeline_rag.text_chunks._data.pop(chunk_id, None)
+    await vdb_delete(pipeline_rag.chunks_vdb, removed_chunks)
+    new_chunks = [c for c in await get_rag_chunks(pipeline_rag) if c["source_id"] not in existing_chunks]
+    if new_chunks:
+        await pipeline_rag.chunks_vdb.upsert(new_chunks)
+
+    await pipeline_rag._insert_done()
+    if csr_graph.csr_graph_enabled():
+        csr_graph.write_csr_graph(pipeline_rag.chunk_entity_relation_graph)
+    kg_ledger.save_ledger(working_dir, ledger)
+    if entity_blocking.entity_blocking_enabled():
+        write_entity_merge_candidates(working_dir, dict(graph.nodes(data=True)))
+
+
+def _replayed(value) -> dict:
+    return value.materialise() if isinstance(value, (EntityAccumulator, RelationshipAccumulator)) else value
+
+
+async def verify_incremental_insert(ledger: dict, files: List[str], accumulate: bool):
+    """
+    Check the ledger replay of an incremental merge against a full ainsert_custom_kg merge of files, fragment order
+    included. The full merge runs on a scratch LightRAG instance, with graph upserts deferred.
+    """
+    scratch_dir = Path(tempfile.mkdtemp(prefix="incremental_verify_"))
+    try:
+        rag = new_pipeline_rag(scratch_dir)
+        full_entities: dict = {}
+        full_relationships: dict = {}
+        for file in files:
+            await rag.ainsert_custom_kg(
+                get_custom_kg_dict(file_path=file),
+                all_entities_map=full_entities,
+                all_relationships_map=full_relationships,
+                defer_graph_upsert=True,
+                accumulate=accumulate,
+                undirected=True,
+            )
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+    order = kg_ledger.doc_order(ledger)
+    expected = {
+        "entities": {name: _replayed(value) for name, value in full_entities.items()},
+        "relationships": {},
+    }
+    for relationship_key, value in full_relationships.items():
+        src_id, tgt_id = relationship_key.split("######", 1)
+        expected["relationships"][undirected_relationship_key(src_id, tgt_id)] = {
+            "src_id": src_id, "tgt_id": tgt_id, **_replayed(value)
+        }
+    replayed = {
+        "entities": {name: _replayed(kg_ledger.replay_entity(ledger, name, accumulate)) for name in ledger["entities"]},
+        "relationships": {},
+    }
+    for relationship_key in ledger["relationships"]:
+        src_id, tgt_id = relationship_key.split("######", 1)
+        key = undirected_relationship_key(src_id, tgt_id)
+        if key not in replayed["relationships"]:
+            replayed["relationships"][key] = _replayed(
+                kg_ledger.replay_relationship(ledger, src_id, tgt_id, accumulate, order)
+            )
+    for kind in ("entities", "relationships"):
+        if expected[kind].keys() != replayed[kind].keys():
+            missing = expected[kind].keys() ^ replayed[kind].keys()
+            raise ValueError(f"Incremental merge differs from a full merge on {kind}: {sorted(missing)[:10]}")
+        for key, value in expected[kind].items():
+            if replayed[kind][key] != value:
+                raise ValueError(f"Incremental merge differs on {kind} {key}: {replayed[kind][key]} != {value}")
+
+
+def write_entity_merge_candidates(working_dir: Path, entities: dict[str, dict]):
+    """
+    Propose near-duplicate entities (case, plural and punctuation variants) of a merged base_entry through the
+    MinHash/LSH blocking index. Proposals are written to entity_merge_candidates.json for review, nothing is merged.
+    """
+    embedding_threshold = float(os.getenv("entity_blocking_embedding_threshold", "0"))
+    vector_lookup = None
+    if embedding_threshold > 0 and embedding_cache.embedding_cache_enabled():
+        cache = embedding_cache.get_embedding_cache(embedding_dimension)
+
+        # Refine with the vectors cached when the entities were embedded for entities_vdb, no new requests.
+        def vector_lookup(names: List[str]) -> dict:
+            keys = {
+                embedding_cache.compute_embedding_key(
+                    AZURE_EMBEDDING_DEPLOYMENT, name + entities[name].get("description", "")
+                ): name
+                for name in names
+            }
+            return {keys[key]: vector for key, vector in cache.get_many(list(keys)).items()}
+
+    proposals = entity_blocking.propose_merges(
+        entities,
+        threshold=float(os.getenv("entity_blocking_threshold", "0.8")),
+        vector_lookup=vector_lookup,
+        embedding_threshold=embedding_threshold,
+    )
+    clusters: dict[str, List[str]] = {}
+    for name, representative in entity_blocking.cluster_proposals(proposals).items():
+        clusters.setdefault(representative, []).append(name)
+    with open(working_dir / "entity_merge_candidates.json", "w", encoding="utf-8") as file:
+        json.dump(
+            {"pairs": proposals, "clusters": [sorted(c) for c in clusters.values()]},
+            file,
+            ensure_ascii=False,
+            indent=2,
+        )
+    print(f"[custom_insert] {working_dir}: {len(proposals)} entity merge candidates in {len(clusters)} clusters")
+
+
+def accumulate_enabled() -> bool:
+    return os.getenv("phase2_accumulate", "off").lower() == "on"
+
+
+async def materialise_maps(pipeline_rag: LightRAG, all_entities_map: dict, all_relationships_map: dict):
+    """
+    Join accumulated fragments once. Descriptions above description_fragment_cap fragments are capped and,
+    with description_summary=on, replaced by an LLM summary of all their fragments. A description short enough to
+    come back from the summary unchanged is capped like the others.
+    """
+    fragment_cap = int(os.getenv("description_fragment_cap", "0"))
+    summary_queue = [] if os.getenv("description_summary", "off").lower() == "on" else None
+    materialise_custom_kg_maps(all_entities_map, all_relationships_map, fragment_cap, summary_queue)
+    if not summary_queue:
+        return
+    global_config = pipeline_rag.chunk_entity_relation_graph.global_config
+    semaphore = asyncio.Semaphore(pipeline_rag.llm_model_max_async)
+
+    async def summarise(kind: str, key: str, fragments: List[str]):
+        async with semaphore:
+            name = key if kind == "entities" else tuple(key.split("######", 1))
+            target = all_entities_map if kind == "entities" else all_relationships_map
+            summary = await _handle_entity_relation_summary(name, "<SEP>".join(fragments), global_config)
+            target[key]["description"] = "<SEP>".join(summary.split("<SEP>")[:fragment_cap])
+
+    await asyncio.gather(*[summarise(*item) for item in summary_queue])
+
+
+async def vdb_delete(vdb, ids: List[str]):
+    if not ids:
+        return
+    if hasattr(vdb, "delete"):
+        await vdb.delete(ids)
+    else:
+        # NanoVectorDBStorage only exposes deletion through its client.
+        vdb._client.delete(ids)
 
 def get_custom_kg_dict(file_path):
-    with open(file_path, "r", encoding="utf-8") as file:
-        return json.load(file)
+    # JSON records load as dicts, Arrow records as a memory-mapped view iterated batch by batch.
+    return subgraph_pool.read_subgraph(file_path)
 
 # Phase 2: Global KG aggregation
-async def merge_kg():
+async def merge_kg(only_entries: List[str] = None) -> List[str]:
+    """
+    Params:
+        only_entries: merge just these base_entries, e.g. the ones that failed in the previous attempt
+    Returns the base_entries that failed.
+    """
     base_kg_dir = ROOT / "KG_NEW"  
-    json_file_dir = ROOT / "json_dir"
-    json_file_dir.mkdir(parents=True, exist_ok=True)
 
     db = next(db_utils.get_db())
     '''
@@ -168,19 +573,75 @@ async def merge_kg():
         base_entry = str(inst.base_entry).strip()
         if not inst.base_entry or not base_entry:
             continue
+        if only_entries is not None and base_entry not in only_entries:
+            continue
         if not base_entrys.get(base_entry):
             base_entrys[base_entry] = []
         base_entrys[base_entry].append(inst)
-    for b in base_entrys:
-        working_dir: Path = base_kg_dir / b
-        await custom_insert(
-            working_dir=working_dir,
-            files=list(
-                set(map(lambda x: json_file_dir / f"{str(x.md5)}.json", base_entrys[b]))
+    jobs = {
+        b: dict(
+            working_dir=base_kg_dir / b,
+            # Sorted, so the merge order (and a journal resuming it) is the same across runs.
+            files=sorted(
+                set(map(lambda x: subgraph_pool.subgraph_path(str(x.md5)), base_entrys[b]))
             ),
+            # Incremental mode applies the New/Modified/Deleted deltas on top of the currently served KG.
+            previous_dir=kg_store.current_kg_dir() / b if kg_ledger.incremental_enabled() else None,
         )
+        for b in base_entrys
+    }
+    failed_entries = []
+    max_workers = int(os.getenv("phase2_workers", "1"))
+    if max_workers <= 1:
+        for done, b in enumerate(jobs, start=1):
+            start = time.perf_counter()
+            try:
+                await custom_insert(**jobs[b])
+                print(f"[merge_kg] {done}/{len(jobs)} base_entry {b} merged in {time.perf_counter() - start:.1f}s")
+            except Exception as e:
+                print(f"[merge_kg] {done}/{len(jobs)} base_entry {b} failed: {e}")
+                failed_entries.append(b)
+    else:
+        # base_entries share no state and write to separate KG_NEW/<base_entry> dirs, so each runs in its own process.
+        loop = asyncio.get_running_loop()
+        with ProcessPoolExecutor(
+            max_workers=min(max_workers, max(1, len(jobs))),
+            mp_context=multiprocessing.get_context("spawn"),
+        ) as executor:
+            futures = {
+                asyncio.ensure_future(loop.run_in_executor(executor, merge_base_entry, jobs[b])): b
+                for b in jobs
+            }
+            pending = set(futures)
+            done = 0
+            while pending:
+                finished, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for future in finished:
+                    b = futures[future]
+                    done += 1
+                    try:
+                        elapsed = future.result()
+                        print(f"[merge_kg] {done}/{len(jobs)} base_entry {b} merged in {elapsed:.1f}s")
+                    except Exception as e:
+                        print(f"[merge_kg] {done}/{len(jobs)} base_entry {b} failed: {e}")
+                        failed_entries.append(b)
+    for b in base_entrys:
+        if b in failed_entries:
+            continue
         for inst in base_entrys[b]:
             db.commit()
+    return failed_entries
+
+
+def merge_base_entry(job: dict) -> float:
+    """Process pool entry point: aggregate one base_entry with its own event loop, return the elapsed seconds."""
+    start = time.perf_counter()
+    try:
+        asyncio.run(http_client.run_with_pooled_client(custom_insert(**job)))
+    except Exception as e:
+        # Storage exceptions are not always picklable, hand back their text instead.
+        raise RuntimeError(repr(e)) from None
+    return time.perf_counter() - start
 
 # Phase 1: Subgraph processing
 async def single_genKG():
@@ -188,6 +649,9 @@ async def single_genKG():
 
     json_file_dir = ROOT / "json_dir"
     json_file_dir.mkdir(parents=True, exist_ok=True)
+    # Every document gets its own workspace below single_kg, so documents can be extracted concurrently.
+    single_kg_dir = ROOT / "single_kg"
+    single_kg_dir.mkdir(parents=True, exist_ok=True)
 
     db = next(db_utils.get_db())
     ''' 
@@ -195,40 +659,61 @@ async def single_genKG():
     all New, Modified, Persistent, Deleted lifecycle status.
     '''
     datas = db.query(SubgraphPoolMapping).filter(SubgraphPoolMapping.cur_status.in_(['New', 'Modified'])).all() 
-    response = 1
-    for inst in datas:
-        text_file_path = txt_dir / inst.filepath
-        with open(text_file_path, "r", encoding="utf-8") as file:
-            content: str = file.read()
-        working_dir = ROOT / "single_kg"
-        if working_dir.exists():
-            shutil.rmtree(working_dir)
-        working_dir.mkdir(parents=True, exist_ok=True)
+    # phase1_concurrency=1 keeps the original one-document-at-a-time behaviour.
+    semaphore = asyncio.Semaphore(max(1, int(os.getenv("phase1_concurrency", "1"))))
+    results = await asyncio.gather(
+        *[
+            gen_single_subgraph(inst, txt_dir, single_kg_dir, semaphore)
+            for inst in datas
+        ]
+    )
+    db.close()
+    return 1 if all(results) else 0
+
+async def gen_single_subgraph(
+    inst: SubgraphPoolMapping, txt_dir: Path, single_kg_dir: Path, semaphore: asyncio.Semaphore
+) -> bool:
+    """
+    Extract one document into the subgraph pool. inst is only read, the status update goes through a session of
+    this task, so a failing document never rolls back the updates of the documents extracted next to it.
+    """
+    async with semaphore:
+        working_dir = Path(tempfile.mkdtemp(prefix=f"{inst.id}_", dir=single_kg_dir))
         try:
-            p_rag = LightRAG(
-                working_dir=working_dir,
-                llm_model_func=llm_model_func,
-                embedding_func=EmbeddingFunc(
-                    embedding_dim=embedding_dimension,
-                    max_token_size=8196,
-                    func=embedding_func,
-                ),
-            )
+            text_file_path = txt_dir / inst.filepath
+            with open(text_file_path, "r", encoding="utf-8") as file:
+                content: str = file.read()
+            p_rag = new_pipeline_rag(working_dir)
+            cached_chunks = {}
+            if chunk_store.chunk_store_enabled():
+                # Chunks already in the store are skipped by ainsert, only new chunk hashes reach the LLM.
+                cached_chunks = await chunk_store.seed_cached_chunks(p_rag, content)
             record_inst = record_query(content=str(inst.filename), req_type="GENERATE")
-            await p_rag.ainsert(
-                string_or_strings=content,
-                file_or_files=str(inst.filename),
-                req_id=record_inst.req_id,
-            )
-            kg_file_md5 = create_single_json()
-            inst.md5 = kg_file_md5
-            inst.cur_status = "Persistent"
-            db.commit()
+            with chunk_store.capture_extractions() as extractions:
+                await p_rag.ainsert(
+                    string_or_strings=content,
+                    file_or_files=str(inst.filename),
+                    req_id=record_inst.req_id,
+                )
+            if cached_chunks:
+                # ainsert returns early without writing full_docs when every chunk was cached.
+                doc_id = compute_mdhash_id(content.strip(), prefix="doc-")
+                if await p_rag.full_docs.get_by_id(doc_id) is None:
+                    await p_rag.full_docs.upsert({doc_id: {"content": content.strip()}})
+                    await p_rag.full_docs.index_done_callback()
+            kg_file_md5 = await export_single_subgraph(p_rag, cached_chunks=cached_chunks, extractions=extractions)
+            with db_utils.get_sessionmaker()() as db:
+                task_inst = db.get(SubgraphPoolMapping, inst.id)
+                task_inst.md5 = kg_file_md5
+                task_inst.cur_status = "Persistent"
+                db.commit()
+            return True
         except Exception as e:
             print(e)
             print(f"inst.id: {inst.id} , inst.filename: {inst.filename}")
-            response = 0
-    return response
+            return False
+        finally:
+            shutil.rmtree(working_dir, ignore_errors=True)
 
 async def custom_genKG():
     try_times = 3
@@ -243,22 +728,18 @@ async def custom_genKG():
     if ret != 1:
         return "FAILED"
     try_times = 3
-    ret = 0
-    while try_times > 0 and ret != 1:
+    # None merges every base_entry, later attempts only retry the ones that failed.
+    failed_entries = None
+    while try_times > 0 and failed_entries != []:
         try:
-            await merge_kg()
-            ret = 1
+            failed_entries = await merge_kg(only_entries=failed_entries)
         except Exception as e:
             print(e)
-            ret = 0
         try_times -= 1
-    if ret == 0:
+    if failed_entries != []:
         return "FAILED"
-    dir2 = ROOT / "KG_NEW"
-    dir1 = ROOT / "KG"
-    del_KG_data(dir1)
-    if os.path.exists(dir1):
-        shutil.rmtree(dir1)
-    shutil.move(dir2, dir1)
+    # Publish KG_NEW as a new version and hot swap the served instance, the previous version is released once drained.
+    version = kg_store.publish_kg_version(ROOT / "KG_NEW")
+    await asyncio.to_thread(swap_rag, version)
     return "SUCCESS"
 
@@ -5,13 +5,22 @@ from src.app.model.request_seq import RequestSeq
 from src.app.model.request_token import RequestToken
 from src.app.lightRAG.lightrag import LightRAG, QueryParam
 from src.app.lightRAG.lightrag.utils import EmbeddingFunc
-from src.app.util import db_utils
+from src.app.util import db_utils, llm_cache, embedding_cache, kg_store, answer_cache, embedding_batcher, http_client, rate_limiter, ann_index, csr_graph
+from src.app.util.kg_registry import KGRegistry, KGNotFound, kg_memory_budget_bytes
 import numpy as np
 from dotenv import load_dotenv
-import aiohttp
 import logging
+import asyncio
+import contextvars
+import csv
+import io
+import json
+import re
 import shutil
 import uuid
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator
+from pathlib import Path
 from datetime import datetime
 
 logging.basicConfig(level=logging.INFO)
@@ -25,10 +34,21 @@ AZURE_OPENAI_ENDPOINT = os.getenv("AZURE_OPENAI_ENDPOINT")
 AZURE_EMBEDDING_DEPLOYMENT = os.getenv("AZURE_EMBEDDING_DEPLOYMENT")
 AZURE_EMBEDDING_API_VERSION = os.getenv("AZURE_EMBEDDING_API_VERSION")
 
-BASE_DIR = "./KG/"
+# change to your base_entry which stored in DB table: subgraph_pool_mapping
+# Served when a request does not name a base_entry, and loaded at startup.
+SERVING_BASE_ENTRY = "YOUR_BASE_ENTRY"
+# Max /search queries running at once in this worker, further ones are rejected with HTTP 429 instead of queueing.
+SEARCH_MAX_IN_FLIGHT = int(os.getenv("search_max_in_flight", "256"))
 
 embedding_dimension = 3072
 
+# Set by astream_search: the answer-generating LLM call of that query streams its tokens into this queue.
+stream_sink: contextvars.ContextVar[asyncio.Queue | None] = contextvars.ContextVar("stream_sink", default=None)
+FILE_LIST_PATTERN = re.compile(r"<FileNameList>\[(.*?)\]</FileNameList>", re.S)
+# file_path of the retrieved chunks in the context LightRAG puts into the answer prompt, JSON or CSV formatted.
+CONTEXT_FILE_PATH_PATTERN = re.compile(r'"file_path"\s*:\s*"((?:[^"\\]|\\.)*)"')
+CONTEXT_CSV_PATTERN = re.compile(r"```csv\s*\n(.*?)```", re.S)
+
 async def llm_model_func(
     prompt, system_prompt=None, history_messages=[], **kwargs
 ) -> str:
@@ -56,29 +76,130 @@ async def llm_model_func(
         "top_p": kwargs.get("top_p", 1),
         "n": kwargs.get("n", 1),
     }
-    db = next(db_utils.get_db())
     inst = RequestToken()
     inst.req_id = kwargs.get("req_id", "")
     inst.req_type = kwargs.get("req_type", "")
     inst.create_at = datetime.now()
     inst.scenario = os.getenv("scenario")
+    inst.cached = 0
+    # Only the answer generation (the call with a system prompt) of a streamed query is streamed,
+    # keyword extraction runs as a normal request.
+    sink = stream_sink.get() if system_prompt else None
+    if sink is not None:
+        # Retrieval is done once the answer prompt exists: its file list goes out before the first token.
+        sink.put_nowait({"type": "files", "data": context_file_list(system_prompt)})
+
+    # cache_bypass=True forces a fresh completion for this call.
+    use_cache = llm_cache.llm_cache_enabled() and not kwargs.get("cache_bypass", False)
+    if use_cache:
+        cache_key = llm_cache.compute_cache_key(AZURE_OPENAI_DEPLOYMENT, payload)
+        # SQLite lookups run in a thread, off the event loop.
+        cached_result = await asyncio.to_thread(llm_cache.get_llm_cache().get, cache_key)
+        if cached_result is not None:
+            # Cache hits keep the original token usage and are marked cached, so ED1 accounting can include or exclude them.
+            inst.completion_tokens = cached_result["completion_tokens"]
+            inst.prompt_tokens = cached_result["prompt_tokens"]
+            inst.cached = 1
+            await asyncio.to_thread(save_record, inst)
+            if sink is not None:
+                sink.put_nowait({"type": "token", "data": cached_result["content"]})
+            return cached_result["content"]
+
+    if sink is not None:
+        content, usage = await stream_completion(endpoint, headers, payload, sink)
+        # Usage arrives in the last stream chunk, estimate it when the deployment does not send it.
+        inst.prompt_tokens = (usage or {}).get("prompt_tokens") or rate_limiter.estimate_chat_tokens(messages, 0)
+        inst.completion_tokens = (usage or {}).get("completion_tokens") or rate_limiter.count_tokens(content)
+        await asyncio.to_thread(save_record, inst)
+        if use_cache:
+            await asyncio.to_thread(
+                llm_cache.get_llm_cache().put, cache_key, content, inst.prompt_tokens, inst.completion_tokens
+            )
+        return content
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(endpoint, headers=headers, json=payload) as response:
-            if response.status != 200:
+    async with http_client.client() as client:
+        response = await send_request(
+            "llm",
+            lambda: client.post(endpoint, headers=headers, json=payload),
+            lambda: rate_limiter.estimate_chat_tokens(messages, kwargs.get("max_tokens")),
+        )
+        if response.status_code != 200:
+            raise ValueError(
+                f"Request failed with status {response.status_code}: {response.text}"
+            )
+        result = response.json()
+        # Recording token consumption data.
+        inst.completion_tokens = result.get("usage").get("completion_tokens")
+        inst.prompt_tokens = result.get("usage").get("prompt_tokens")
+        # The DB write runs in a thread so concurrent queries on the event loop are not blocked by it.
+        await asyncio.to_thread(save_record, inst)
+        content = result["choices"][0]["message"]["content"]
+        if use_cache:
+            await asyncio.to_thread(
+                llm_cache.get_llm_cache().put, cache_key, content, inst.prompt_tokens, inst.completion_tokens
+            )
+        return content
+
+
+async def stream_completion(endpoint: str, headers: dict, payload: dict, sink: asyncio.Queue) -> tuple[str, dict | None]:
+    """Stream a chat completion, forwarding each content delta to sink; returns the full content and the usage."""
+    payload = {**payload, "stream": True, "stream_options": {"include_usage": True}}
+    parts = []
+    usage = None
+    async with http_client.client() as client:
+        response = await send_request(
+            "llm",
+            lambda: client.send(client.build_request("POST", endpoint, headers=headers, json=payload), stream=True),
+            lambda: rate_limiter.estimate_chat_tokens(payload["messages"]),
+        )
+        try:
+            if response.status_code != 200:
+                await response.aread()
                 raise ValueError(
-                    f"Request failed with status {response.status}: {await response.text()}"
+                    f"Request failed with status {response.status_code}: {response.text}"
                 )
-            result = await response.json()
-            # Recording token consumption data.
-            inst.completion_tokens = result.get("usage").get("completion_tokens")
-            inst.prompt_tokens = result.get("usage").get("prompt_tokens")
-            db.add(inst)
-            db.commit()
-            return result["choices"][0]["message"]["content"]
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                usage = chunk.get("usage") or usage
+                for choice in chunk.get("choices") or []:
+                    delta = (choice.get("delta") or {}).get("content")
+                    if delta:
+                        parts.append(delta)
+                        sink.put_nowait({"type": "token", "data": delta})
+        finally:
+            await response.aclose()
+    return "".join(parts), usage
 
 
 async def embedding_func(texts: list[str]) -> np.ndarray:
+    if not embedding_cache.embedding_cache_enabled():
+        return await send_embeddings(texts)
+    # Only texts never embedded before by this model are sent to the endpoint.
+    cache = embedding_cache.get_embedding_cache(embedding_dimension)
+    keys = [embedding_cache.compute_embedding_key(AZURE_EMBEDDING_DEPLOYMENT, text) for text in texts]
+    # SQLite and vector file I/O run in a thread, off the event loop.
+    vectors = await asyncio.to_thread(cache.get_many, keys)
+    missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+    if missing:
+        new_vectors = await send_embeddings(list(missing.values()))
+        await asyncio.to_thread(cache.put_many, list(missing), new_vectors)
+        vectors.update(zip(missing, np.asarray(new_vectors, dtype=np.float32)))
+    return np.array([vectors[key] for key in keys], dtype=np.float32)
+
+
+async def send_embeddings(texts: list[str]) -> np.ndarray:
+    # Concurrent calls on the same event loop are merged into one deduplicated request by the micro-batcher.
+    if embedding_batcher.embedding_batch_enabled():
+        return await embedding_batcher.get_embedding_batcher(request_embeddings).embed(texts)
+    return await request_embeddings(texts)
+
+
+async def request_embeddings(texts: list[str]) -> np.ndarray:
     headers = {
         "Content-Type": "application/json",
         "api-key": AZURE_OPENAI_API_KEY,
@@ -87,52 +208,350 @@ async def embedding_func(texts: list[str]) -> np.ndarray:
 
     payload = {"input": texts}
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(endpoint, headers=headers, json=payload) as response:
-            if response.status != 200:
-                raise ValueError(
-                    f"Request failed with status {response.status}: {await response.text()}"
-                )
-            result = await response.json()
-            embeddings = [item["embedding"] for item in result["data"]]
-            return np.array(embeddings)
-
-rag = LightRAG(
-        working_dir=BASE_DIR + "YOUR_BASE_ENTRY", # change to your base_entry which stored in DB table: subgraph_pool_mapping
-        llm_model_func=llm_model_func,
-        embedding_func=EmbeddingFunc(
-            embedding_dim=embedding_dimension,
-            max_token_size=8192,    # max_token_size setting
-            func=embedding_func,
-        ),
+    async with http_client.client() as client:
+        response = await send_request(
+            "embedding",
+            lambda: client.post(endpoint, headers=headers, json=payload),
+            lambda: sum(rate_limiter.count_tokens(text) for text in texts),
+        )
+        if response.status_code != 200:
+            raise ValueError(
+                f"Request failed with status {response.status_code}: {response.text}"
+            )
+        result = response.json()
+        embeddings = [item["embedding"] for item in result["data"]]
+        # float32 halves the vector stores compared to the float64 np.array default.
+        return np.array(embeddings, dtype=np.float32)
+
+async def send_request(kind: str, send, estimate_tokens):
+    """
+    With llm_scheduler=on, requests wait for the <kind> RPM/TPM buckets and transient failures (429, 5xx) are retried
+    there, instead of failing the whole Phase 1/Phase 2 attempt. Tokens are only estimated when a TPM bucket is set.
+    """
+    if not rate_limiter.scheduler_enabled():
+        return await send()
+    scheduler = rate_limiter.get_scheduler(kind)
+    return await scheduler.request(send, tokens=estimate_tokens() if scheduler.tpm is not None else 0)
+
+def load_rag(working_dir: Path) -> LightRAG:
+    rag = LightRAG(
+            working_dir=str(working_dir),
+            llm_model_func=llm_model_func,
+            embedding_func=EmbeddingFunc(
+                embedding_dim=embedding_dimension,
+                max_token_size=8192,    # max_token_size setting
+                func=embedding_func,
+            ),
+    )
+    if ann_index.vector_storage_enabled():
+        # Serving instances keep only the quantized codes in memory, full-precision vectors are memory-mapped.
+        ann_index.install_ann(rag, serving=True)
+    else:
+        ann_index.restore_matrices(rag, serving=True)
+    if csr_graph.csr_graph_enabled():
+        # Local-mode expansion reads degrees and edges from the CSR arrays built at merge time.
+        csr_graph.install_csr_graph(rag)
+    return rag
+
+def _release_version(version: str | None):
+    logging.info(f"Releasing KG version {version}")
+    del_KG_data(kg_store.kg_dir(version))
+
+# One LightRAG instance per base_entry of the served KG version, loaded on first query and unloaded
+# least-recently-used first beyond kg_memory_budget_mb.
+_registry = KGRegistry(
+    load_rag,
+    kg_store.kg_dir,
+    kg_store.current_version(),
+    memory_budget=kg_memory_budget_bytes(),
+    on_version_released=_release_version,
 )
 
+def kg_working_dir(base_entry: str = None) -> Path:
+    """Directory of base_entry in the served KG version, raises KGNotFound for unknown base_entries."""
+    return _registry.working_dir(base_entry or SERVING_BASE_ENTRY)
+
+@contextmanager
+def acquire_rag(base_entry: str = None):
+    """Pin the served KG version of base_entry for the duration of one query, loading it on first use."""
+    entry = _registry.pin(base_entry or SERVING_BASE_ENTRY)
+    try:
+        yield entry.rag
+    finally:
+        _registry.unpin(entry)
+
+@asynccontextmanager
+async def aacquire_rag(base_entry: str = None):
+    """acquire_rag for the server event loop: a KG that is not loaded yet is loaded in a worker thread."""
+    base_entry = base_entry or SERVING_BASE_ENTRY
+    # try_pin never loads, so the event loop is not blocked even when the KG got unloaded since a check.
+    entry = _registry.try_pin(base_entry)
+    if entry is None:
+        entry = await asyncio.to_thread(_registry.pin, base_entry)
+    try:
+        yield entry.rag
+    finally:
+        _registry.unpin(entry)
+
+def swap_rag(version: str):
+    """
+    Pre-load the published KG version of every loaded base_entry, then switch new queries over to it.
+    Queries still running on the old version finish there, the old version is released once the last one is done.
+    """
+    _registry.publish(version)
+    if answer_cache.answer_cache_enabled():
+        # Keys carry the KG version so old answers can no longer hit, clearing just frees them.
+        answer_cache.get_answer_cache().clear()
+
+try:
+    with acquire_rag():
+        pass
+except KGNotFound:
+    logging.warning(f"No KG for the default base_entry {SERVING_BASE_ENTRY} in version {_registry.version} yet")
+
+def save_record(inst):
+    db = next(db_utils.get_db())
+    try:
+        db.add(inst)
+        db.commit()
+        db.refresh(inst)
+    finally:
+        db.close()
+
 # Track and record every request, token consumption calculation is depending on this log data.      
-def record_query(content: str, req_type: str = "SEARCH") -> RequestSeq:
+def record_query(content: str, req_type: str = "SEARCH", req_id: str = None) -> RequestSeq:
     """
     Params:
         req_type: SEARCH | GENERATE
+        req_id: generated when not given
     """
-    req_id = str(uuid.uuid4())
-    db = next(db_utils.get_db())
     inst = RequestSeq()
     inst.content = content
-    inst.req_id = req_id
+    inst.req_id = req_id or str(uuid.uuid4())
     inst.req_type = req_type
     inst.scenario = os.getenv("scenario")
-    db.add(inst)
-    db.commit()
-    db.refresh(inst)
+    save_record(inst)
     return inst
 
-def search_public(query:str):
-    record_inst = record_query(query, req_type="SEARCH")
+_background_tasks: set[asyncio.Task] = set()
+
+def record_query_in_background(content: str, req_type: str = "SEARCH") -> str:
+    """Log the request from a worker thread without waiting for it, return its req_id right away."""
+    req_id = str(uuid.uuid4())
+    task = asyncio.get_running_loop().create_task(asyncio.to_thread(record_query, content, req_type, req_id))
+    # Keep a reference until done, the loop only holds weak references to tasks.
+    _background_tasks.add(task)
+    task.add_done_callback(_background_task_done)
+    return req_id
+
+def _background_task_done(task: asyncio.Task):
+    _background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logging.error(f"Background request logging failed: {task.exception()!r}")
+
+class SearchOverloaded(Exception):
+    pass
+
+search_stats = {"in_flight": 0, "rejected": 0}
+
+async def asearch_public(query: str, base_entry: str = None):
+    """
+    Query base_entry (the serving graph by default) on the server event loop: awaits rag.aquery and logs the request
+    in the background. Raises SearchOverloaded once SEARCH_MAX_IN_FLIGHT queries are running,
+    and KGNotFound for an unknown base_entry.
+    With answer_cache=on, repeated and concurrent identical queries are answered from the cache or coalesced,
+    only queries that run the pipeline count towards the in-flight limit.
+    """
+    base_entry = base_entry or SERVING_BASE_ENTRY
+    kg_working_dir(base_entry)
+    req_id = record_query_in_background(query, req_type="SEARCH")
     # Use LightRAG's "local query" as default retrieval workflow
-    response_str = rag.query(query, param=QueryParam(mode="local", req_id=record_inst.req_id))
+    param = QueryParam(mode="local", req_id=req_id)
+    if not answer_cache.answer_cache_enabled():
+        response_str = await _run_query(query, param, base_entry)
+    else:
+        scope = answer_cache.compute_answer_scope(
+            {**{k: v for k, v in vars(param).items() if k != "req_id"}, "base_entry": base_entry}, _registry.version
+        )
+        response_str = await answer_cache.get_answer_cache().get_or_compute(
+            query, scope, lambda: _run_query(query, param, base_entry), embed=_embed_query
+        )
     return """
     {response_str}
 """.format(response_str=response_str)
+
+async def _run_query(query: str, param: QueryParam, base_entry: str) -> str:
+    if search_stats["in_flight"] >= SEARCH_MAX_IN_FLIGHT:
+        search_stats["rejected"] += 1
+        raise SearchOverloaded(f"{search_stats['in_flight']} queries in flight")
+    search_stats["in_flight"] += 1
+    try:
+        async with aacquire_rag(base_entry) as rag:
+            return await rag.aquery(query, param=param)
+    finally:
+        search_stats["in_flight"] -= 1
+
+def parse_file_list(text: str) -> list[str] | None:
+    match = FILE_LIST_PATTERN.search(text)
+    if match is None:
+        return None
+    return [name for name in match.group(1).replace("'", "").replace(" ", "").split(",") if name]
+
+def context_file_list(context: str) -> list[str]:
+    """Distinct file names of the chunks in a LightRAG retrieval context, in retrieval order."""
+    names = parse_file_list(context)
+    if names is None:
+        names = [json.loads(f'"{name}"') for name in CONTEXT_FILE_PATH_PATTERN.findall(context)]
+    if not names:
+        for block in CONTEXT_CSV_PATTERN.findall(context):
+            lines = block.strip().splitlines()
+            # Older LightRAG joins unquoted cells with ",\t", newer ones write proper CSV.
+            if lines and ",\t" in lines[0]:
+                rows = [line.split(",\t") for line in lines]
+            else:
+                rows = list(csv.reader(io.StringIO(block)))
+            header = [cell.strip() for cell in rows[0]] if rows else []
+            if "file_path" in header:
+                # Counted from the end: unquoted content may contain the delimiter.
+                from_end = len(header) - header.index("file_path")
+                names.extend(row[-from_end].strip() for row in rows[1:] if len(row) >= len(header))
+    return [name for name in dict.fromkeys(names) if name and name != "unknown_source"]
+
+class FileListStripper:
+    """Drops <FileNameList>...</FileNameList> from streamed text, holding back deltas that may start or end in a tag."""
+
+    OPEN, CLOSE = "<FileNameList>", "</FileNameList>"
+
+    def __init__(self):
+        self.buffer = ""
+        self.in_tag = False
+
+    def feed(self, text: str) -> str:
+        self.buffer += text
+        out = []
+        while True:
+            if self.in_tag:
+                end = self.buffer.find(self.CLOSE)
+                if end < 0:
+                    self.buffer = self.buffer[-(len(self.CLOSE) - 1):]
+                    break
+                self.buffer = self.buffer[end + len(self.CLOSE):]
+                self.in_tag = False
+                continue
+            start = self.buffer.find(self.OPEN)
+            if start >= 0:
+                out.append(self.buffer[:start])
+                self.buffer = self.buffer[start + len(self.OPEN):]
+                self.in_tag = True
+                continue
+            hold = next(
+                (k for k in range(min(len(self.OPEN) - 1, len(self.buffer)), 0, -1) if self.buffer.endswith(self.OPEN[:k])), 0
+            )
+            out.append(self.buffer[:len(self.buffer) - hold])
+            self.buffer = self.buffer[len(self.buffer) - hold:]
+            break
+        return "".join(out)
+
+    def flush(self) -> str:
+        rest, self.buffer = ("" if self.in_tag else self.buffer), ""
+        return rest
+
+def _release_search_slot(task: asyncio.Task):
+    search_stats["in_flight"] -= 1
+    if not task.cancelled():
+        # Retrieved here so an unread stream does not log "exception was never retrieved".
+        task.exception()
+
+async def astream_search(query: str, base_entry: str = None) -> AsyncIterator[dict]:
+    """
+    Streaming variant of asearch_public, yielding events:
+        files: file names of the retrieved chunks, sent once retrieval is done and before the first token
+        token: answer text as it is generated, without the <FileNameList> tag
+        done: the full answer without the file list
+        error: the query failed after the stream started
+    Admission against SEARCH_MAX_IN_FLIGHT happens before the stream starts, so overload can still be answered with 429,
+    and so is the base_entry lookup (KGNotFound).
+    The query starts right away and holds its in-flight slot until it finishes, whether or not the stream is iterated;
+    closing the stream early cancels it.
+    """
+    base_entry = base_entry or SERVING_BASE_ENTRY
+    kg_working_dir(base_entry)
+    if search_stats["in_flight"] >= SEARCH_MAX_IN_FLIGHT:
+        search_stats["rejected"] += 1
+        raise SearchOverloaded(f"{search_stats['in_flight']} queries in flight")
+    req_id = record_query_in_background(query, req_type="SEARCH")
+    sink: asyncio.Queue = asyncio.Queue()
+
+    async def run_query() -> str:
+        stream_sink.set(sink)
+        async with aacquire_rag(base_entry) as rag:
+            return await rag.aquery(query, param=QueryParam(mode="local", req_id=req_id))
+
+    search_stats["in_flight"] += 1
+    task = asyncio.get_running_loop().create_task(run_query())
+    task.add_done_callback(_release_search_slot)
+
+    async def events() -> AsyncIterator[dict]:
+        stripper = FileListStripper()
+
+        def stripped(event: dict) -> dict | None:
+            if event["type"] != "token":
+                return event
+            data = stripper.feed(event["data"])
+            return {"type": "token", "data": data} if data else None
+
+        try:
+            while True:
+                getter = asyncio.ensure_future(sink.get())
+                done, _ = await asyncio.wait({getter, task}, return_when=asyncio.FIRST_COMPLETED)
+                if getter not in done:
+                    getter.cancel()
+                    break
+                event = stripped(getter.result())
+                if event is not None:
+                    yield event
+            while not sink.empty():
+                event = stripped(sink.get_nowait())
+                if event is not None:
+                    yield event
+            rest = stripper.flush()
+            if rest:
+                yield {"type": "token", "data": rest}
+            try:
+                result = task.result()
+            except Exception as e:
+                yield {"type": "error", "data": str(e)}
+                return
+            yield {"type": "done", "data": FILE_LIST_PATTERN.sub("", result).strip()}
+        finally:
+            if not task.done():
+                # The client went away mid-stream.
+                task.cancel()
+
+    return events()
+
+async def _embed_query(query: str) -> np.ndarray:
+    return (await embedding_func([query]))[0]
     
+def get_metrics() -> dict:
+    metrics = {
+        "kg_version": _registry.version,
+        "search": dict(search_stats, max_in_flight=SEARCH_MAX_IN_FLIGHT),
+        "kg_registry": _registry.stats(),
+    }
+    if llm_cache.llm_cache_enabled():
+        metrics["llm_cache"] = llm_cache.get_llm_cache().stats()
+    if embedding_cache.embedding_cache_enabled():
+        metrics["embedding_cache"] = embedding_cache.get_embedding_cache(embedding_dimension).stats()
+    if embedding_batcher.embedding_batch_enabled():
+        metrics["embedding_batcher"] = embedding_batcher.batcher_stats()
+    metrics["http_pool"] = http_client.pool_stats()
+    if rate_limiter.scheduler_enabled():
+        metrics["scheduler"] = rate_limiter.scheduler_stats()
+    if answer_cache.answer_cache_enabled():
+        metrics["answer_cache"] = answer_cache.get_answer_cache().stats()
+    return metrics
+
 def del_KG_data(target_dir:str):
     if not os.path.exists(target_dir):
         return
@@ -0,0 +1,231 @@
+import asyncio
+import multiprocessing
+import os
+import pickle
+import shutil
+import tempfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Callable, List
+
+from src.app.lightRAG.lightrag.lightrag import (
+    EntityAccumulator,
+    RelationshipAccumulator,
+    fold_custom_entity,
+    fold_custom_relationship,
+    record_contribution,
+    undirected_relationship_key,
+)
+from src.app.util import kg_ledger, subgraph_pool
+
+
+def shard_count() -> int:
+    return max(1, int(os.getenv("phase2_shards", "1")))
+
+
+def shard_verify_enabled() -> bool:
+    return os.getenv("phase2_shard_verify", "off").lower() == "on"
+
+
+def shard_of(key: str, num_shards: int) -> int:
+    # crc32 instead of hash(): str hashes are salted per process and would differ between workers.
+    return zlib.crc32(key.encode("utf-8")) % num_shards
+
+
+def _partition_path(spill_dir: Path, mapper: int, shard: int) -> Path:
+    return spill_dir / f"map-{mapper}-shard-{shard}.pkl"
+
+
+def map_files(files: List[Path], first_order: int, mapper: int, num_shards: int, spill_dir: Path):
+    """
+    Process pool entry point of the map stage: parse a contiguous share of the subgraph files once and spill their
+    entities/relationships to one partition per shard, as (order, doc_id, source_id, [(position, entity)],
+    [(position, relationship)]) per file. Relationships are partitioned by their undirected key, so both directions
+    of a pair reach the same reducer.
+    """
+    partitions = [[] for _ in range(num_shards)]
+    for order, file in enumerate(files, start=first_order):
+        custom_kg = subgraph_pool.read_subgraph(file)
+        source_id = None
+        for chunk_data in custom_kg.get("chunks", []):
+            source_id = chunk_data["source_id"]
+        records = [(order, custom_kg.get("source_id"), source_id, [], []) for _ in range(num_shards)]
+        for position, entity_data in enumerate(custom_kg.get("entities", [])):
+            records[shard_of(entity_data["entity_name"], num_shards)][3].append((position, dict(entity_data)))
+        for position, relationship_data in enumerate(custom_kg.get("relationships", [])):
+            key = undirected_relationship_key(relationship_data["src_id"], relationship_data["tgt_id"])
+            records[shard_of(key, num_shards)][4].append((position, dict(relationship_data)))
+        for shard, record in enumerate(records):
+            if record[3] or record[4]:
+                partitions[shard].append(record)
+    for shard, partition in enumerate(partitions):
+        with open(_partition_path(spill_dir, mapper, shard), "wb") as file:
+            pickle.dump(partition, file, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def reduce_shard(
+    shard: int, num_mappers: int, spill_dir: Path, accumulate: bool, track_contributions: bool, undirected: bool
+) -> dict:
+    """
+    Process pool entry point of the reduce stage: fold the partition of one shard in file order (mapper shares are
+    contiguous, so reading them in mapper order keeps it), like ainsert_custom_kg folds them.
+    """
+    all_entities_map: dict = {}
+    all_relationships_map: dict = {}
+    first_seen = {"entities": {}, "relationships": {}}
+    contributions = kg_ledger.new_ledger() if track_contributions else None
+    for mapper in range(num_mappers):
+        with open(_partition_path(spill_dir, mapper, shard), "rb") as file:
+            partition = pickle.load(file)
+        for order, doc_id, source_id, entities, relationships in partition:
+            for position, entity_data in entities:
+                entity_name, node_data = fold_custom_entity(all_entities_map, entity_data, accumulate)
+                first_seen["entities"].setdefault(entity_name, (order, position))
+                if contributions is not None:
+                    record_contribution(contributions, doc_id, "entities", entity_name, node_data)
+            for position, relationship_data in relationships:
+                relationship_key, edge_data, source_chunk_id = fold_custom_relationship(
+                    all_relationships_map, relationship_data, source_id, accumulate, undirected
+                )
+                first_seen["relationships"].setdefault(relationship_key, (order, position))
+                if contributions is not None:
+                    record_contribution(
+                        contributions, doc_id, "relationships", relationship_key, [edge_data, source_chunk_id]
+                    )
+    return {
+        "entities": all_entities_map,
+        "relationships": all_relationships_map,
+        "first_seen": first_seen,
+        "contributions": contributions,
+    }
+
+
+def _merge_contributions(contributions: dict, shard_contributions: dict):
+    for kind in ("entities", "relationships"):
+        # Shards own disjoint keys, so per-key fragment lists never collide.
+        contributions[kind].update(shard_contributions[kind])
+    for doc_id, doc_keys in shard_contributions["docs"].items():
+        target = contributions["docs"].setdefault(doc_id, {"entities": [], "relationships": [], "chunks": []})
+        for kind in ("entities", "relationships"):
+            target[kind].extend(doc_keys[kind])
+
+
+def _comparable(items: dict) -> list:
+    return [
+        (key, value.materialise() if isinstance(value, (EntityAccumulator, RelationshipAccumulator)) else value)
+        for key, value in items.items()
+    ]
+
+
+async def verify_sharded_reduce(
+    files: List[Path],
+    accumulate: bool,
+    undirected: bool,
+    all_entities_map: dict,
+    all_relationships_map: dict,
+    new_rag: Callable[[Path], object],
+):
+    """
+    Check the sharded result against the sequential ainsert_custom_kg merge, key order included.
+    The sequential merge runs on a scratch LightRAG instance from new_rag, with graph upserts deferred.
+    """
+    scratch_dir = Path(tempfile.mkdtemp(prefix="shard_verify_"))
+    try:
+        rag = new_rag(scratch_dir)
+        sequential_entities: dict = {}
+        sequential_relationships: dict = {}
+        for file in files:
+            await rag.ainsert_custom_kg(
+                subgraph_pool.read_subgraph(file),
+                all_entities_map=sequential_entities,
+                all_relationships_map=sequential_relationships,
+                defer_graph_upsert=True,
+                accumulate=accumulate,
+                undirected=undirected,
+            )
+    finally:
+        shutil.rmtree(scratch_dir, ignore_errors=True)
+    for kind, sharded, sequential in (
+        ("entities", all_entities_map, sequential_entities),
+        ("relationships", all_relationships_map, sequential_relationships),
+    ):
+        sharded_items, sequential_items = _comparable(sharded), _comparable(sequential)
+        if sharded_items == sequential_items:
+            continue
+        if len(sharded_items) != len(sequential_items):
+            raise ValueError(
+                f"Sharded merge produced {len(sharded_items)} {kind}, sequential merge {len(sequential_items)}"
+            )
+        for sharded_item, sequential_item in zip(sharded_items, sequential_items):
+            if sharded_item != sequential_item:
+                raise ValueError(f"Sharded merge differs on {kind}: {sharded_item} != {sequential_item}")
+
+
+async def sharded_reduce(
+    files: List[Path],
+    num_shards: int,
+    accumulate: bool = False,
+    contributions: dict = None,
+    new_rag: Callable[[Path], object] = None,
+    undirected: bool = False,
+) -> tuple[dict, dict]:
+    """
+    Map-reduce aggregation of a single base_entry over num_shards worker processes.
+    Map: each worker parses its contiguous share of the files once and partitions the entities and relationships by
+    hash of the entity name / undirected relationship key. Reduce: each worker folds one partition in file order.
+    The disjoint results are combined in first-occurrence order so the maps match the sequential merge.
+    undirected folds both directions of a relationship into one key, as ainsert_custom_kg does for the ledger.
+    With phase2_shard_verify=on, new_rag provides the LightRAG instance the sequential merge is checked on.
+    """
+    loop = asyncio.get_running_loop()
+    num_mappers = min(num_shards, len(files)) or 1
+    share = -(-len(files) // num_mappers)
+    spill_dir = Path(tempfile.mkdtemp(prefix="shard_spill_"))
+    try:
+        with ProcessPoolExecutor(max_workers=num_shards, mp_context=multiprocessing.get_context("spawn")) as executor:
+            await asyncio.gather(
+                *[
+                    loop.run_in_executor(
+                        executor,
+                        map_files,
+                        files[mapper * share : (mapper + 1) * share],
+                        mapper * share,
+                        mapper,
+                        num_shards,
+                        spill_dir,
+                    )
+                    for mapper in range(num_mappers)
+                ]
+            )
+            results = await asyncio.gather(
+                *[
+                    loop.run_in_executor(
+                        executor,
+                        reduce_shard,
+                        shard,
+                        num_mappers,
+                        spill_dir,
+                        accumulate,
+                        contributions is not None,
+                        undirected,
+                    )
+                    for shard in range(num_shards)
+                ]
+            )
+    finally:
+        shutil.rmtree(spill_dir, ignore_errors=True)
+    maps = {}
+    for kind in ("entities", "relationships"):
+        first_seen = {}
+        combined = {}
+        for result in results:
+            first_seen.update(result["first_seen"][kind])
+            combined.update(result[kind])
+        maps[kind] = {key: combined[key] for key in sorted(combined, key=first_seen.__getitem__)}
+    if contributions is not None:
+        for result in results:
+            _merge_contributions(contributions, result["contributions"])
+    if shard_verify_enabled() and new_rag is not None:
+        await verify_sharded_reduce(files, accumulate, undirected, maps["entities"], maps["relationships"], new_rag)
+    return maps["entities"], maps["relationships"]
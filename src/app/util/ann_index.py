@@ -0,0 +1,323 @@
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+
+from src.app.util import vector_quant
+
+# Vectors are scored in blocks of this many rows when assigning them to their lists.
+ASSIGN_BATCH = 8192
+
+
+def ann_enabled() -> bool:
+    return os.getenv("ann_index", "off").lower() == "on"
+
+
+def ann_min_vectors() -> int:
+    return int(os.getenv("ann_min_vectors", "10000"))
+
+
+def ann_nprobe() -> int:
+    return max(1, int(os.getenv("ann_nprobe", "8")))
+
+
+def default_nlist(num_vectors: int) -> int:
+    nlist = int(os.getenv("ann_nlist", "0"))
+    return nlist if nlist > 0 else max(1, int(4 * np.sqrt(num_vectors)))
+
+
+def _assign(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    assignment = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_BATCH):
+        assignment[start : start + ASSIGN_BATCH] = np.argmax(vectors[start : start + ASSIGN_BATCH] @ centroids.T, axis=1)
+    return assignment
+
+
+def _normalise(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class IVFIndex:
+    """
+    Inverted-file index for cosine similarity over unit vectors: spherical k-means splits the vectors into nlist lists,
+    a query scans only the nprobe lists with the closest centroids. Recall rises and latency grows with nprobe.
+    The index stores row numbers into the vector matrix, not the vectors themselves.
+    """
+
+    def __init__(self, centroids: np.ndarray, order: np.ndarray, offsets: np.ndarray, fingerprint: str = ""):
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.fingerprint = fingerprint
+
+    @property
+    def nlist(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(
+        cls, matrix: np.ndarray, nlist: int, iterations: int = 10, sample_per_list: int = 64, seed: int = 0,
+        fingerprint: str = "",
+    ) -> "IVFIndex":
+        rng = np.random.default_rng(seed)
+        matrix = np.asarray(matrix, dtype=np.float32)
+        nlist = max(1, min(nlist, len(matrix)))
+        # Centroids are trained on a sample, every vector is assigned afterwards.
+        sample_size = min(len(matrix), nlist * sample_per_list)
+        sample = matrix[np.sort(rng.choice(len(matrix), sample_size, replace=False))]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = _assign(sample, centroids)
+            counts = np.bincount(assignment, minlength=nlist)
+            by_list = np.argsort(assignment, kind="stable")
+            non_empty = np.flatnonzero(counts)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))[non_empty]
+            centroids[non_empty] = np.add.reduceat(sample[by_list], starts, axis=0)
+            empty = np.flatnonzero(counts == 0)
+            if len(empty):
+                # Re-seed empty lists with random sample vectors.
+                centroids[empty] = sample[rng.choice(len(sample), len(empty), replace=False)]
+            centroids = _normalise(centroids).astype(np.float32)
+        assignment = _assign(matrix, centroids)
+        order = np.argsort(assignment, kind="stable").astype(np.int32)
+        offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=nlist)))).astype(np.int64)
+        return cls(centroids, order, offsets, fingerprint)
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """Rows of the nprobe lists whose centroids are closest to the unit query vector."""
+        centroid_scores = self.centroids @ query
+        if nprobe < self.nlist:
+            probe = np.argpartition(-centroid_scores, nprobe - 1)[:nprobe]
+        else:
+            probe = np.arange(self.nlist)
+        return np.concatenate([self.order[self.offsets[c] : self.offsets[c + 1]] for c in probe])
+
+    def search(self, matrix: np.ndarray, query: np.ndarray, top_k: int, nprobe: int) -> tuple[np.ndarray, np.ndarray]:
+        """Rows and cosine scores of the approximate top_k, best first. query must be a unit vector."""
+        candidates = self.candidates(query, nprobe)
+        return top_rows(candidates, matrix[candidates] @ query, top_k)
+
+    def save(self, path: str | Path):
+        path = Path(path)
+        tmp_path = path.with_suffix(".tmp.npz")
+        np.savez(
+            tmp_path, centroids=self.centroids, order=self.order, offsets=self.offsets,
+            fingerprint=np.array(self.fingerprint),
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str | Path) -> "IVFIndex":
+        with np.load(path) as data:
+            return cls(data["centroids"], data["order"], data["offsets"], str(data["fingerprint"]))
+
+
+def top_rows(rows: np.ndarray, scores: np.ndarray, top_k: int) -> tuple[np.ndarray, np.ndarray]:
+    """The top_k (row, score) pairs, best first."""
+    if len(rows) == 0:
+        return rows, np.empty(0, dtype=np.float32)
+    k = min(top_k, len(rows))
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top])]
+    return rows[top], scores[top]
+
+
+def ids_fingerprint(ids: list[str]) -> str:
+    return hashlib.sha1("\n".join(ids).encode("utf-8")).hexdigest()
+
+
+def client_file(storage) -> Path:
+    return Path(getattr(
+        storage, "_client_file_name",
+        os.path.join(storage.global_config["working_dir"], f"vdb_{storage.namespace}.json"),
+    ))
+
+
+def attach_full_precision(nano_storage: dict, directory: str | Path, memory_map: bool = False) -> bool:
+    """
+    Put the matrix back into a NanoVectorDB storage loaded from a vdb_*.json whose vectors live only in the .f32 file
+    named by its matrix_file entry: memory-mapped, or read into memory. False if the JSON carried its matrix itself.
+    """
+    name = nano_storage.pop("matrix_file", None)
+    if name is None:
+        return False
+    matrix = vector_quant.open_full_precision(Path(directory) / name, nano_storage["embedding_dim"])
+    if len(matrix) != len(nano_storage["data"]):
+        raise ValueError(f"{name} holds {len(matrix)} vectors for {len(nano_storage['data'])} vector DB entries")
+    nano_storage["matrix"] = matrix if memory_map else np.array(matrix)
+    return True
+
+
+def restore_matrices(rag, serving: bool = False):
+    """
+    Load the .f32 vectors of vector DBs persisted by ANNVectorStorage into an instance that does not install it,
+    e.g. after vector_precision was switched back to float32.
+    """
+    for name in ("entities_vdb", "chunks_vdb"):
+        storage = getattr(rag, name)
+        if hasattr(storage, "_client"):
+            attach_full_precision(storage._client._NanoVectorDB__storage, client_file(storage).parent, serving)
+    return rag
+
+
+class ANNVectorStorage:
+    """
+    Wraps a NanoVectorDBStorage: upserts, deletes and persistence still go to it, queries are answered from
+    the artifacts built over its matrix whenever the storage is flushed after changes, stored next to the vector DB:
+        vdb_<namespace>.ivf.npz: IVF index (ann_index=on), only the ann_nprobe closest lists are scanned
+        vdb_<namespace>.<precision>.npz + vdb_<namespace>.f32: quantized codes (vector_precision) scored in memory,
+            and the float32 vectors the best candidates are rescored against
+    With quantized codes the vectors are persisted once, in the .f32 file: vdb_<namespace>.json keeps the ids and
+    metadata with an empty matrix, so loading it no longer decodes the base64 matrix. A serving instance
+    (serving=True) memory-maps the .f32 file, so only the codes stay resident; the pipeline reads it into memory.
+    Stale artifacts (id fingerprint mismatch) fall back to the exact scan.
+    """
+
+    def __init__(self, storage, serving: bool = False):
+        self._storage = storage
+        self.client_file = client_file(storage)
+        restored = attach_full_precision(self._nano_storage, self.client_file.parent, memory_map=serving)
+        self.index_path = self.client_file.with_suffix(".ivf.npz")
+        self.precision = vector_quant.vector_precision()
+        self.codec_path = self.client_file.with_suffix(f".{self.precision}.npz")
+        self.full_precision_path = self.client_file.with_suffix(".f32")
+        self._index: IVFIndex | None = None
+        self._codec = None
+        self._dirty = False
+        fingerprint = self._fingerprint()
+        if ann_enabled() and self.index_path.exists():
+            index = IVFIndex.load(self.index_path)
+            if index.fingerprint == fingerprint:
+                self._index = index
+            else:
+                self._dirty = True
+        if self.precision != "float32" and self.codec_path.exists():
+            codec, codec_fingerprint = vector_quant.load_codec(self.codec_path)
+            if codec_fingerprint == fingerprint:
+                self._codec = codec
+                if serving and not restored:
+                    self._release_matrix()
+            else:
+                self._dirty = True
+
+    def __getattr__(self, name):
+        if name == "_storage":
+            raise AttributeError(name)
+        return getattr(self._storage, name)
+
+    @property
+    def _nano_storage(self) -> dict:
+        return self._storage._client._NanoVectorDB__storage
+
+    def _fingerprint(self) -> str:
+        return ids_fingerprint([d["__id__"] for d in self._nano_storage["data"]])
+
+    def _release_matrix(self):
+        matrix = self._nano_storage["matrix"]
+        if not self.full_precision_path.exists() or len(matrix) == 0:
+            return
+        memmap = vector_quant.open_full_precision(self.full_precision_path, matrix.shape[1])
+        if memmap.shape == matrix.shape:
+            self._nano_storage["matrix"] = memmap
+
+    async def upsert(self, data: dict):
+        result = await self._storage.upsert(data)
+        self._dirty = True
+        return result
+
+    async def delete(self, ids: list[str]):
+        self._storage._client.delete(ids)
+        self._dirty = True
+
+    async def query(self, query: str, top_k: int = 5):
+        matrix = self._nano_storage["matrix"]
+        use_index = self._index is not None and len(matrix) >= ann_min_vectors()
+        if self._dirty or (not use_index and self._codec is None):
+            return await self._storage.query(query, top_k)
+        embedding = _normalise(np.asarray((await self.embedding_func([query]))[0], dtype=np.float32))
+        candidates = self._index.candidates(embedding, ann_nprobe()) if use_index else np.arange(len(matrix))
+        if self._codec is None:
+            rows, scores = top_rows(candidates, matrix[candidates] @ embedding, top_k)
+        else:
+            factor = vector_quant.rescore_factor()
+            rows, scores = top_rows(
+                candidates,
+                self._codec.score(embedding, candidates if use_index else None),
+                top_k * factor if factor > 0 else top_k,
+            )
+            if factor > 0:
+                # Rescore the best quantized candidates against the full-precision vectors.
+                rows, scores = top_rows(rows, np.asarray(matrix[rows] @ embedding), top_k)
+        data = self._nano_storage["data"]
+        threshold = self._storage.cosine_better_than_threshold
+        return [
+            {**data[row], "id": data[row]["__id__"], "distance": float(score)}
+            for row, score in zip(rows, scores)
+            if score >= threshold
+        ]
+
+    async def flush_vectors(self):
+        """Persist the vectors without rebuilding the index and codes, for intermediate checkpoints."""
+        await self._storage.index_done_callback()
+
+    async def index_done_callback(self):
+        await self._storage.index_done_callback()
+        missing_index = ann_enabled() and self._index is None and len(self._nano_storage["matrix"]) >= ann_min_vectors()
+        missing_codes = self.precision != "float32" and self._codec is None
+        if self._dirty or missing_index or missing_codes:
+            self.build_index()
+        if self._codec is not None:
+            self._strip_matrix()
+
+    def _strip_matrix(self):
+        """Rewrite vdb_<namespace>.json without its matrix, the vectors were just written to the .f32 file."""
+        tmp_path = self.client_file.with_suffix(".tmp.json")
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(
+                {**self._nano_storage, "matrix": "", "matrix_file": self.full_precision_path.name}, file,
+                ensure_ascii=False,
+            )
+        os.replace(tmp_path, self.client_file)
+
+    def build_index(self):
+        matrix = self._nano_storage["matrix"]
+        fingerprint = self._fingerprint()
+        self._dirty = False
+        if ann_enabled() and len(matrix) >= ann_min_vectors():
+            self._index = IVFIndex.build(
+                matrix,
+                default_nlist(len(matrix)),
+                iterations=int(os.getenv("ann_kmeans_iterations", "10")),
+                fingerprint=fingerprint,
+            )
+            self._index.save(self.index_path)
+            logging.info(f"IVF index of {self.index_path.name}: {len(matrix)} vectors in {self._index.nlist} lists")
+        else:
+            self._index = None
+            self.index_path.unlink(missing_ok=True)
+        if self.precision != "float32" and len(matrix):
+            self._codec = vector_quant.encode(matrix, self.precision)
+            vector_quant.save_codec(self._codec, self.codec_path, fingerprint)
+            vector_quant.save_full_precision(matrix, self.full_precision_path)
+            logging.info(
+                f"{self.precision} codes of {self.codec_path.name}: {self._codec.nbytes} bytes "
+                f"instead of {len(matrix) * matrix.shape[1] * 4}"
+            )
+
+
+def vector_storage_enabled() -> bool:
+    return ann_enabled() or vector_quant.quantization_enabled()
+
+
+def install_ann(rag, serving: bool = False):
+    """Route the entity and chunk vector stores of a LightRAG instance through IVF indexes and quantized codes."""
+    for name in ("entities_vdb", "chunks_vdb"):
+        storage = getattr(rag, name)
+        # Only NanoVectorDB storages keep their matrix in process.
+        if hasattr(storage, "_client") and not isinstance(storage, ANNVectorStorage):
+            setattr(rag, name, ANNVectorStorage(storage, serving=serving))
+    return rag
@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+import numpy as np
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def answer_cache_enabled() -> bool:
+    return os.getenv("answer_cache", "off").lower() == "on"
+
+
+def normalise_query(query: str) -> str:
+    return _WHITESPACE.sub(" ", query.casefold()).strip().rstrip("?.! ")
+
+
+def compute_answer_scope(param: dict, kg_version: str | None) -> str:
+    """Answers are only shared between queries run with the same QueryParam against the same KG version."""
+    return hashlib.sha256(
+        json.dumps({"param": param, "kg_version": kg_version}, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+def compute_answer_key(query: str, scope: str) -> str:
+    return hashlib.sha256(f"{scope}\n{normalise_query(query)}".encode("utf-8")).hexdigest()
+
+
+class LeaderCancelled(Exception):
+    """Set on a coalesced computation whose leader was cancelled, so its followers retry instead of failing."""
+
+
+class AnswerCache:
+    """
+    In-memory LRU answer cache with a TTL, plus single-flight coalescing: while a query is being answered,
+    identical queries await the same result instead of running their own retrieval and generation.
+    If the leading query is cancelled (its client went away), the first follower to retry takes the computation over.
+    With semantic_threshold > 0, a miss is also answered by a cached answer of the same scope whose query embedding
+    has at least that cosine similarity.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl_seconds: float = 3600, semantic_threshold: float = 0.0):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.semantic_threshold = semantic_threshold
+        self.hits = 0
+        self.semantic_hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self.evictions = 0
+        # key -> (answer, expires_at, scope, unit query embedding or None)
+        self._entries: OrderedDict[str, tuple] = OrderedDict()
+        # The KG swap clears the cache from a worker thread.
+        self._lock = threading.Lock()
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[1] < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def semantic_get(self, scope: str, embedding: np.ndarray):
+        now = time.monotonic()
+        with self._lock:
+            candidates = [
+                (key, entry) for key, entry in self._entries.items()
+                if entry[2] == scope and entry[3] is not None and entry[1] >= now
+            ]
+            if not candidates:
+                return None
+            similarities = np.stack([entry[3] for _, entry in candidates]) @ embedding
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.semantic_threshold:
+                return None
+            key, entry = candidates[best]
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def put(self, key: str, answer, scope: str, embedding: np.ndarray = None):
+        with self._lock:
+            self._entries[key] = (answer, time.monotonic() + self.ttl_seconds, scope, embedding)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    async def get_or_compute(
+        self,
+        query: str,
+        scope: str,
+        compute: Callable[[], Awaitable],
+        embed: Callable[[str], Awaitable[np.ndarray]] = None,
+    ):
+        key = compute_answer_key(query, scope)
+        while True:
+            answer = self.get(key)
+            if answer is not None:
+                self.hits += 1
+                return answer
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            self.coalesced += 1
+            try:
+                # shield: a follower being cancelled must not cancel the leader's computation.
+                return await asyncio.shield(inflight)
+            except LeaderCancelled:
+                self.coalesced -= 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            embedding = None
+            if self.semantic_threshold > 0 and embed is not None:
+                embedding = np.asarray(await embed(normalise_query(query)), dtype=np.float32).reshape(-1)
+                embedding /= np.linalg.norm(embedding) or 1.0
+                answer = self.semantic_get(scope, embedding)
+            if answer is not None:
+                self.semantic_hits += 1
+            else:
+                self.misses += 1
+                answer = await compute()
+            self.put(key, answer, scope, embedding)
+            future.set_result(answer)
+            return answer
+        except asyncio.CancelledError:
+            # Only this leader was cancelled, not the followers: they retry rather than see the cancellation.
+            future.set_exception(LeaderCancelled())
+            future.exception()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception retrieved, there may be no follower awaiting it.
+            future.exception()
+            raise
+        finally:
+            if self._inflight.get(key) is future:
+                del self._inflight[key]
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.semantic_hits + self.coalesced + self.misses
+        return {
+            "hits": self.hits,
+            "semantic_hits": self.semantic_hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.semantic_hits + self.coalesced) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "in_flight": len(self._inflight),
+        }
+
+
+_answer_cache: AnswerCache | None = None
+
+
+def get_answer_cache() -> AnswerCache:
+    global _answer_cache
+    if _answer_cache is None:
+        _answer_cache = AnswerCache(
+            max_entries=int(os.getenv("answer_cache_max_entries", "1024")),
+            ttl_seconds=float(os.getenv("answer_cache_ttl_seconds", "3600")),
+            semantic_threshold=float(os.getenv("answer_cache_semantic_threshold", "0")),
+        )
+    return _answer_cache
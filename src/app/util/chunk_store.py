@@ -0,0 +1,165 @@
+import asyncio
+import contextvars
+import json
+import os
+from contextlib import contextmanager
+from pathlib import Path
+
+from constant import ROOT
+from src.app.lightRAG.lightrag import operate
+from src.app.lightRAG.lightrag.utils import compute_mdhash_id
+from src.app.lightRAG.lightrag.operate import chunking_by_token_size
+
+# Content-addressed store of per-chunk extraction results, keyed by LightRAG's chunk hash (chunk-<md5>).
+CHUNK_STORE_DIR = ROOT / "chunk_store"
+# Records hold the raw extraction output of their chunk. Older records held a slice of the merged document
+# subgraph and are ignored, so those chunks are extracted again.
+RECORD_VERSION = 2
+
+# Raw entity/relationship records of the ainsert running in this context, by chunk id.
+_extractions: contextvars.ContextVar[dict | None] = contextvars.ContextVar("chunk_extractions", default=None)
+# Open capture_extractions blocks, and LightRAG's extraction handlers they replaced.
+_capture_depth = 0
+_original_handlers: tuple = ()
+
+
+def chunk_store_enabled() -> bool:
+    return os.getenv("chunk_cache", "off").lower() == "on"
+
+
+def _chunk_path(chunk_id: str) -> Path:
+    # Shard by the first two hex chars of the hash to keep directories small.
+    return CHUNK_STORE_DIR / chunk_id[6:8] / f"{chunk_id}.json"
+
+
+def load_chunk(chunk_id: str) -> dict | None:
+    path = _chunk_path(chunk_id)
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as file:
+        record = json.load(file)
+    return record if record.get("version") == RECORD_VERSION else None
+
+
+def save_chunk(chunk_id: str, record: dict):
+    path = _chunk_path(chunk_id)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Concurrent Phase 1 workers may write the same chunk, so replace atomically.
+    tmp_path = path.with_suffix(f".{os.getpid()}.{id(record)}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(record, file, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+async def seed_cached_chunks(p_rag, content: str) -> dict[str, dict]:
+    """
+    Chunk the document exactly like LightRAG.ainsert and pre-load every chunk whose hash is already in the store
+    into p_rag.text_chunks, so ainsert only sends new chunks to the LLM.
+    Returns the cached extraction records by chunk id.
+    """
+    doc_key = compute_mdhash_id(content.strip(), prefix="doc-")
+    chunks = {
+        compute_mdhash_id(dp["content"], prefix="chunk-"): {**dp, "full_doc_id": doc_key}
+        for dp in chunking_by_token_size(
+            content.strip(),
+            overlap_token_size=p_rag.chunk_overlap_token_size,
+            max_token_size=p_rag.chunk_token_size,
+            tiktoken_model=p_rag.tiktoken_model_name,
+        )
+    }
+    cached: dict[str, dict] = {}
+    for chunk_id in chunks:
+        record = load_chunk(chunk_id)
+        if record is not None:
+            cached[chunk_id] = record
+    if cached:
+        await p_rag.text_chunks.upsert({k: chunks[k] for k in cached})
+    return cached
+
+
+def _capturing(handler, kind: str):
+    async def capture(record_attributes: list[str], chunk_key: str):
+        record = await handler(record_attributes, chunk_key)
+        extractions = _extractions.get()
+        if record is not None and extractions is not None:
+            extractions.setdefault(chunk_key, {"entities": [], "relationships": []})[kind].append(dict(record))
+        return record
+
+    return capture
+
+
+@contextmanager
+def capture_extractions():
+    """
+    Collect the raw extraction records of the ainsert calls made in this block, by chunk id: LightRAG's per-record
+    extraction handlers are wrapped while at least one block is open and restored when the last one closes.
+    Concurrent blocks each collect their own ainsert's records.
+    """
+    global _capture_depth, _original_handlers
+    extractions: dict[str, dict] = {}
+    if not chunk_store_enabled():
+        yield extractions
+        return
+    if _capture_depth == 0:
+        _original_handlers = (operate._handle_single_entity_extraction, operate._handle_single_relationship_extraction)
+        operate._handle_single_entity_extraction = _capturing(_original_handlers[0], "entities")
+        operate._handle_single_relationship_extraction = _capturing(_original_handlers[1], "relationships")
+    _capture_depth += 1
+    token = _extractions.set(extractions)
+    try:
+        yield extractions
+    finally:
+        _extractions.reset(token)
+        _capture_depth -= 1
+        if _capture_depth == 0:
+            operate._handle_single_entity_extraction, operate._handle_single_relationship_extraction = _original_handlers
+
+
+def store_extractions(s_doc: dict, extractions: dict[str, dict], skip: dict[str, dict]):
+    """Persist the raw extraction records of every chunk of s_doc that was not served from the store."""
+    for chunk in s_doc["chunks"]:
+        chunk_id = chunk["source_id"]
+        if chunk_id in skip:
+            continue
+        record = extractions.get(chunk_id, {})
+        save_chunk(
+            chunk_id,
+            {
+                "version": RECORD_VERSION,
+                "entities": record.get("entities", []),
+                "relationships": record.get("relationships", []),
+            },
+        )
+
+
+async def merge_cached_chunks(p_rag, cached: dict[str, dict]):
+    """
+    Merge the cached extraction records of the reused chunks into the graph the ainsert of the new chunks built,
+    through LightRAG's own _merge_nodes_then_upsert/_merge_edges_then_upsert, as if they had been extracted by a
+    second ainsert. Relationships are grouped per unordered entity pair, as they end up in the undirected graph.
+    """
+    if not cached:
+        return
+    nodes: dict[str, list[dict]] = {}
+    edges: dict[tuple, list[dict]] = {}
+    for record in cached.values():
+        for entity in record.get("entities", []):
+            nodes.setdefault(entity["entity_name"], []).append(entity)
+        for relationship in record.get("relationships", []):
+            key = tuple(sorted((relationship["src_id"], relationship["tgt_id"])))
+            edges.setdefault(key, []).append(relationship)
+    graph = p_rag.chunk_entity_relation_graph
+    global_config = graph.global_config
+    await asyncio.gather(
+        *[
+            operate._merge_nodes_then_upsert(entity_name, nodes_data, graph, global_config)
+            for entity_name, nodes_data in nodes.items()
+        ]
+    )
+    await asyncio.gather(
+        *[
+            operate._merge_edges_then_upsert(src_id, tgt_id, edges_data, graph, global_config)
+            for (src_id, tgt_id), edges_data in edges.items()
+        ]
+    )
+    await graph.index_done_callback()
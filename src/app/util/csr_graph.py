@@ -0,0 +1,403 @@
+import functools
+import inspect
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+
+
+def csr_graph_enabled() -> bool:
+    return os.getenv("csr_graph", "off").lower() == "on"
+
+
+def graphml_fingerprint(graphml_path: str | Path) -> str:
+    stat = Path(graphml_path).stat()
+    return f"{stat.st_size}:{stat.st_mtime_ns}"
+
+
+class CSRGraph:
+    """
+    Read-only undirected graph with integer-interned node ids and CSR adjacency:
+    the neighbours of node i are indices[indptr[i]:indptr[i + 1]], sorted, with the edge ids in edge_ids.
+    Node degrees and edge ranks (degree of source + degree of target, LightRAG's edge_degree) are precomputed,
+    so a batch of lookups is a few NumPy calls instead of one networkx call per entity.
+    """
+
+    def __init__(
+        self,
+        node_names: list[str],
+        node_data: list[dict],
+        edge_data: list[dict],
+        indptr: np.ndarray,
+        indices: np.ndarray,
+        edge_ids: np.ndarray,
+        edge_src: np.ndarray,
+        edge_tgt: np.ndarray,
+        degrees: np.ndarray,
+        edge_ranks: np.ndarray,
+        fingerprint: str = "",
+    ):
+        self.node_names = node_names
+        self.node_data = node_data
+        self.edge_data = edge_data
+        self.indptr = indptr
+        self.indices = indices
+        self.edge_ids = edge_ids
+        self.edge_src = edge_src
+        self.edge_tgt = edge_tgt
+        self.degrees = degrees
+        self.edge_ranks = edge_ranks
+        self.fingerprint = fingerprint
+        self.node_index = {name: i for i, name in enumerate(node_names)}
+        # Sorted (row * num_nodes + neighbour) of every adjacency slot, for vectorised edge lookups.
+        rows = np.repeat(np.arange(len(node_names), dtype=np.int64), np.diff(indptr))
+        self._slot_keys = rows * len(node_names) + indices
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.node_names)
+
+    @property
+    def num_edges(self) -> int:
+        return len(self.edge_src)
+
+    @classmethod
+    def from_networkx(cls, graph, fingerprint: str = "") -> "CSRGraph":
+        node_names = list(graph.nodes)
+        node_index = {name: i for i, name in enumerate(node_names)}
+        edges = list(graph.edges(data=True))
+        edge_src = np.fromiter((node_index[u] for u, _, _ in edges), dtype=np.int32, count=len(edges))
+        edge_tgt = np.fromiter((node_index[v] for _, v, _ in edges), dtype=np.int32, count=len(edges))
+        num_nodes = len(node_names)
+        # Self-loops count twice towards the degree, like networkx, but take one adjacency slot.
+        degrees = (
+            np.bincount(edge_src, minlength=num_nodes) + np.bincount(edge_tgt, minlength=num_nodes)
+        ).astype(np.int32)
+        reverse = edge_src != edge_tgt
+        rows = np.concatenate([edge_src, edge_tgt[reverse]]).astype(np.int64)
+        cols = np.concatenate([edge_tgt, edge_src[reverse]]).astype(np.int64)
+        slot_edges = np.concatenate([np.arange(len(edges)), np.flatnonzero(reverse)]).astype(np.int32)
+        order = np.lexsort((cols, rows))
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=num_nodes)))).astype(np.int64)
+        return cls(
+            node_names,
+            [dict(data) for _, data in graph.nodes(data=True)],
+            [dict(data) for _, _, data in edges],
+            indptr,
+            cols[order],
+            slot_edges[order],
+            edge_src,
+            edge_tgt,
+            degrees,
+            (degrees[edge_src] + degrees[edge_tgt]).astype(np.int32),
+            fingerprint,
+        )
+
+    def save(self, path: str | Path):
+        """path.npz holds the arrays, path.json the node names and attributes."""
+        path = Path(path)
+        tmp_path = path.with_suffix(".tmp.npz")
+        np.savez(
+            tmp_path,
+            indptr=self.indptr,
+            indices=self.indices,
+            edge_ids=self.edge_ids,
+            edge_src=self.edge_src,
+            edge_tgt=self.edge_tgt,
+            degrees=self.degrees,
+            edge_ranks=self.edge_ranks,
+        )
+        tmp_json = path.with_suffix(".tmp.json")
+        with open(tmp_json, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "fingerprint": self.fingerprint,
+                    "node_names": self.node_names,
+                    "node_data": self.node_data,
+                    "edge_data": self.edge_data,
+                },
+                file,
+                ensure_ascii=False,
+                default=str,
+            )
+        # The JSON is replaced last: its fingerprint marks the pair as complete.
+        os.replace(tmp_path, path.with_suffix(".npz"))
+        os.replace(tmp_json, path.with_suffix(".json"))
+
+    @classmethod
+    def load(cls, path: str | Path) -> "CSRGraph":
+        path = Path(path)
+        with open(path.with_suffix(".json"), encoding="utf-8") as file:
+            attrs = json.load(file)
+        with np.load(path.with_suffix(".npz")) as data:
+            arrays = {key: data[key] for key in data.files}
+        return cls(attrs["node_names"], attrs["node_data"], attrs["edge_data"], fingerprint=attrs["fingerprint"], **arrays)
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (
+            self.indptr, self.indices, self.edge_ids, self.edge_src, self.edge_tgt, self.degrees, self.edge_ranks,
+            self._slot_keys,
+        )
+        return sum(array.nbytes for array in arrays)
+
+    def node_ids(self, names: list[str]) -> np.ndarray:
+        """Interned ids of the nodes, -1 for unknown names."""
+        return np.fromiter((self.node_index.get(name, -1) for name in names), dtype=np.int64, count=len(names))
+
+    def node_degrees(self, names: list[str]) -> np.ndarray:
+        ids = self.node_ids(names)
+        if not self.num_nodes:
+            return np.zeros(len(names), dtype=np.int32)
+        return np.where(ids >= 0, self.degrees[ids], 0)
+
+    def edge_lookup(self, pairs: list[tuple[str, str]]) -> np.ndarray:
+        """Edge ids of the (source, target) pairs in either direction, -1 where there is no such edge."""
+        src = self.node_ids([s for s, _ in pairs])
+        tgt = self.node_ids([t for _, t in pairs])
+        if not len(self._slot_keys):
+            return np.full(len(pairs), -1, dtype=np.int64)
+        keys = src * self.num_nodes + tgt
+        slots = np.minimum(np.searchsorted(self._slot_keys, keys), len(self._slot_keys) - 1)
+        found = (src >= 0) & (tgt >= 0) & (self._slot_keys[slots] == keys)
+        return np.where(found, self.edge_ids[slots], -1)
+
+    def edge_id(self, source: str, target: str) -> int:
+        """Edge id of one (source, target) pair in either direction, -1 if there is no such edge."""
+        i, j = self.node_index.get(source), self.node_index.get(target)
+        if i is None or j is None:
+            return -1
+        start, end = self.indptr[i], self.indptr[i + 1]
+        slot = start + int(np.searchsorted(self.indices[start:end], j))
+        return int(self.edge_ids[slot]) if slot < end and self.indices[slot] == j else -1
+
+    def edge_degrees(self, pairs: list[tuple[str, str]]) -> np.ndarray:
+        """
+        Degree of source plus degree of target, whether or not the edge exists, like networkx edge_degree:
+        the precomputed rank for existing edges, summed node degrees otherwise.
+        """
+        edges = self.edge_lookup(pairs)
+        found = edges >= 0
+        ranks = np.zeros(len(pairs), dtype=np.int64)
+        ranks[found] = self.edge_ranks[edges[found]]
+        if not found.all():
+            absent = [pair for pair, hit in zip(pairs, found.tolist()) if not hit]
+            ranks[~found] = self.node_degrees([s for s, _ in absent]) + self.node_degrees([t for _, t in absent])
+        return ranks
+
+    def neighbours(self, names: list[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Neighbours of a batch of nodes in one gather: (offsets, neighbour ids, edge ids), the neighbours of names[i]
+        being ids[offsets[i]:offsets[i + 1]]. Unknown names have none.
+        """
+        ids = self.node_ids(names)
+        if not self.num_nodes:
+            empty = np.empty(0, dtype=self.indices.dtype)
+            return np.zeros(len(names) + 1, dtype=np.int64), empty, np.empty(0, dtype=self.edge_ids.dtype)
+        known = ids >= 0
+        starts = np.where(known, self.indptr[np.where(known, ids, 0)], 0)
+        counts = np.where(known, self.indptr[np.where(known, ids, 0) + 1] - starts, 0)
+        offsets = np.concatenate(([0], np.cumsum(counts)))
+        slots = np.repeat(starts - offsets[:-1], counts) + np.arange(offsets[-1])
+        return offsets, self.indices[slots], self.edge_ids[slots]
+
+
+class CSRGraphStorage:
+    """
+    Read-only stand-in for the NetworkXStorage of a served KG, answering LightRAG's graph queries from a CSRGraph.
+    Per-call methods keep the storage interface with scalar lookups, the batch ones (get_nodes, get_nodes_edges,
+    get_edges, edge_degrees) resolve the neighbourhood of a whole set of retrieved entities at once, for
+    install_batch_local_query.
+    """
+
+    def __init__(self, storage, graph: CSRGraph):
+        self.namespace = storage.namespace
+        self.global_config = storage.global_config
+        self.embedding_func = getattr(storage, "embedding_func", None)
+        self.graph = graph
+
+    @property
+    def nbytes(self) -> int:
+        return self.graph.nbytes
+
+    async def has_node(self, node_id: str) -> bool:
+        return node_id in self.graph.node_index
+
+    async def has_edge(self, source_node_id: str, target_node_id: str) -> bool:
+        return self.graph.edge_id(source_node_id, target_node_id) >= 0
+
+    async def node_degree(self, node_id: str) -> int:
+        i = self.graph.node_index.get(node_id)
+        return 0 if i is None else int(self.graph.degrees[i])
+
+    async def edge_degree(self, src_id: str, tgt_id: str) -> int:
+        edge = self.graph.edge_id(src_id, tgt_id)
+        if edge >= 0:
+            return int(self.graph.edge_ranks[edge])
+        return await self.node_degree(src_id) + await self.node_degree(tgt_id)
+
+    async def get_node(self, node_id: str) -> dict | None:
+        i = self.graph.node_index.get(node_id)
+        return None if i is None else self.graph.node_data[i]
+
+    async def get_edge(self, source_node_id: str, target_node_id: str) -> dict | None:
+        edge = self.graph.edge_id(source_node_id, target_node_id)
+        return self.graph.edge_data[edge] if edge >= 0 else None
+
+    async def get_node_edges(self, source_node_id: str) -> list[tuple[str, str]] | None:
+        i = self.graph.node_index.get(source_node_id)
+        if i is None:
+            return None
+        names = self.graph.node_names
+        neighbours = self.graph.indices[self.graph.indptr[i] : self.graph.indptr[i + 1]].tolist()
+        return [(source_node_id, names[j]) for j in neighbours]
+
+    async def get_nodes(self, node_ids: list[str]) -> list[dict | None]:
+        ids = self.graph.node_ids(node_ids)
+        return [self.graph.node_data[i] if i >= 0 else None for i in ids.tolist()]
+
+    async def get_nodes_edges(self, node_ids: list[str]) -> list[list[tuple[str, str]]]:
+        offsets, neighbours, _ = self.graph.neighbours(node_ids)
+        names = self.graph.node_names
+        neighbours = neighbours.tolist()
+        return [
+            [(node_id, names[j]) for j in neighbours[offsets[i] : offsets[i + 1]]]
+            for i, node_id in enumerate(node_ids)
+        ]
+
+    async def get_edges(self, pairs: list[tuple[str, str]]) -> list[dict | None]:
+        return [self.graph.edge_data[e] if e >= 0 else None for e in self.graph.edge_lookup(pairs).tolist()]
+
+    async def edge_degrees(self, pairs: list[tuple[str, str]]) -> list[int]:
+        return self.graph.edge_degrees(pairs).tolist()
+
+    async def upsert_node(self, node_id: str, node_data: dict):
+        raise RuntimeError("CSRGraphStorage is read-only storage, Phase 2 writes through NetworkXStorage")
+
+    async def upsert_edge(self, source_node_id: str, target_node_id: str, edge_data: dict):
+        raise RuntimeError("CSRGraphStorage is read-only storage, Phase 2 writes through NetworkXStorage")
+
+    async def index_done_callback(self):
+        pass
+
+
+class PrefetchedGraph:
+    """
+    The neighbourhood of a batch of entities, fetched from a CSRGraphStorage with a few batch calls: their edges,
+    the one-hop nodes, and the data and degree of every edge. LightRAG's per-entity calls during local-query expansion
+    are answered from it, anything else goes to the storage.
+    """
+
+    def __init__(self, storage: CSRGraphStorage):
+        self._storage = storage
+        self._node_edges: dict[str, list | None] = {}
+        self._nodes: dict[str, dict | None] = {}
+        self._edges: dict[tuple[str, str], dict | None] = {}
+        self._edge_degrees: dict[tuple[str, str], int] = {}
+
+    def __getattr__(self, name):
+        return getattr(self._storage, name)
+
+    @classmethod
+    async def fetch(cls, storage: CSRGraphStorage, entity_names: list[str]) -> "PrefetchedGraph":
+        view = cls(storage)
+        entity_names = list(dict.fromkeys(entity_names))
+        node_edges = await storage.get_nodes_edges(entity_names)
+        for name, edges in zip(entity_names, node_edges):
+            view._node_edges[name] = edges if name in storage.graph.node_index else None
+        one_hop = list(dict.fromkeys(e[1] for edges in node_edges for e in edges))
+        nodes = list(dict.fromkeys(entity_names + one_hop))
+        view._nodes = dict(zip(nodes, await storage.get_nodes(nodes)))
+        # LightRAG looks edges up by their sorted endpoints.
+        pairs = list(dict.fromkeys(tuple(sorted(e)) for edges in node_edges for e in edges))
+        view._edges = dict(zip(pairs, await storage.get_edges(pairs)))
+        view._edge_degrees = dict(zip(pairs, await storage.edge_degrees(pairs)))
+        return view
+
+    async def get_node_edges(self, source_node_id: str):
+        if source_node_id in self._node_edges:
+            return self._node_edges[source_node_id]
+        return await self._storage.get_node_edges(source_node_id)
+
+    async def get_node(self, node_id: str):
+        if node_id in self._nodes:
+            return self._nodes[node_id]
+        return await self._storage.get_node(node_id)
+
+    async def get_edge(self, source_node_id: str, target_node_id: str):
+        if (source_node_id, target_node_id) in self._edges:
+            return self._edges[(source_node_id, target_node_id)]
+        return await self._storage.get_edge(source_node_id, target_node_id)
+
+    async def edge_degree(self, src_id: str, tgt_id: str) -> int:
+        if (src_id, tgt_id) in self._edge_degrees:
+            return self._edge_degrees[(src_id, tgt_id)]
+        return await self._storage.edge_degree(src_id, tgt_id)
+
+
+def _batched(expansion):
+    """Run a LightRAG local-query expansion step on the prefetched neighbourhood when it queries a CSR graph."""
+    signature = inspect.signature(expansion)
+
+    @functools.wraps(expansion)
+    async def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        storage = bound.arguments.get("knowledge_graph_inst")
+        if isinstance(storage, CSRGraphStorage):
+            bound.arguments["knowledge_graph_inst"] = await PrefetchedGraph.fetch(
+                storage, [dp["entity_name"] for dp in bound.arguments["node_datas"]]
+            )
+        return await expansion(*bound.args, **bound.kwargs)
+
+    wrapper.batched = True
+    return wrapper
+
+
+def install_batch_local_query():
+    """
+    Patch LightRAG's local-query expansion (_find_most_related_text_unit_from_entities and
+    _find_most_related_edges_from_entities) to resolve the retrieved entities' neighbourhood with one batch of CSR
+    lookups instead of one awaited graph call per entity, edge and one-hop node. Other graph storages are untouched.
+    """
+    from src.app.lightRAG.lightrag import operate
+
+    for name in ("_find_most_related_text_unit_from_entities", "_find_most_related_edges_from_entities"):
+        expansion = getattr(operate, name)
+        if not getattr(expansion, "batched", False):
+            setattr(operate, name, _batched(expansion))
+
+
+def csr_path(storage) -> Path:
+    return Path(storage.global_config["working_dir"]) / f"graph_{storage.namespace}.csr"
+
+
+def graphml_path(storage) -> Path:
+    return Path(getattr(
+        storage, "_graphml_xml_file",
+        os.path.join(storage.global_config["working_dir"], f"graph_{storage.namespace}.graphml"),
+    ))
+
+
+def write_csr_graph(storage):
+    """Build the CSR form of a merged NetworkXStorage graph, after its GraphML was written."""
+    graph = CSRGraph.from_networkx(storage._graph, fingerprint=graphml_fingerprint(graphml_path(storage)))
+    graph.save(csr_path(storage))
+    logging.info(f"CSR graph of {csr_path(storage).name}: {graph.num_nodes} nodes, {graph.num_edges} edges")
+
+
+def install_csr_graph(rag):
+    """Answer the graph queries of a serving LightRAG instance from the CSR graph built at merge time, if current."""
+    storage = rag.chunk_entity_relation_graph
+    path = csr_path(storage)
+    if isinstance(storage, CSRGraphStorage) or not path.with_suffix(".json").exists():
+        return rag
+    graph = CSRGraph.load(path)
+    if not graphml_path(storage).exists() or graph.fingerprint != graphml_fingerprint(graphml_path(storage)):
+        # The GraphML was rewritten after the CSR graph was built, keep networkx.
+        logging.warning(f"Stale CSR graph {path.name}, serving the GraphML")
+        return rag
+    rag.chunk_entity_relation_graph = CSRGraphStorage(storage, graph)
+    install_batch_local_query()
+    return rag
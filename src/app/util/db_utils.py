@@ -1,5 +1,5 @@
 from urllib import parse
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker
 from dotenv import load_dotenv
 import os
@@ -27,8 +27,23 @@ def get_db():
     finally:
         db.close()
 
-def get_sessionmaker():
-    return sessionmaker(bind=get_engine(), autoflush=False, autocommit=False)
-
+_sessionmaker = None
 
-    
+def get_sessionmaker():
+    global _sessionmaker
+    # One engine, and so one connection pool, per process instead of a new engine for every session.
+    if _sessionmaker is None:
+        _sessionmaker = sessionmaker(bind=get_engine(), autoflush=False, autocommit=False)
+    return _sessionmaker
+
+def migrate_schema():
+    """
+    Idempotent DDL for columns added after the tables were created:
+        request_token.cached: 1 for LLM responses served from the llm_cache, existing rows count as 0
+    """
+    with get_sessionmaker()() as db:
+        db.execute(text(
+            "IF COL_LENGTH('request_token', 'cached') IS NULL "
+            "ALTER TABLE request_token ADD cached INT NOT NULL CONSTRAINT DF_request_token_cached DEFAULT 0"
+        ))
+        db.commit()
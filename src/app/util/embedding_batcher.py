@@ -0,0 +1,133 @@
+import asyncio
+import os
+import time
+import weakref
+from typing import Awaitable, Callable
+
+import numpy as np
+
+
+def embedding_batch_enabled() -> bool:
+    return os.getenv("embedding_batch", "off").lower() == "on"
+
+
+class EmbeddingBatcher:
+    """
+    Collects concurrent embedding calls for up to max_wait_ms, or until max_texts distinct texts are waiting,
+    sends them as one request with identical texts deduplicated, and hands every caller back its own rows.
+    Bound to the event loop it was created on.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[list[str]], Awaitable[np.ndarray]],
+        max_texts: int = 64,
+        max_wait_ms: float = 5,
+    ):
+        self._send = send
+        self.max_texts = max_texts
+        self.max_wait = max_wait_ms / 1000
+        # (texts, future, enqueued_at) of the callers in the batch being collected
+        self._pending: list[tuple[list[str], asyncio.Future, float]] = []
+        self._pending_texts: dict[str, None] = {}
+        self._timer: asyncio.TimerHandle | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self.calls = 0
+        self.batches = 0
+        self.texts = 0
+        self.sent_texts = 0
+        self.max_batch_size = 0
+        self.total_wait = 0.0
+        self.max_wait_seen = 0.0
+
+    async def embed(self, texts: list[str]) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((list(texts), future, time.perf_counter()))
+        self._pending_texts.update(dict.fromkeys(texts))
+        self.calls += 1
+        self.texts += len(texts)
+        if len(self._pending_texts) >= self.max_texts:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, texts = self._pending, list(self._pending_texts)
+        self._pending, self._pending_texts = [], {}
+        task = asyncio.get_running_loop().create_task(self._send_batch(batch, texts))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send_batch(self, batch: list[tuple[list[str], asyncio.Future, float]], texts: list[str]):
+        sent_at = time.perf_counter()
+        self.batches += 1
+        self.sent_texts += len(texts)
+        self.max_batch_size = max(self.max_batch_size, len(texts))
+        for _, _, enqueued_at in batch:
+            self.total_wait += sent_at - enqueued_at
+            self.max_wait_seen = max(self.max_wait_seen, sent_at - enqueued_at)
+        try:
+            vectors = np.asarray(await self._send(texts))
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        rows = {text: i for i, text in enumerate(texts)}
+        for caller_texts, future, _ in batch:
+            if not future.done():
+                future.set_result(vectors[[rows[text] for text in caller_texts]])
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "batches": self.batches,
+            "texts": self.texts,
+            "sent_texts": self.sent_texts,
+            "deduplicated_texts": self.texts - self.sent_texts - sum(len(t) for t, _, _ in self._pending),
+            "avg_batch_size": self.sent_texts / self.batches if self.batches else 0.0,
+            "max_batch_size": self.max_batch_size,
+            "total_wait_ms": 1000 * self.total_wait,
+            "avg_wait_ms": 1000 * self.total_wait / self.calls if self.calls else 0.0,
+            "max_wait_ms": 1000 * self.max_wait_seen,
+        }
+
+
+# One batcher per event loop: the server loop, and the private loops of sync rag.query calls and Phase 2 workers.
+_batchers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, EmbeddingBatcher]" = weakref.WeakKeyDictionary()
+
+
+def get_embedding_batcher(send: Callable[[list[str]], Awaitable[np.ndarray]]) -> EmbeddingBatcher:
+    loop = asyncio.get_running_loop()
+    batcher = _batchers.get(loop)
+    if batcher is None:
+        batcher = EmbeddingBatcher(
+            send,
+            max_texts=int(os.getenv("embedding_batch_max_texts", "64")),
+            max_wait_ms=float(os.getenv("embedding_batch_max_wait_ms", "5")),
+        )
+        _batchers[loop] = batcher
+    return batcher
+
+
+def batcher_stats() -> dict:
+    """Stats summed over the batchers of all live event loops."""
+    totals: dict = {}
+    for batcher in list(_batchers.values()):
+        for name, value in batcher.stats().items():
+            if name.startswith("max_"):
+                totals[name] = max(totals.get(name, 0), value)
+            elif not name.startswith("avg_"):
+                totals[name] = totals.get(name, 0) + value
+    if totals.get("batches"):
+        totals["avg_batch_size"] = totals["sent_texts"] / totals["batches"]
+    if totals.get("calls"):
+        totals["avg_wait_ms"] = totals["total_wait_ms"] / totals["calls"]
+    return totals
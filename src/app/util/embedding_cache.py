@@ -0,0 +1,115 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+import numpy as np
+
+from constant import ROOT
+
+EMBEDDING_CACHE_DIR = ROOT / "embedding_cache"
+
+
+def embedding_cache_enabled() -> bool:
+    return os.getenv("embedding_cache", "off").lower() == "on"
+
+
+def compute_embedding_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\n{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache keyed by hash(model + text).
+    Vectors are appended as float32 rows to vectors.f32 and read back through np.memmap,
+    a SQLite index maps each key to its row.
+    Phase 1 and Phase 2 (including its worker processes) share the same cache directory,
+    so chunks embedded in Phase 1 are not embedded again when the global KG is built.
+    """
+
+    def __init__(self, cache_dir: str | Path, dim: int):
+        self.cache_dir = Path(cache_dir)
+        self.dim = dim
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._matrix: np.memmap | None = None
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.vectors_path = self.cache_dir / f"vectors_{dim}.f32"
+        self.vectors_path.touch(exist_ok=True)
+        with self._connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS embedding_cache (key TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+
+    @contextmanager
+    def _connection(self):
+        """A connection committed on success, rolled back on error, and closed in both cases."""
+        conn = sqlite3.connect(self.cache_dir / f"index_{self.dim}.sqlite", timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _rows(self, max_row: int) -> np.ndarray:
+        # Re-map the vector file whenever other writers have appended past the current mapping.
+        if self._matrix is None or max_row >= self._matrix.shape[0]:
+            rows = self.vectors_path.stat().st_size // (self.dim * 4)
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        return self._matrix
+
+    def get_many(self, keys: list[str]) -> dict[str, np.ndarray]:
+        if not keys:
+            return {}
+        found: dict[str, int] = {}
+        with self._lock, self._connection() as conn:
+            unique_keys = list(dict.fromkeys(keys))
+            for i in range(0, len(unique_keys), 500):
+                batch = unique_keys[i : i + 500]
+                found.update(
+                    conn.execute(
+                        f"SELECT key, row FROM embedding_cache WHERE key IN ({','.join('?' * len(batch))})",
+                        batch,
+                    ).fetchall()
+                )
+            self.hits += len(found)
+            self.misses += len(unique_keys) - len(found)
+            if not found:
+                return {}
+            matrix = self._rows(max(found.values()))
+            return {key: np.array(matrix[row]) for key, row in found.items()}
+
+    def put_many(self, keys: list[str], vectors: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        with self._lock, self._connection() as conn:
+            # The write lock serialises appenders across processes, so row numbers follow the file size.
+            conn.execute("BEGIN IMMEDIATE")
+            start_row = self.vectors_path.stat().st_size // (self.dim * 4)
+            with open(self.vectors_path, "r+b") as file:
+                file.seek(start_row * self.dim * 4)
+                file.write(vectors.tobytes())
+            conn.executemany(
+                "INSERT OR REPLACE INTO embedding_cache VALUES (?, ?)",
+                [(key, start_row + i) for i, key in enumerate(keys)],
+            )
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "vectors": self.vectors_path.stat().st_size // (self.dim * 4),
+            "size_bytes": self.vectors_path.stat().st_size,
+        }
+
+
+_embedding_cache: EmbeddingCache | None = None
+
+
+def get_embedding_cache(dim: int) -> EmbeddingCache:
+    global _embedding_cache
+    if _embedding_cache is None:
+        _embedding_cache = EmbeddingCache(EMBEDDING_CACHE_DIR, dim)
+    return _embedding_cache
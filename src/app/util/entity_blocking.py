@@ -0,0 +1,143 @@
+import os
+import re
+import zlib
+from typing import Callable, Iterable
+
+import numpy as np
+
+# Mersenne-like prime above 2**32: a * x + b stays below 2**64 for 32-bit a, b and x.
+_PRIME = np.uint64(4294967311)
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+
+
+def entity_blocking_enabled() -> bool:
+    return os.getenv("entity_blocking", "off").lower() == "on"
+
+
+def _singular(token: str) -> str:
+    if len(token) > 4 and token.endswith("ies"):
+        return token[:-3] + "y"
+    if len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+        return token[:-1]
+    return token
+
+
+def normalise_entity_name(name: str) -> str:
+    """Case, punctuation and plural insensitive form of an entity name, e.g. '"Neural-Networks"' -> 'neural network'."""
+    tokens = _NON_ALNUM.sub(" ", name.strip().strip('"').casefold()).split()
+    return " ".join(_singular(token) for token in tokens)
+
+
+def name_shingles(name: str, k: int = 3) -> set[str]:
+    padded = f" {normalise_entity_name(name)} "
+    if len(padded) <= k:
+        return {padded}
+    return {padded[i : i + k] for i in range(len(padded) - k + 1)}
+
+
+def shingle_jaccard(a: set[str], b: set[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+class MinHashLSH:
+    """
+    MinHash signatures over character shingles of the normalised entity names, split into bands:
+    names sharing any band bucket become candidate pairs, so only likely near-duplicates are ever compared.
+    With the default 16 bands of 4 rows, pairs above ~0.5 shingle Jaccard are very likely to collide.
+    """
+
+    def __init__(self, num_perm: int = 64, bands: int = 16, seed: int = 1, max_bucket_size: int = 200):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.bands = bands
+        self.rows = num_perm // bands
+        # Buckets larger than this are treated as uninformative (e.g. very short names) and skipped.
+        self.max_bucket_size = max_bucket_size
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 2**32, size=(num_perm, 1), dtype=np.uint64)
+        self._b = rng.integers(0, 2**32, size=(num_perm, 1), dtype=np.uint64)
+        self._buckets: dict[tuple[int, bytes], list[str]] = {}
+        self.shingles: dict[str, set[str]] = {}
+
+    def signature(self, shingles: set[str]) -> np.ndarray:
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+        return ((self._a * hashes + self._b) % _PRIME).min(axis=1)
+
+    def add(self, key: str, name: str = None):
+        if key in self.shingles:
+            return
+        shingles = name_shingles(key if name is None else name)
+        self.shingles[key] = shingles
+        signature = self.signature(shingles)
+        for band in range(self.bands):
+            band_key = (band, signature[band * self.rows : (band + 1) * self.rows].tobytes())
+            self._buckets.setdefault(band_key, []).append(key)
+
+    def add_many(self, keys: Iterable[str]):
+        for key in keys:
+            self.add(key)
+
+    def candidate_pairs(self) -> set[tuple[str, str]]:
+        pairs = set()
+        for members in self._buckets.values():
+            if len(members) < 2 or len(members) > self.max_bucket_size:
+                continue
+            for i, a in enumerate(members):
+                for b in members[i + 1 :]:
+                    pairs.add((a, b) if a < b else (b, a))
+        return pairs
+
+
+def propose_merges(
+    names: Iterable[str],
+    threshold: float = 0.8,
+    vector_lookup: Callable[[list[str]], dict[str, np.ndarray]] = None,
+    embedding_threshold: float = 0.0,
+    index: MinHashLSH = None,
+) -> list[dict]:
+    """
+    Candidate merges among names, in near-linear time through the LSH index.
+    A pair is proposed when the normalised names are equal or their shingle Jaccard reaches threshold;
+    with vector_lookup and embedding_threshold > 0, pairs whose vectors are both known must also reach that cosine.
+    """
+    if index is None:
+        index = MinHashLSH()
+    index.add_many(names)
+    proposals = []
+    for a, b in sorted(index.candidate_pairs()):
+        score = shingle_jaccard(index.shingles[a], index.shingles[b])
+        if score >= threshold or normalise_entity_name(a) == normalise_entity_name(b):
+            proposals.append({"entities": [a, b], "name_jaccard": round(score, 4)})
+    if vector_lookup is None or embedding_threshold <= 0 or not proposals:
+        return proposals
+    vectors = vector_lookup(sorted({name for p in proposals for name in p["entities"]}))
+    refined = []
+    for proposal in proposals:
+        a, b = proposal["entities"]
+        if a in vectors and b in vectors:
+            cosine = float(
+                np.dot(vectors[a], vectors[b]) / (np.linalg.norm(vectors[a]) * np.linalg.norm(vectors[b]) or 1.0)
+            )
+            if cosine < embedding_threshold:
+                continue
+            proposal["embedding_cosine"] = round(cosine, 4)
+        refined.append(proposal)
+    return refined
+
+
+def cluster_proposals(proposals: list[dict]) -> dict[str, str]:
+    """Union-find over proposed pairs: each name in a cluster mapped to the cluster's smallest name."""
+    parent: dict[str, str] = {}
+
+    def find(name: str) -> str:
+        parent.setdefault(name, name)
+        while parent[name] != name:
+            parent[name] = parent[parent[name]]
+            name = parent[name]
+        return name
+
+    for proposal in proposals:
+        a, b = (find(name) for name in proposal["entities"])
+        if a != b:
+            parent[max(a, b)] = min(a, b)
+    return {name: find(name) for name in parent}
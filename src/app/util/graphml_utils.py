@@ -0,0 +1,84 @@
+from pathlib import Path
+from typing import Iterator
+import xml.etree.ElementTree as ET
+
+
+def _local_name(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+def iter_graphml(file_path: str | Path) -> Iterator[tuple[str, dict]]:
+    """
+    Stream a GraphML file and yield ("node", attrs) / ("edge", attrs) one element at a time.
+    Data keys are resolved to their attr.name through the <key> header instead of hard-coded d0..d6,
+    and every element is cleared and detached from its <graph> once yielded, so memory stays flat on large merged graphs.
+    """
+    keys: dict[str, str] = {}
+    graph = None
+    for event, elem in ET.iterparse(str(file_path), events=("start", "end")):
+        if event == "start":
+            if graph is None and _local_name(elem.tag) == "graph":
+                graph = elem
+            continue
+        tag = _local_name(elem.tag)
+        if tag == "key":
+            keys[elem.get("id")] = elem.get("attr.name", elem.get("id"))
+        elif tag in ("node", "edge"):
+            attrs = {
+                keys.get(data.get("key"), data.get("key")): data.text or ""
+                for data in elem
+                if _local_name(data.tag) == "data"
+            }
+            if tag == "node":
+                attrs["id"] = elem.get("id")
+            else:
+                attrs["source"] = elem.get("source")
+                attrs["target"] = elem.get("target")
+            yield tag, attrs
+            elem.clear()
+            if graph is not None:
+                # Earlier siblings are already detached, so this is the first child (later ones are parser read-ahead).
+                graph.remove(elem)
+
+
+def entity_from_attrs(attrs: dict) -> dict:
+    return {
+        "entity_name": attrs["id"],
+        "entity_type": attrs.get("entity_type", ""),
+        "description": attrs.get("description", ""),
+        "source_id": attrs.get("source_id", ""),
+    }
+
+
+def relationship_from_attrs(attrs: dict) -> dict:
+    return {
+        "src_id": attrs["source"],
+        "tgt_id": attrs["target"],
+        "weight": attrs.get("weight", ""),
+        "description": attrs.get("description", ""),
+        "keywords": attrs.get("keywords", ""),
+        "source_id": attrs.get("source_id", ""),
+    }
+
+
+def iter_entities(file_path: str | Path) -> Iterator[dict]:
+    for tag, attrs in iter_graphml(file_path):
+        if tag == "node":
+            yield entity_from_attrs(attrs)
+
+
+def iter_relationships(file_path: str | Path) -> Iterator[dict]:
+    for tag, attrs in iter_graphml(file_path):
+        if tag == "edge":
+            yield relationship_from_attrs(attrs)
+
+
+def read_subgraph(file_path: str | Path) -> tuple[list[dict], list[dict]]:
+    """Entities and relationships of a LightRAG graph in a single streaming pass."""
+    entities, relationships = [], []
+    for tag, attrs in iter_graphml(file_path):
+        if tag == "node":
+            entities.append(entity_from_attrs(attrs))
+        else:
+            relationships.append(relationship_from_attrs(attrs))
+    return entities, relationships
@@ -0,0 +1,86 @@
+import asyncio
+import os
+import weakref
+from contextlib import asynccontextmanager
+
+import httpx
+
+# Clients are bound to the event loop that opened their connections: one pooled client per scoped loop
+# (the server loop via the FastAPI lifespan, each Phase 2 worker's loop via run_with_pooled_client).
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = weakref.WeakKeyDictionary()
+http_stats = {"requests": 0, "in_flight": 0, "unpooled_requests": 0}
+
+
+def http2_enabled() -> bool:
+    return os.getenv("http2", "off").lower() == "on"
+
+
+def new_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=int(os.getenv("http_pool_max_connections", "100")),
+            max_keepalive_connections=int(os.getenv("http_pool_max_keepalive", "20")),
+            keepalive_expiry=float(os.getenv("http_keepalive_seconds", "30")),
+        ),
+        timeout=httpx.Timeout(
+            float(os.getenv("http_timeout_seconds", "300")),
+            connect=float(os.getenv("http_connect_timeout_seconds", "10")),
+        ),
+        http2=http2_enabled(),
+    )
+
+
+@asynccontextmanager
+async def pooled_client():
+    """Open the pooled client of the running loop for the duration of the block, and close it cleanly afterwards."""
+    loop = asyncio.get_running_loop()
+    client = new_client()
+    _clients[loop] = client
+    try:
+        yield client
+    finally:
+        _clients.pop(loop, None)
+        await client.aclose()
+
+
+async def run_with_pooled_client(coro):
+    async with pooled_client():
+        return await coro
+
+
+@asynccontextmanager
+async def client():
+    """
+    The pooled client of the running loop. Loops without one (e.g. the private loop of a sync rag.query)
+    get a short-lived client, as every call did before pooling.
+    """
+    http_stats["requests"] += 1
+    http_stats["in_flight"] += 1
+    try:
+        pooled = _clients.get(asyncio.get_running_loop())
+        if pooled is not None and not pooled.is_closed:
+            yield pooled
+            return
+        http_stats["unpooled_requests"] += 1
+        async with new_client() as unpooled:
+            yield unpooled
+    finally:
+        http_stats["in_flight"] -= 1
+
+
+def pool_stats() -> dict:
+    connections = idle = 0
+    for pooled in list(_clients.values()):
+        # httpcore's pool behind the default transport, absent for custom transports.
+        pool = getattr(getattr(pooled, "_transport", None), "_pool", None)
+        for connection in getattr(pool, "connections", []):
+            connections += 1
+            idle += connection.is_idle()
+    return {
+        **http_stats,
+        "pooled_clients": len(_clients),
+        "connections": connections,
+        "idle_connections": idle,
+        "active_connections": connections - idle,
+        "http2": http2_enabled(),
+    }
@@ -0,0 +1,140 @@
+import json
+import os
+from pathlib import Path
+
+from src.app.lightRAG.lightrag.lightrag import (
+    EntityAccumulator,
+    RelationshipAccumulator,
+    merge_custom_entity,
+    merge_custom_relationship,
+)
+
+# Per base_entry record of which subgraph contributed each entity, relationship and chunk fragment.
+LEDGER_FILE = "kg_contributions.json"
+KINDS = ("entities", "relationships", "chunks")
+
+
+def incremental_enabled() -> bool:
+    return os.getenv("phase2_incremental", "off").lower() == "on"
+
+
+def incremental_verify_enabled() -> bool:
+    return os.getenv("phase2_incremental_verify", "off").lower() == "on"
+
+
+def new_ledger() -> dict:
+    """
+    docs: doc_id -> keys it contributed to, per kind
+    entities / relationships / chunks: key -> [[doc_id, data], ...] in merge order
+    """
+    return {"docs": {}, "entities": {}, "relationships": {}, "chunks": {}}
+
+
+def load_ledger(working_dir: str | Path) -> dict | None:
+    path = Path(working_dir) / LEDGER_FILE
+    if not path.exists():
+        return None
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def save_ledger(working_dir: str | Path, ledger: dict):
+    path = Path(working_dir) / LEDGER_FILE
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(ledger, file, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def remove_docs(ledger: dict, doc_ids: list[str]) -> dict[str, set]:
+    """Drop every fragment contributed by doc_ids and return the keys whose merged value changed."""
+    affected = {kind: set() for kind in KINDS}
+    for doc_id in doc_ids:
+        doc_keys = ledger["docs"].pop(doc_id, None)
+        if doc_keys is None:
+            continue
+        for kind in KINDS:
+            for key in set(doc_keys.get(kind, [])):
+                remaining = [c for c in ledger[kind].get(key, []) if c[0] != doc_id]
+                if remaining:
+                    ledger[kind][key] = remaining
+                else:
+                    ledger[kind].pop(key, None)
+                affected[kind].add(key)
+    return affected
+
+
+def replay_entity(ledger: dict, entity_name: str, accumulate: bool = False):
+    """Merged node data (or an EntityAccumulator when accumulate) of an entity, None when nothing contributes to it."""
+    contributions = ledger["entities"].get(entity_name, [])
+    if not contributions:
+        return None
+    if accumulate:
+        accumulator = EntityAccumulator()
+        for _, data in contributions:
+            accumulator.add(data)
+        return accumulator
+    node_data = None
+    for _, data in contributions:
+        node_data = merge_custom_entity(node_data, data)
+    return node_data
+
+
+def reorder_docs(ledger: dict, doc_ids: list[str], affected: dict[str, set]):
+    """
+    Put the docs in doc_ids order (the sorted file order of a full merge) and re-sort the fragments of the affected
+    keys accordingly, in place. Docs applied incrementally are appended, a full merge would have folded them at their
+    file position. The sort is stable, so a doc's own fragments keep their order.
+    """
+    position = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+    ledger["docs"] = {doc_id: ledger["docs"][doc_id] for doc_id in sorted(ledger["docs"], key=position.__getitem__)}
+    for kind in KINDS:
+        for key in affected[kind]:
+            if key in ledger[kind]:
+                ledger[kind][key].sort(key=lambda contribution: position[contribution[0]])
+
+
+def doc_order(ledger: dict) -> dict[str, int]:
+    return {doc_id: position for position, doc_id in enumerate(ledger["docs"])}
+
+
+def relationship_contributions(ledger: dict, src_id: str, tgt_id: str, order: dict[str, int] = None) -> list:
+    """
+    Contributions of both directions of an undirected relationship, interleaved in merge order: docs in ledger order,
+    and within a doc in the order its relationships were folded.
+    """
+    keys = list(dict.fromkeys((f"{src_id}######{tgt_id}", f"{tgt_id}######{src_id}")))
+    by_key = {key: ledger["relationships"].get(key, []) for key in keys}
+    if sum(1 for contributions in by_key.values() if contributions) < 2:
+        return [c for contributions in by_key.values() for c in contributions]
+    if order is None:
+        order = doc_order(ledger)
+    pending = {key: iter(contributions) for key, contributions in by_key.items()}
+    docs = sorted({c[0] for contributions in by_key.values() for c in contributions}, key=order.__getitem__)
+    merged = []
+    for doc_id in docs:
+        for key in ledger["docs"][doc_id]["relationships"]:
+            if key in pending:
+                merged.append(next(pending[key]))
+    return merged
+
+
+def replay_relationship(ledger: dict, src_id: str, tgt_id: str, accumulate: bool = False, order: dict = None):
+    """
+    Merged edge data (or a RelationshipAccumulator when accumulate) of the undirected relationship, folding the
+    contributions of both directions like a full merge, None when nothing contributes to it.
+    """
+    contributions = relationship_contributions(ledger, src_id, tgt_id, order)
+    if not contributions:
+        return None
+    if accumulate:
+        accumulator = RelationshipAccumulator()
+        for _, (data, source_chunk_id) in contributions:
+            accumulator.add(data, source_chunk_id)
+        return accumulator
+    edge_data = None
+    for _, (data, source_chunk_id) in contributions:
+        edge_data = merge_custom_relationship(edge_data, data, source_chunk_id)
+    # The edge keeps the direction it was first seen in, as the first upsert of a full merge leaves it.
+    first = contributions[0][1][0]
+    return {"src_id": first["src_id"], "tgt_id": first["tgt_id"], **edge_data}
@@ -0,0 +1,293 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable
+
+import numpy as np
+
+
+def kg_memory_budget_bytes() -> int:
+    """Resident size the loaded KGs may take together before least-recently-used ones are unloaded (0 = unlimited)."""
+    return int(float(os.getenv("kg_memory_budget_mb", "0")) * 1024 * 1024)
+
+
+class KGNotFound(Exception):
+    pass
+
+
+def valid_base_entry(base_entry: str) -> bool:
+    # base_entry becomes a directory name under the KG version, never a path.
+    return bool(base_entry) and base_entry == Path(base_entry).name and not base_entry.startswith(".")
+
+
+def resident_bytes(rag) -> int:
+    """
+    Estimated memory held by a loaded LightRAG instance: the in-memory vector matrices (memory-mapped ones excluded),
+    quantized codes, IVF indexes and CSR graph arrays, plus the on-disk size of the KV stores, graph and graph
+    attributes it loads into dicts and networkx.
+    """
+    total = 0
+    for name in ("entities_vdb", "relationships_vdb", "chunks_vdb"):
+        storage = getattr(rag, name, None)
+        nano = getattr(getattr(storage, "_client", None), "_NanoVectorDB__storage", None)
+        if nano is not None and not isinstance(nano["matrix"], np.memmap):
+            total += nano["matrix"].nbytes
+        codec = getattr(storage, "_codec", None)
+        if codec is not None:
+            total += codec.nbytes
+        index = getattr(storage, "_index", None)
+        if index is not None:
+            total += index.centroids.nbytes + index.order.nbytes + index.offsets.nbytes
+    graph = getattr(rag, "chunk_entity_relation_graph", None)
+    patterns = ["kv_store_*.json"]
+    if hasattr(graph, "nbytes"):
+        # CSRGraphStorage: arrays plus the node and edge attributes, networkx was dropped after loading.
+        total += graph.nbytes
+        patterns.append("*.csr.json")
+    else:
+        patterns.append("*.graphml")
+    working_dir = Path(rag.working_dir)
+    for pattern in patterns:
+        total += sum(path.stat().st_size for path in working_dir.glob(pattern))
+    return total
+
+
+class LoadedKG:
+    """A loaded base_entry of a KG version together with the number of queries currently running against it."""
+
+    def __init__(self, version: str | None, base_entry: str, rag, load_seconds: float, resident_bytes: int):
+        self.version = version
+        self.base_entry = base_entry
+        self.rag = rag
+        self.load_seconds = load_seconds
+        self.resident_bytes = resident_bytes
+        self.in_flight = 0
+        self.queries = 0
+        self.last_used = time.time()
+        self.retired = False
+
+    def stats(self) -> dict:
+        return {
+            "version": self.version,
+            "base_entry": self.base_entry,
+            "load_seconds": self.load_seconds,
+            "resident_bytes": self.resident_bytes,
+            "in_flight": self.in_flight,
+            "queries": self.queries,
+            "last_used": self.last_used,
+        }
+
+
+class KGRegistry:
+    """
+    LightRAG instances of the served KG version, one per base_entry, loaded on first use. Once the loaded KGs
+    exceed memory_budget bytes, the least-recently-used ones without running queries are unloaded.
+    A new version retires every loaded KG of the previous one: running queries finish on it, and the previous version
+    is handed to on_version_released once none of its KGs is pinned any more and no load from it is in progress.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[Path], object],
+        kg_dir: Callable[[str | None], Path],
+        version: str | None,
+        memory_budget: int = 0,
+        on_version_released: Callable[[str | None], None] = None,
+    ):
+        self._load = load
+        self._kg_dir = kg_dir
+        self.version = version
+        self.memory_budget = memory_budget
+        self._on_version_released = on_version_released
+        self._lock = threading.Lock()
+        # One lock per (version, base_entry), so concurrent first queries load a KG once.
+        self._load_locks: dict[tuple, threading.Lock] = {}
+        # (version, base_entry) -> LoadedKG, least recently used first
+        self._loaded: OrderedDict[tuple, LoadedKG] = OrderedDict()
+        self._retired: list[LoadedKG] = []
+        self._retired_versions: list = []
+        # version -> number of loads reading its directory right now, they pin the version like running queries.
+        self._loading: dict = {}
+        self.loads = 0
+        self.evictions = 0
+        self.total_load_seconds = 0.0
+
+    def working_dir(self, base_entry: str, version: str | None = None) -> Path:
+        if not valid_base_entry(base_entry):
+            raise KGNotFound(f"Invalid base_entry {base_entry!r}")
+        path = self._kg_dir(self.version if version is None else version) / base_entry
+        if not path.is_dir():
+            raise KGNotFound(f"No KG for base_entry {base_entry!r}")
+        return path
+
+    def _pin_loaded(self, key: tuple) -> LoadedKG | None:
+        """Pin the loaded KG under key, if any. Caller holds the lock."""
+        entry = self._loaded.get(key)
+        if entry is not None:
+            self._loaded.move_to_end(key)
+            entry.in_flight += 1
+            entry.queries += 1
+            entry.last_used = time.time()
+        return entry
+
+    def try_pin(self, base_entry: str) -> LoadedKG | None:
+        """pin without loading: None when base_entry is not loaded in the served version, never blocks on a load."""
+        with self._lock:
+            return self._pin_loaded((self.version, base_entry))
+
+    def pin(self, base_entry: str) -> LoadedKG:
+        """The loaded KG of base_entry in the served version, loading it first if needed. Pair with unpin."""
+        while True:
+            with self._lock:
+                version = self.version
+                key = (version, base_entry)
+                entry = self._pin_loaded(key)
+                if entry is not None:
+                    return entry
+                load_lock = self._load_locks.setdefault(key, threading.Lock())
+            with load_lock:
+                with self._lock:
+                    if key in self._loaded or version != self.version:
+                        # Loaded by a concurrent query meanwhile, or a new version got published: look up again.
+                        continue
+                    self._loading[version] = self._loading.get(version, 0) + 1
+                self._load_entry(version, base_entry)
+
+    def _load_entry(self, version: str | None, base_entry: str):
+        """Load base_entry of version, which the caller registered in _loading; unregisters it when done."""
+        entry = None
+        try:
+            working_dir = self.working_dir(base_entry, version)
+            start = time.perf_counter()
+            rag = self._load(working_dir)
+            load_seconds = time.perf_counter() - start
+            entry = LoadedKG(version, base_entry, rag, load_seconds, resident_bytes(rag))
+            logging.info(
+                f"Loaded KG {base_entry} of version {version} in {load_seconds:.2f}s, ~{entry.resident_bytes} bytes"
+            )
+        finally:
+            evicted = []
+            with self._lock:
+                self._loading[version] -= 1
+                if not self._loading[version]:
+                    del self._loading[version]
+                self._load_locks.pop((version, base_entry), None)
+                if entry is not None:
+                    self.loads += 1
+                    self.total_load_seconds += entry.load_seconds
+                    # Published over while loading: the entry is dropped, the next pin loads the new version.
+                    if version == self.version:
+                        self._loaded[(version, base_entry)] = entry
+                        evicted = self._evict()
+                # A version retired while this load read its directory can go now.
+                released = self._release_retired()
+            for old in evicted:
+                self._unload(old)
+            for released_version in released:
+                self._version_released(released_version)
+
+    def _evict(self) -> list[LoadedKG]:
+        """Pop least-recently-used idle KGs until the loaded ones fit the budget. Caller holds the lock."""
+        evicted = []
+        if self.memory_budget <= 0:
+            return evicted
+        resident = sum(entry.resident_bytes for entry in self._loaded.values())
+        # The most recently used KG stays, even when it alone exceeds the budget.
+        for key in list(self._loaded)[:-1]:
+            if resident <= self.memory_budget:
+                break
+            entry = self._loaded[key]
+            if entry.in_flight:
+                continue
+            del self._loaded[key]
+            resident -= entry.resident_bytes
+            self.evictions += 1
+            evicted.append(entry)
+        return evicted
+
+    def unpin(self, entry: LoadedKG):
+        with self._lock:
+            entry.in_flight -= 1
+            released = self._release_retired()
+            # KGs skipped by the last eviction because they were busy may be unloadable now.
+            evicted = self._evict() if not entry.retired else []
+        for old in evicted:
+            self._unload(old)
+        for version in released:
+            self._version_released(version)
+
+    def publish(self, version: str | None, preload: list[str] = None):
+        """
+        Switch new queries over to version. The base_entries given in preload (by default those loaded now) are loaded
+        from the new version first, so the hot KGs do not pay their load time on a query after the switch.
+        """
+        with self._lock:
+            if preload is None:
+                preload = [base_entry for _, base_entry in self._loaded]
+        preloaded = []
+        for base_entry in preload:
+            try:
+                working_dir = self.working_dir(base_entry, version)
+            except KGNotFound:
+                continue
+            start = time.perf_counter()
+            rag = self._load(working_dir)
+            load_seconds = time.perf_counter() - start
+            preloaded.append(LoadedKG(version, base_entry, rag, load_seconds, resident_bytes(rag)))
+        with self._lock:
+            if version != self.version:
+                self._retired_versions.append(self.version)
+            self.version = version
+            for entry in self._loaded.values():
+                entry.retired = True
+                self._retired.append(entry)
+            self._loaded = OrderedDict(((version, entry.base_entry), entry) for entry in preloaded)
+            self.loads += len(preloaded)
+            self.total_load_seconds += sum(entry.load_seconds for entry in preloaded)
+            evicted = self._evict()
+            released = self._release_retired()
+        for old in evicted:
+            self._unload(old)
+        for version in released:
+            self._version_released(version)
+
+    def _release_retired(self) -> list:
+        """
+        Drop retired KGs without running queries, and return the retired versions none of whose KGs is pinned any more
+        and that no load is reading. Caller holds the lock.
+        """
+        for entry in self._retired:
+            if entry.in_flight == 0:
+                logging.info(f"Releasing KG {entry.base_entry} of version {entry.version}")
+                entry.rag = None
+        self._retired = [entry for entry in self._retired if entry.in_flight]
+        pinned = {entry.version for entry in self._retired} | set(self._loading)
+        released = [version for version in self._retired_versions if version not in pinned]
+        self._retired_versions = [version for version in self._retired_versions if version in pinned]
+        return released
+
+    def _unload(self, entry: LoadedKG):
+        logging.info(f"Unloading least-recently-used KG {entry.base_entry} of version {entry.version}")
+        entry.rag = None
+
+    def _version_released(self, version: str | None):
+        if self._on_version_released is not None:
+            self._on_version_released(version)
+
+    def stats(self) -> dict:
+        with self._lock:
+            loaded = [entry.stats() for entry in reversed(self._loaded.values())]
+            retired = len(self._retired)
+        return {
+            "version": self.version,
+            "memory_budget_bytes": self.memory_budget,
+            "resident_bytes": sum(entry["resident_bytes"] for entry in loaded),
+            "loads": self.loads,
+            "evictions": self.evictions,
+            "total_load_seconds": self.total_load_seconds,
+            "retired_in_flight": retired,
+            "loaded": loaded,
+        }
@@ -0,0 +1,39 @@
+import os
+import shutil
+from datetime import datetime
+from pathlib import Path
+
+from constant import ROOT
+
+# Versioned KG layout: every genKG run is published as KG_versions/<version>/<base_entry>,
+# and the KG_CURRENT pointer file names the version being served.
+KG_VERSIONS_DIR = ROOT / "KG_versions"
+KG_POINTER = ROOT / "KG_CURRENT"
+# Layout used before versioning, served until the first version is published.
+LEGACY_KG_DIR = ROOT / "KG"
+
+
+def current_version() -> str | None:
+    if not KG_POINTER.exists():
+        return None
+    version = KG_POINTER.read_text(encoding="utf-8").strip()
+    return version or None
+
+
+def kg_dir(version: str | None) -> Path:
+    return LEGACY_KG_DIR if version is None else KG_VERSIONS_DIR / version
+
+
+def current_kg_dir() -> Path:
+    return kg_dir(current_version())
+
+
+def publish_kg_version(new_kg_dir: Path) -> str:
+    """Move a freshly built KG into its own version directory and atomically switch the pointer to it."""
+    version = datetime.now().strftime("%Y%m%d%H%M%S%f")
+    KG_VERSIONS_DIR.mkdir(parents=True, exist_ok=True)
+    shutil.move(str(new_kg_dir), str(KG_VERSIONS_DIR / version))
+    tmp_pointer = KG_POINTER.with_suffix(".tmp")
+    tmp_pointer.write_text(version, encoding="utf-8")
+    os.replace(tmp_pointer, KG_POINTER)
+    return version
@@ -0,0 +1,133 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from constant import ROOT
+
+LLM_CACHE_PATH = ROOT / "llm_cache" / "llm_response_cache.sqlite"
+
+
+def llm_cache_enabled() -> bool:
+    return os.getenv("llm_cache", "off").lower() == "on"
+
+
+def compute_cache_key(model: str, payload: dict) -> str:
+    """Hash of the model plus everything in the payload that changes the completion: messages, temperature, top_p, n."""
+    key_data = {
+        "model": model,
+        "messages": payload.get("messages"),
+        "temperature": payload.get("temperature"),
+        "top_p": payload.get("top_p"),
+        "n": payload.get("n"),
+    }
+    return hashlib.sha256(
+        json.dumps(key_data, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    ).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    Durable, size-bounded LLM response cache in SQLite.
+    Entries are evicted least-recently-used first once the stored responses exceed max_bytes.
+    Every call blocks on SQLite, async callers run them through asyncio.to_thread.
+    """
+
+    def __init__(self, db_path: str | Path = LLM_CACHE_PATH, max_bytes: int = 1024 * 1024 * 1024):
+        self.db_path = Path(db_path)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._connection() as conn:
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    content TEXT NOT NULL,
+                    prompt_tokens INTEGER,
+                    completion_tokens INTEGER,
+                    size INTEGER NOT NULL,
+                    last_access REAL NOT NULL
+                )
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache(last_access)")
+
+    @contextmanager
+    def _connection(self):
+        """A connection committed on success, rolled back on error, and closed in both cases."""
+        # Phase 2 worker processes share the file, so wait on locks instead of failing.
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key: str) -> dict | None:
+        with self._lock, self._connection() as conn:
+            row = conn.execute(
+                "SELECT content, prompt_tokens, completion_tokens FROM llm_cache WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+            return {"content": row[0], "prompt_tokens": row[1], "completion_tokens": row[2]}
+
+    def put(self, key: str, content: str, prompt_tokens: int = None, completion_tokens: int = None):
+        size = len(content.encode("utf-8"))
+        with self._lock, self._connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?)",
+                (key, content, prompt_tokens, completion_tokens, size, time.time()),
+            )
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        while total > self.max_bytes:
+            rows = conn.execute("SELECT key, size FROM llm_cache ORDER BY last_access LIMIT 64").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                total -= size
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._connection() as conn:
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "size_bytes": size,
+            "max_bytes": self.max_bytes,
+        }
+
+
+_llm_cache: LLMResponseCache | None = None
+
+
+def get_llm_cache() -> LLMResponseCache:
+    global _llm_cache
+    if _llm_cache is None:
+        _llm_cache = LLMResponseCache(max_bytes=int(os.getenv("llm_cache_max_mb", "1024")) * 1024 * 1024)
+    return _llm_cache
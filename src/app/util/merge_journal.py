@@ -0,0 +1,128 @@
+import json
+import os
+import pickle
+from pathlib import Path
+
+# Per base_entry write-ahead journal of Phase 2: which subgraph files have been applied,
+# which checkpoints were flushed and how far the final stages (graph, vector DBs) got.
+JOURNAL_FILE = "merge_journal.jsonl"
+STATE_FILE = "merge_state.{seq}.pkl"
+
+
+def checkpoint_interval() -> int:
+    return int(os.getenv("phase2_checkpoint_every", "0"))
+
+
+def journal_enabled() -> bool:
+    return checkpoint_interval() > 0
+
+
+def vdb_batch_size() -> int:
+    return max(1, int(os.getenv("phase2_checkpoint_vdb_batch", "2048")))
+
+
+def clear(working_dir: str | Path):
+    working_dir = Path(working_dir)
+    for path in [working_dir / JOURNAL_FILE, *working_dir.glob(STATE_FILE.format(seq="*"))]:
+        path.unlink(missing_ok=True)
+
+
+class MergeJournal:
+    """
+    Events are appended one JSON line at a time and fsynced, the first line is the header the run was started with.
+    A checkpoint line is only written after the storages were flushed and the in-memory merge state was pickled,
+    so on resume the storages on disk match the state of the last checkpoint; subgraph files applied after it are
+    merged again.
+    """
+
+    def __init__(self, working_dir: str | Path, header: dict):
+        self.working_dir = Path(working_dir)
+        self.path = self.working_dir / JOURNAL_FILE
+        self.header = header
+        self.checkpoint_event: dict | None = None
+        self.vdb_done: dict[str, int] = {}
+        self.done = False
+
+    @classmethod
+    def start(cls, working_dir: str | Path, header: dict) -> "MergeJournal":
+        journal = cls(working_dir, header)
+        clear(working_dir)
+        journal.log("start", **header)
+        return journal
+
+    @classmethod
+    def resume(cls, working_dir: str | Path, header: dict) -> "MergeJournal | None":
+        """The journal of an interrupted run with the same header, None when there is no checkpoint to resume from."""
+        journal = cls(working_dir, header)
+        if not journal.path.exists():
+            return None
+        with open(journal.path, "rb") as file:
+            lines = file.readlines()
+        events = []
+        valid_bytes = 0
+        for line in lines:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                break
+            valid_bytes += len(line)
+        if valid_bytes < journal.path.stat().st_size:
+            # Cut off a torn last line from a crash mid-append, so new events start on a line of their own.
+            with open(journal.path, "r+b") as file:
+                file.truncate(valid_bytes)
+        if not events or events[0].get("event") != "start":
+            return None
+        if {k: v for k, v in events[0].items() if k != "event"} != header:
+            return None
+        for event in events[1:]:
+            if event["event"] == "checkpoint":
+                journal.checkpoint_event = event
+            elif event["event"] == "vdb":
+                journal.vdb_done[event["name"]] = event["done"]
+            elif event["event"] == "done":
+                journal.done = True
+        if journal.checkpoint_event is None and not journal.done:
+            return None
+        return journal
+
+    def log(self, event: str, **fields):
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(json.dumps({"event": event, **fields}, ensure_ascii=False) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+
+    @property
+    def applied(self) -> int:
+        return self.checkpoint_event["applied"] if self.checkpoint_event else 0
+
+    @property
+    def stage(self) -> str | None:
+        return self.checkpoint_event["stage"] if self.checkpoint_event else None
+
+    def checkpoint(self, state: dict, applied: int, stage: str):
+        """Pickle the merge state, then record the checkpoint. Call only after the storages were flushed."""
+        seq = self.checkpoint_event["seq"] + 1 if self.checkpoint_event else 0
+        state_path = self.working_dir / STATE_FILE.format(seq=seq)
+        tmp_path = state_path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as file:
+            pickle.dump(state, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, state_path)
+        event = {"event": "checkpoint", "seq": seq, "applied": applied, "stage": stage}
+        self.log(**event)
+        if self.checkpoint_event:
+            (self.working_dir / STATE_FILE.format(seq=self.checkpoint_event["seq"])).unlink(missing_ok=True)
+        self.checkpoint_event = event
+
+    def load_state(self) -> dict | None:
+        if self.checkpoint_event is None:
+            return None
+        with open(self.working_dir / STATE_FILE.format(seq=self.checkpoint_event["seq"]), "rb") as file:
+            return pickle.load(file)
+
+    def finish(self):
+        self.log("done")
+        self.done = True
+        for path in self.working_dir.glob(STATE_FILE.format(seq="*")):
+            path.unlink(missing_ok=True)
@@ -0,0 +1,217 @@
+import asyncio
+import os
+import random
+import time
+import weakref
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable
+
+import httpx
+from aiolimiter import AsyncLimiter
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+_encoding = None
+
+
+def scheduler_enabled() -> bool:
+    return os.getenv("llm_scheduler", "off").lower() == "on"
+
+
+def count_tokens(text: str) -> int:
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding(os.getenv("tiktoken_encoding", "cl100k_base"))
+        except Exception:
+            # No BPE file available (e.g. offline): fall back to the ~4 characters per token rule.
+            _encoding = False
+    if _encoding is False:
+        return len(text) // 4 + 1
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def estimate_chat_tokens(messages: list[dict], max_completion_tokens: int = None) -> int:
+    """Prompt tokens of the chat messages plus the completion tokens the provider reserves against the TPM quota."""
+    prompt_tokens = sum(count_tokens(str(m.get("content", ""))) + 4 for m in messages) + 3
+    if max_completion_tokens is None:
+        max_completion_tokens = int(os.getenv("llm_tpm_completion_reserve", "256"))
+    return prompt_tokens + max_completion_tokens
+
+
+def retry_after_seconds(response: httpx.Response) -> float | None:
+    retry_after_ms = response.headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = response.headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return float(retry_after)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveConcurrency:
+    """AIMD concurrency limit: halved on every throttled response, raised by one after increase_after successes."""
+
+    def __init__(self, max_limit: int, increase_after: int = 20):
+        self.max_limit = max_limit
+        self.limit = max_limit
+        self.active = 0
+        self.increase_after = increase_after
+        self._successes = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+
+    async def __aexit__(self, *exc):
+        async with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    def on_throttled(self):
+        self.limit = max(1, self.limit // 2)
+        self._successes = 0
+
+    def on_success(self):
+        self._successes += 1
+        if self._successes >= self.increase_after and self.limit < self.max_limit:
+            self.limit += 1
+            self._successes = 0
+
+
+class RequestScheduler:
+    """
+    Client-side scheduler for one deployment: requests-per-minute and tokens-per-minute buckets, an adaptive
+    concurrency limit, and retries of 429/5xx responses and transport errors. Retry-After pauses every sender of this
+    scheduler, not only the throttled one; without it the retry waits an exponential backoff with full jitter.
+    """
+
+    def __init__(
+        self,
+        rpm: int = 0,
+        tpm: int = 0,
+        max_concurrency: int = 16,
+        max_retries: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+    ):
+        self.rpm = AsyncLimiter(rpm, 60) if rpm > 0 else None
+        self.tpm = AsyncLimiter(tpm, 60) if tpm > 0 else None
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._paused_until = 0.0
+        self.stats = {
+            "requests": 0,
+            "retries": 0,
+            "throttled": 0,
+            "server_errors": 0,
+            "transport_errors": 0,
+            "wait_seconds": 0.0,
+        }
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+
+    async def _wait_for_quota(self, tokens: int):
+        start = time.monotonic()
+        pause = self._paused_until - start
+        if pause > 0:
+            await asyncio.sleep(pause)
+        if self.rpm is not None:
+            await self.rpm.acquire()
+        if self.tpm is not None:
+            # A single request larger than the bucket would never be admitted, cap it at a full minute of quota.
+            await self.tpm.acquire(min(tokens, self.tpm.max_rate))
+        self.stats["wait_seconds"] += time.monotonic() - start
+
+    async def request(self, send: Callable[[], Awaitable[httpx.Response]], tokens: int = 0) -> httpx.Response:
+        """
+        Send through the buckets, retrying transient failures. After the last retry the final response is returned
+        as is (or the transport error raised), so callers keep their own error handling.
+        """
+        for attempt in range(self.max_retries + 1):
+            last_attempt = attempt == self.max_retries
+            async with self.concurrency:
+                await self._wait_for_quota(tokens)
+                self.stats["requests"] += 1
+                try:
+                    response = await send()
+                except httpx.TransportError:
+                    self.stats["transport_errors"] += 1
+                    if last_attempt:
+                        raise
+                    response = None
+            if response is not None and response.status_code not in RETRY_STATUS:
+                self.concurrency.on_success()
+                return response
+            if response is not None and response.status_code == 429:
+                self.stats["throttled"] += 1
+                self.concurrency.on_throttled()
+            elif response is not None:
+                self.stats["server_errors"] += 1
+            if last_attempt:
+                return response
+            delay = retry_after_seconds(response) if response is not None else None
+            if response is not None:
+                # Release the connection of a streamed response that is not going to be read.
+                await response.aclose()
+            if delay is not None:
+                # Jitter spreads the senders released by the same Retry-After.
+                delay += random.uniform(0, self.base_delay)
+                self._paused_until = max(self._paused_until, time.monotonic() + delay)
+            else:
+                delay = self._backoff(attempt)
+            self.stats["retries"] += 1
+            await asyncio.sleep(delay)
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "concurrency_limit": self.concurrency.limit, "active": self.concurrency.active}
+
+
+# Buckets and the concurrency limit use loop-bound primitives: one scheduler per (event loop, deployment kind).
+# Phase 2 worker processes each get their own buckets, so size llm_rpm/llm_tpm per process.
+_schedulers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, RequestScheduler]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def get_scheduler(kind: str = "llm") -> RequestScheduler:
+    """kind: llm | embedding, each with its own <kind>_rpm / <kind>_tpm quota."""
+    schedulers = _schedulers.setdefault(asyncio.get_running_loop(), {})
+    if kind not in schedulers:
+        schedulers[kind] = RequestScheduler(
+            rpm=int(os.getenv(f"{kind}_rpm", "0")),
+            tpm=int(os.getenv(f"{kind}_tpm", "0")),
+            max_concurrency=int(os.getenv(f"{kind}_max_concurrency", "16")),
+            max_retries=int(os.getenv("llm_max_retries", "6")),
+            base_delay=float(os.getenv("llm_retry_base_seconds", "1")),
+            max_delay=float(os.getenv("llm_retry_max_seconds", "60")),
+        )
+    return schedulers[kind]
+
+
+def scheduler_stats() -> dict:
+    totals: dict = {}
+    for schedulers in list(_schedulers.values()):
+        for kind, scheduler in schedulers.items():
+            kind_totals = totals.setdefault(kind, {})
+            for name, value in scheduler.snapshot().items():
+                kind_totals[name] = kind_totals.get(name, 0) + value
+    return totals
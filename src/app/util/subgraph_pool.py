@@ -0,0 +1,126 @@
+import json
+import os
+import shutil
+from collections.abc import Mapping
+from pathlib import Path
+from typing import Iterator
+
+import pyarrow as pa
+
+from constant import ROOT
+
+JSON_POOL_DIR = ROOT / "json_dir"
+# Arrow pool: one directory per subgraph holding chunks.arrow, entities.arrow and relationships.arrow (Arrow IPC files).
+ARROW_POOL_DIR = ROOT / "arrow_dir"
+TABLES = ("chunks", "entities", "relationships")
+BATCH_SIZE = 1024
+# Defaults ainsert_custom_kg applies to fields a JSON record leaves out. An Arrow table has one column per field
+# across all records and stores null where a record lacks it, so these are filled in before writing.
+RECORD_DEFAULTS = {
+    "chunks": {"chunk_order_index": 0},
+    "entities": {"entity_type": "UNKNOWN", "description": "No description provided", "source_id": "UNKNOWN"},
+    "relationships": {"weight": 1.0, "source_id": "UNKNOWN"},
+}
+
+
+def pool_format() -> str:
+    """json | arrow"""
+    return os.getenv("subgraph_pool_format", "json").lower()
+
+
+def subgraph_path(md5: str, fmt: str = None) -> Path:
+    """Location of a subgraph in the pool, falling back to the other format when it only exists there."""
+    fmt = fmt or pool_format()
+    paths = {"json": JSON_POOL_DIR / f"{md5}.json", "arrow": ARROW_POOL_DIR / md5}
+    path = paths[fmt]
+    if not path.exists():
+        other = paths["json" if fmt == "arrow" else "arrow"]
+        if other.exists():
+            return other
+    return path
+
+
+def _doc_fields(s_doc: dict) -> dict:
+    return {k: v for k, v in s_doc.items() if k not in TABLES}
+
+
+def write_subgraph(s_doc: dict, fmt: str = None) -> str:
+    """Write a subgraph pool record and return its file name (the doc md5)."""
+    fmt = fmt or pool_format()
+    file_name = s_doc.get("source_id")[4:]
+    if fmt == "arrow":
+        write_arrow_subgraph(s_doc, ARROW_POOL_DIR / file_name)
+    else:
+        JSON_POOL_DIR.mkdir(parents=True, exist_ok=True)
+        with open(JSON_POOL_DIR / f"{file_name}.json", "w", encoding="utf-8") as file:
+            json.dump(s_doc, file, indent=4, ensure_ascii=False)
+    return file_name
+
+
+def write_arrow_subgraph(s_doc: dict, target_dir: Path):
+    tmp_dir = target_dir.with_name(target_dir.name + ".tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+    metadata = {b"doc": json.dumps(_doc_fields(s_doc), ensure_ascii=False).encode("utf-8")}
+    for table_name in TABLES:
+        records = s_doc.get(table_name, [])
+        if any(field not in record for record in records for field in RECORD_DEFAULTS[table_name]):
+            records = [{**RECORD_DEFAULTS[table_name], **record} for record in records]
+        table = pa.Table.from_pylist(records)
+        table = table.replace_schema_metadata(metadata)
+        with pa.OSFile(str(tmp_dir / f"{table_name}.arrow"), "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table, max_chunksize=BATCH_SIZE)
+    shutil.rmtree(target_dir, ignore_errors=True)
+    os.replace(tmp_dir, target_dir)
+
+
+class ArrowSubgraph(Mapping):
+    """
+    Read-only, memory-mapped view of an Arrow subgraph.
+    chunks/entities/relationships are produced lazily one record batch at a time,
+    every other key is a document level field.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        with pa.memory_map(str(self.path / "chunks.arrow"), "r") as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+        self._doc = json.loads(metadata.get(b"doc", b"{}"))
+
+    def iter_table(self, table_name: str) -> Iterator[dict]:
+        with pa.memory_map(str(self.path / f"{table_name}.arrow"), "r") as source:
+            reader = pa.ipc.open_file(source)
+            for i in range(reader.num_record_batches):
+                yield from reader.get_batch(i).to_pylist()
+
+    def __getitem__(self, key):
+        if key in TABLES:
+            return self.iter_table(key)
+        return self._doc[key]
+
+    def __iter__(self):
+        yield from self._doc
+        yield from TABLES
+
+    def __len__(self):
+        return len(self._doc) + len(TABLES)
+
+
+def read_subgraph(path: str | Path) -> Mapping:
+    path = Path(path)
+    if path.is_dir():
+        return ArrowSubgraph(path)
+    with open(path, "r", encoding="utf-8") as file:
+        return json.load(file)
+
+
+def convert_json_pool(json_dir: Path = JSON_POOL_DIR, arrow_dir: Path = ARROW_POOL_DIR) -> int:
+    """Convert every <md5>.json subgraph in json_dir into the Arrow pool layout, return the number converted."""
+    count = 0
+    for json_file in sorted(Path(json_dir).glob("*.json")):
+        with open(json_file, "r", encoding="utf-8") as file:
+            s_doc = json.load(file)
+        write_arrow_subgraph(s_doc, Path(arrow_dir) / json_file.stem)
+        count += 1
+    return count
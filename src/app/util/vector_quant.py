@@ -0,0 +1,193 @@
+import os
+from pathlib import Path
+
+import numpy as np
+
+PRECISIONS = ("float32", "float16", "int8", "pq")
+# Rows decoded and scored per block, so scoring never materialises a full float32 copy of the codes.
+SCORE_BLOCK = 65536
+
+
+def vector_precision() -> str:
+    precision = os.getenv("vector_precision", "float32").lower()
+    if precision not in PRECISIONS:
+        raise ValueError(f"vector_precision must be one of {PRECISIONS}, got {precision}")
+    return precision
+
+
+def quantization_enabled() -> bool:
+    return vector_precision() != "float32"
+
+
+def rescore_factor() -> int:
+    """Candidates rescored against full precision per requested result (0 = no rescoring)."""
+    return int(os.getenv("vector_rescore_factor", "4"))
+
+
+def _blocks(rows: np.ndarray | None, num_rows: int):
+    if rows is None:
+        for start in range(0, num_rows, SCORE_BLOCK):
+            yield slice(start, min(start + SCORE_BLOCK, num_rows))
+    else:
+        for start in range(0, len(rows), SCORE_BLOCK):
+            yield rows[start : start + SCORE_BLOCK]
+
+
+class Float16Codec:
+    name = "float16"
+
+    def __init__(self, codes: np.ndarray):
+        self.codes = codes
+
+    @classmethod
+    def encode(cls, matrix: np.ndarray, **_) -> "Float16Codec":
+        return cls(np.asarray(matrix, dtype=np.float16))
+
+    def score(self, query: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+        return np.concatenate(
+            [self.codes[block].astype(np.float32) @ query for block in _blocks(rows, len(self.codes))]
+            or [np.empty(0, dtype=np.float32)]
+        )
+
+    def arrays(self) -> dict:
+        return {"codes": self.codes}
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes
+
+
+class Int8Codec:
+    """Symmetric scalar quantization with one scale per vector: v ~= codes * scale."""
+
+    name = "int8"
+
+    def __init__(self, codes: np.ndarray, scales: np.ndarray):
+        self.codes = codes
+        self.scales = scales
+
+    @classmethod
+    def encode(cls, matrix: np.ndarray, **_) -> "Int8Codec":
+        matrix = np.asarray(matrix, dtype=np.float32)
+        scales = np.abs(matrix).max(axis=1) / 127
+        scales[scales == 0] = 1
+        codes = np.clip(np.rint(matrix / scales[:, None]), -127, 127).astype(np.int8)
+        return cls(codes, scales.astype(np.float32))
+
+    def score(self, query: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+        return np.concatenate(
+            [
+                (self.codes[block].astype(np.float32) @ query) * self.scales[block]
+                for block in _blocks(rows, len(self.codes))
+            ]
+            or [np.empty(0, dtype=np.float32)]
+        )
+
+    def arrays(self) -> dict:
+        return {"codes": self.codes, "scales": self.scales}
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.scales.nbytes
+
+
+def _kmeans(data: np.ndarray, k: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    k = min(k, len(data))
+    centroids = data[rng.choice(len(data), k, replace=False)].copy()
+    for _ in range(iterations):
+        distances = (data**2).sum(1)[:, None] - 2 * data @ centroids.T + (centroids**2).sum(1)[None, :]
+        assignment = np.argmin(distances, axis=1)
+        counts = np.bincount(assignment, minlength=k)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, data)
+        non_empty = counts > 0
+        centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+    return centroids
+
+
+class PQCodec:
+    """
+    Product quantization: each vector is split into m sub-vectors, each stored as the uint8 id of its nearest of
+    256 sub-centroids. Inner products are computed from per-query lookup tables (asymmetric distance computation).
+    """
+
+    name = "pq"
+
+    def __init__(self, codebooks: np.ndarray, codes: np.ndarray):
+        # codebooks: (m, 256, sub_dim), codes: (n, m)
+        self.codebooks = codebooks
+        self.codes = codes
+
+    @classmethod
+    def encode(
+        cls, matrix: np.ndarray, subspaces: int = 96, iterations: int = 10, sample_size: int = 16384, seed: int = 0, **_
+    ) -> "PQCodec":
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if matrix.shape[1] % subspaces:
+            raise ValueError(f"Dimension {matrix.shape[1]} is not divisible into {subspaces} subspaces")
+        sub_dim = matrix.shape[1] // subspaces
+        rng = np.random.default_rng(seed)
+        sample = matrix[rng.choice(len(matrix), min(len(matrix), sample_size), replace=False)]
+        codebooks = np.zeros((subspaces, 256, sub_dim), dtype=np.float32)
+        codes = np.empty((len(matrix), subspaces), dtype=np.uint8)
+        for j in range(subspaces):
+            sub = slice(j * sub_dim, (j + 1) * sub_dim)
+            centroids = _kmeans(sample[:, sub], 256, iterations, rng)
+            codebooks[j, : len(centroids)] = centroids
+            for block in _blocks(None, len(matrix)):
+                vectors = matrix[block, sub]
+                distances = -2 * vectors @ centroids.T + (centroids**2).sum(1)[None, :]
+                codes[block, j] = np.argmin(distances, axis=1)
+        return cls(codebooks, codes)
+
+    def score(self, query: np.ndarray, rows: np.ndarray = None) -> np.ndarray:
+        subspaces, _, sub_dim = self.codebooks.shape
+        # tables[j, c] = query sub-vector j . centroid c of subspace j
+        tables = np.einsum("jcd,jd->jc", self.codebooks, query.reshape(subspaces, sub_dim))
+        return np.concatenate(
+            [
+                tables[np.arange(subspaces), self.codes[block]].sum(axis=1)
+                for block in _blocks(rows, len(self.codes))
+            ]
+            or [np.empty(0, dtype=np.float32)]
+        )
+
+    def arrays(self) -> dict:
+        return {"codebooks": self.codebooks, "codes": self.codes}
+
+    @property
+    def nbytes(self) -> int:
+        return self.codebooks.nbytes + self.codes.nbytes
+
+
+CODECS = {codec.name: codec for codec in (Float16Codec, Int8Codec, PQCodec)}
+
+
+def encode(matrix: np.ndarray, precision: str):
+    return CODECS[precision].encode(matrix, subspaces=int(os.getenv("vector_pq_subspaces", "96")))
+
+
+def save_codec(codec, path: str | Path, fingerprint: str):
+    path = Path(path)
+    tmp_path = path.with_suffix(".tmp.npz")
+    np.savez(tmp_path, precision=np.array(codec.name), fingerprint=np.array(fingerprint), **codec.arrays())
+    os.replace(tmp_path, path)
+
+
+def load_codec(path: str | Path) -> tuple[object, str]:
+    with np.load(path) as data:
+        arrays = {key: data[key] for key in data.files if key not in ("precision", "fingerprint")}
+        return CODECS[str(data["precision"])](**arrays), str(data["fingerprint"])
+
+
+def save_full_precision(matrix: np.ndarray, path: str | Path):
+    path = Path(path)
+    tmp_path = path.with_suffix(".tmp")
+    np.ascontiguousarray(matrix, dtype=np.float32).tofile(tmp_path)
+    os.replace(tmp_path, path)
+
+
+def open_full_precision(path: str | Path, dim: int) -> np.memmap:
+    # Copy-on-write: a serving instance never writes back, later in-place upserts stay private to the process.
+    rows = Path(path).stat().st_size // (dim * 4)
+    return np.memmap(path, dtype=np.float32, mode="c", shape=(rows, dim))